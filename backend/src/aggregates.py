@@ -0,0 +1,256 @@
+# src/aggregates.py
+import os
+import json
+import math
+import threading
+from sketches import RecordingSketches, merge_sketches
+from manifest import is_path_id, path_id
+
+# per-recording values tracked over time and summarized per cohort group
+TREND_METRICS = ('cadence_spm', 'mean_step_time_s', 'knee_rom_deg', 'peak_knee_angle_deg',
+                 'mean_knee_angle_deg', 'freezing_fraction', 'detected_steps')
+
+# same buckets as the admin StatsPanel
+AGE_BUCKETS = ('<30', '30-50', '>50')
+
+def age_bucket(age):
+    try:
+        age = float(age)
+    except (TypeError, ValueError):
+        return 'unknown'
+    if age < 30:
+        return '<30'
+    return '30-50' if age <= 50 else '>50'
+
+def patient_group(patient):
+    return patient.get('status') or 'unknown', age_bucket(patient.get('age'))
+
+def _finite(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v)
+
+def knee_rom(metrics):
+    """Knee range of motion (deg): range of the mean gait-cycle curve, else of all angles."""
+    curve = [v for v in (metrics.get('gait_cycles') or {}).get('mean_curve_deg') or [] if _finite(v)]
+    if not curve:
+        curve = [v for v in metrics.get('angles') or [] if _finite(v)]
+    return max(curve) - min(curve) if curve else None
+
+def recording_point(rec):
+    """One trend point from a stored recording (metric values None when unavailable)."""
+    m = rec.get('metrics') or {}
+    values = {
+        'cadence_spm': m.get('cadence_spm'),
+        'mean_step_time_s': m.get('mean_step_time_s'),
+        'knee_rom_deg': knee_rom(m),
+        'peak_knee_angle_deg': m.get('peak_knee_angle_deg'),
+        'mean_knee_angle_deg': m.get('mean_knee_angle_deg'),
+        'freezing_fraction': (m.get('spectral') or {}).get('freezing_fraction'),
+        'detected_steps': m.get('detected_steps'),
+    }
+    point = {'recording_id': rec.get('id'), 'timestamp': rec.get('timestamp'), 'date': rec.get('date')}
+    point.update({k: (v if _finite(v) else None) for k, v in values.items()})
+    point['sketches'] = m.get('sketches')
+    return point
+
+def _empty_sums():
+    return {k: [0, 0.0, 0.0] for k in TREND_METRICS}  # n, sum, sum of squares
+
+def _add_point(sums, point, sign=1):
+    for k in TREND_METRICS:
+        v = point.get(k)
+        if v is not None:
+            s = sums[k]
+            s[0] += sign
+            s[1] += sign * v
+            s[2] += sign * v * v
+
+def _add_sketch(group, sketch, sign=1):
+    # group['sketch']: merged RecordingSketches.to_dict() of its recordings
+    if not sketch:
+        return
+    merged = RecordingSketches.from_dict(group['sketch']) if group.get('sketch') else RecordingSketches()
+    other = sketch if isinstance(sketch, RecordingSketches) else RecordingSketches.from_dict(sketch)
+    group['sketch'] = (merged.merge(other) if sign > 0 else merged.subtract(other)).to_dict()
+
+class Aggregates:
+    """
+    Incrementally maintained patient statistics.
+    - cohort.json: patient/recording counts and per-metric (n, sum, sumsq)
+      for every (status, age bucket) group, plus each patient's group
+    - trends/<patient_id>.jsonl: one trend point per recording, appended
+    - per group and per trend point, the knee / accel angle and gyro norm sketches
+      (sketches.py), merged and subtracted like the sums
+    Every update touches only the affected group(s) and one trend file, so
+    reads never scan patients or recordings. rebuild() recreates the state
+    from the JSON stores (first start, or after external edits).
+    """
+    def __init__(self, data_dir):
+        self.cohort_path = os.path.join(data_dir, 'cohort.json')
+        self.trend_dir = os.path.join(data_dir, 'trends')
+        os.makedirs(self.trend_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.state = None
+        if os.path.exists(self.cohort_path):
+            with open(self.cohort_path) as f:
+                self.state = json.load(f)
+
+    @property
+    def ready(self):
+        return self.state is not None
+
+    def _save(self):
+        tmp = self.cohort_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.cohort_path)
+
+    def _trend_path(self, pid):
+        return os.path.join(self.trend_dir, f"{path_id(pid)}.jsonl")
+
+    def _group(self, key):
+        groups = self.state['groups']
+        if key not in groups:
+            status, bucket = key.split('|', 1)
+            groups[key] = {'status': status, 'age_bucket': bucket, 'n_patients': 0,
+                           'n_recordings': 0, 'sums': _empty_sums()}
+        return groups[key]
+
+    def _points(self, pid):
+        if not is_path_id(pid):
+            return []  # never stored
+        path = self._trend_path(pid)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _patient_sums(self, pid):
+        sums = _empty_sums()
+        points = self._points(pid)
+        for p in points:
+            _add_point(sums, p)
+        return sums, len(points), merge_sketches(p.get('sketches') for p in points)
+
+    def _move(self, pid, old_key, new_key):
+        # move one patient's contribution between groups
+        sums, n_rec, sketch = self._patient_sums(pid)
+        for key, sign in ((old_key, -1), (new_key, 1)):
+            if key is None:
+                continue
+            g = self._group(key)
+            g['n_patients'] += sign
+            g['n_recordings'] += sign * n_rec
+            for k in TREND_METRICS:
+                for i in range(3):
+                    g['sums'][k][i] += sign * sums[k][i]
+            _add_sketch(g, sketch, sign)
+
+    def rebuild(self, patients, recordings):
+        with self._lock:
+            self.state = {'patients': {}, 'groups': {}}
+            by_patient = {}
+            for r in recordings:
+                by_patient.setdefault(r.get('patient_id'), []).append(r)
+            for p in patients:
+                if not is_path_id(p.get('id')):
+                    print(f"Aggregates: skipping patient with unsafe ID {p.get('id')!r}")
+                    continue
+                key = '|'.join(patient_group(p))
+                self.state['patients'][p['id']] = key
+                g = self._group(key)
+                g['n_patients'] += 1
+                recs = sorted(by_patient.get(p['id'], []), key=lambda r: r.get('timestamp') or 0)
+                with open(self._trend_path(p['id']), 'w') as f:
+                    points = [recording_point(r) for r in recs]
+                    for point in points:
+                        f.write(json.dumps(point) + "\n")
+                        _add_point(g['sums'], point)
+                _add_sketch(g, merge_sketches(point['sketches'] for point in points))
+                g['n_recordings'] += len(recs)
+            self._save()
+
+    def patient_added(self, patient):
+        with self._lock:
+            key = '|'.join(patient_group(patient))
+            self.state['patients'][patient['id']] = key
+            self._group(key)['n_patients'] += 1
+            self._save()
+
+    def patient_updated(self, patient):
+        with self._lock:
+            old = self.state['patients'].get(patient['id'])
+            key = '|'.join(patient_group(patient))
+            if old == key:
+                return
+            self._move(patient['id'], old, key)
+            self.state['patients'][patient['id']] = key
+            self._save()
+
+    def patient_removed(self, pid):
+        with self._lock:
+            old = self.state['patients'].pop(pid, None)
+            if old is None:
+                return
+            self._move(pid, old, None)
+            if os.path.exists(self._trend_path(pid)):
+                os.remove(self._trend_path(pid))
+            self._save()
+
+    def recording_added(self, rec):
+        with self._lock:
+            pid = rec.get('patient_id')
+            key = self.state['patients'].get(pid)
+            point = recording_point(rec)
+            with open(self._trend_path(pid), 'a') as f:
+                f.write(json.dumps(point) + "\n")
+            if key is not None:
+                g = self._group(key)
+                g['n_recordings'] += 1
+                _add_point(g['sums'], point)
+                _add_sketch(g, point['sketches'])
+                self._save()
+            return point
+
+    def trends(self, pid, metrics=TREND_METRICS):
+        keep = ('recording_id', 'timestamp', 'date') + tuple(metrics)
+        return [{k: p.get(k) for k in keep} for p in self._points(pid)]
+
+    def patient_distribution(self, pid):
+        """Knee angle / gyro norm distribution over all of a patient's recordings."""
+        points = self._points(pid)
+        out = merge_sketches(p.get('sketches') for p in points).summary()
+        return dict(out, n_recordings=len(points))
+
+    def cohort_distribution(self, status=None, age_bucket=None):
+        """Same, merged over the cohort groups matching status / age bucket (all by default)."""
+        with self._lock:
+            groups = [g for g in self.state['groups'].values() if g['n_patients'] > 0
+                      and status in (None, g['status']) and age_bucket in (None, g['age_bucket'])]
+            out = merge_sketches(g.get('sketch') for g in groups).summary()
+        return dict(out, n_patients=sum(g['n_patients'] for g in groups),
+                    n_recordings=sum(g['n_recordings'] for g in groups))
+
+    def cohort(self):
+        """Counts by status and age bucket, and per-group metric mean / SD."""
+        with self._lock:
+            groups = [{k: json.loads(json.dumps(v)) for k, v in g.items() if k != 'sketch'}
+                      for g in self.state['groups'].values() if g['n_patients'] > 0]
+        by_status, by_age = {}, {b: 0 for b in AGE_BUCKETS}
+        out_groups = []
+        for g in groups:
+            by_status[g['status']] = by_status.get(g['status'], 0) + g['n_patients']
+            by_age[g['age_bucket']] = by_age.get(g['age_bucket'], 0) + g['n_patients']
+            stats = {}
+            for k, (n, s, ss) in g['sums'].items():
+                if n > 0:
+                    mean = s / n
+                    stats[k] = {'n': n, 'mean': mean, 'sd': math.sqrt(max(0.0, ss / n - mean * mean))}
+            out_groups.append({'status': g['status'], 'age_bucket': g['age_bucket'],
+                               'n_patients': g['n_patients'], 'n_recordings': g['n_recordings'],
+                               'metrics': stats})
+        return {
+            'total_patients': sum(g['n_patients'] for g in groups),
+            'by_status': by_status,
+            'by_age_bucket': by_age,
+            'groups': out_groups,
+        }
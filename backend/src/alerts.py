@@ -0,0 +1,396 @@
+# src/alerts.py
+# Live clinical alerts: declarative rules evaluated per packet during
+# capture (main.measurement_phase, mp_pipeline.analysis_worker).
+# A rule is a JSON object:
+#   {"id": "fast_swing", "signal": "gyro_norm_dps", "op": ">", "value": 600,
+#    "for_s": 0.2, "severity": "warning"}
+#   signal     - one of SIGNALS (LiveFeatures computes them per packet)
+#   agg        - 'last' (the sample itself, default) or a window aggregate in
+#   window_s     AGGREGATES over the trailing window_s seconds ('mean' when
+#                only window_s is given); evaluated once the window is full
+#   op, value  - comparison against a constant, or
+#   baseline   - {"agg": "mean", "window_s": 60, "factor": 0.6}: against
+#                factor * an aggregate of the same signal ("sudden drop")
+#   for_s      - the condition must hold this long before the alert fires
+#   cooldown_s - minimum time between two firings of the rule
+#   severity   - one of SEVERITIES; message - optional text
+# knee_angle_deg comes from the hinge calibration, which fixes the joint
+# axis but not the angle's zero or sign (estimator_eval.angle_errors
+# removes both for the same reason), so absolute knee thresholds such as
+# hyperextension are not meaningful and none are in DEFAULT_RULES.
+# An alert fires once when its condition starts to hold (after for_s) and
+# resolves when it stops. Rules with the same (signal, window) share one
+# incremental window (running sums + monotonic min/max queues, O(1)
+# amortized per sample), and each sample only visits the rules on its
+# signals, so hundreds of rules cost well under a millisecond per packet.
+import os
+import math
+import json
+import time
+import operator
+from collections import deque
+from manifest import path_id
+
+SIGNALS = ('knee_angle_deg', 'accel_angle_deg', 'gyro_norm_dps', 'acc1_norm', 'acc2_norm',
+           'step', 'cadence_spm', 'packet_gap_s', 'freezing')
+AGGREGATES = ('last', 'mean', 'min', 'max', 'std', 'sum', 'count')
+OPS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+       '==': operator.eq, '!=': operator.ne}
+SEVERITIES = ('info', 'warning', 'critical')
+
+DEFAULT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'alerts'))
+
+# used when a session gives no rules of its own
+DEFAULT_RULES = [
+    {'id': 'cadence_drop', 'signal': 'cadence_spm', 'op': '<',
+     'baseline': {'agg': 'mean', 'window_s': 60.0, 'factor': 0.6}, 'for_s': 2.0,
+     'severity': 'warning', 'message': "Cadence dropped below 60% of the last minute"},
+    {'id': 'imu1_detached', 'signal': 'acc1_norm', 'agg': 'mean', 'window_s': 1.0, 'op': '<', 'value': 2.0,
+     'severity': 'critical', 'message': "IMU1 reads no gravity (detached or dead sensor)"},
+    {'id': 'imu2_detached', 'signal': 'acc2_norm', 'agg': 'mean', 'window_s': 1.0, 'op': '<', 'value': 2.0,
+     'severity': 'critical', 'message': "IMU2 reads no gravity (detached or dead sensor)"},
+    {'id': 'data_gap', 'signal': 'packet_gap_s', 'op': '>', 'value': 0.5,
+     'severity': 'warning', 'message': "No packets for over 0.5 s"},
+    {'id': 'freezing_of_gait', 'signal': 'freezing', 'op': '>=', 'value': 1,
+     'severity': 'warning', 'message': "Freezing of gait"},
+]
+
+def log_path(recording_id, out_dir=DEFAULT_DIR):
+    """Alert log (JSON lines) of a recording."""
+    return os.path.join(out_dir, f"{path_id(recording_id)}.jsonl")
+
+class Rule:
+    __slots__ = ('id', 'signal', 'agg', 'window_s', 'op', 'op_fn', 'value', 'baseline',
+                 'for_s', 'cooldown_s', 'severity', 'message')
+
+    def __init__(self, spec):
+        if not isinstance(spec, dict):
+            raise ValueError("A rule must be an object")
+        self.id = str(spec.get('id') or '')
+        if not self.id:
+            raise ValueError("Rule needs an 'id'")
+        self.signal = spec.get('signal')
+        if self.signal not in SIGNALS:
+            raise ValueError(f"Rule {self.id}: unknown signal {self.signal!r}; use one of {', '.join(SIGNALS)}")
+        self.window_s = _positive(spec.get('window_s'), self.id, 'window_s')
+        self.agg = spec.get('agg') or ('mean' if self.window_s else 'last')
+        self._check_agg(self.agg, self.window_s)
+        self.op = spec.get('op')
+        if self.op not in OPS:
+            raise ValueError(f"Rule {self.id}: unknown op {self.op!r}; use one of {' '.join(OPS)}")
+        self.op_fn = OPS[self.op]
+        self.baseline = None
+        if spec.get('baseline') is not None:
+            b = spec['baseline']
+            window_s = _positive(b.get('window_s'), self.id, 'baseline window_s')
+            agg = b.get('agg', 'mean')
+            self._check_agg(agg, window_s)
+            self.baseline = (agg, window_s, _number(b.get('factor', 1.0), self.id, 'baseline factor'))
+            self.value = None
+        else:
+            self.value = _number(spec.get('value'), self.id, 'value')
+        self.for_s = _positive(spec.get('for_s'), self.id, 'for_s') or 0.0
+        self.cooldown_s = _positive(spec.get('cooldown_s'), self.id, 'cooldown_s') or 0.0
+        self.severity = spec.get('severity', 'warning')
+        if self.severity not in SEVERITIES:
+            raise ValueError(f"Rule {self.id}: unknown severity {self.severity!r}")
+        target = self.value if self.baseline is None else "{2:g} x {0} over {1:g} s".format(*self.baseline)
+        self.message = spec.get('message') or f"{self.signal} {self.agg} {self.op} {target}"
+
+    def _check_agg(self, agg, window_s):
+        if agg not in AGGREGATES:
+            raise ValueError(f"Rule {self.id}: unknown aggregate {agg!r}; use one of {', '.join(AGGREGATES)}")
+        if (agg == 'last') != (window_s is None):
+            raise ValueError(f"Rule {self.id}: window aggregates need window_s (and 'last' none)")
+
+def _number(v, rule_id, name):
+    if isinstance(v, bool) or not isinstance(v, (int, float)) or not math.isfinite(v):
+        raise ValueError(f"Rule {rule_id}: {name} must be a number")
+    return float(v)
+
+def _positive(v, rule_id, name):
+    if v is None:
+        return None
+    v = _number(v, rule_id, name)
+    if v < 0:
+        raise ValueError(f"Rule {rule_id}: {name} must not be negative")
+    return v
+
+def parse_rules(specs):
+    """Rule objects from JSON rule specs; ValueError names the first bad rule."""
+    if not isinstance(specs, list):
+        raise ValueError("Rules must be a list")
+    rules = [Rule(s) for s in specs]
+    ids = [r.id for r in rules]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Rule ids must be unique")
+    return rules
+
+def load_rules(path=None):
+    """Validated rule specs from a JSON file (a list of specs), else DEFAULT_RULES."""
+    if not path:
+        return DEFAULT_RULES
+    with open(path) as f:
+        specs = json.load(f)
+    parse_rules(specs)
+    return specs
+
+class _Window:
+    """
+    Trailing time window with O(1) amortized push and O(1) aggregates.
+    Sums are kept relative to the first value so the std stays accurate
+    for signals with a large offset (e.g. accel norms near 9.81).
+    """
+    __slots__ = ('window_s', 'items', 'mins', 'maxs', 'ref', 'sum', 'sumsq', 'start')
+
+    def __init__(self, window_s):
+        self.window_s = window_s
+        self.items = deque()
+        self.mins = deque()   # increasing values: front is the window minimum
+        self.maxs = deque()   # decreasing values: front is the window maximum
+        self.ref = None
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.start = None
+
+    def push(self, t, x):
+        if self.ref is None:
+            self.ref, self.start = x, t
+        d = x - self.ref
+        self.items.append((t, x))
+        self.sum += d
+        self.sumsq += d * d
+        while self.mins and self.mins[-1][1] >= x:
+            self.mins.pop()
+        self.mins.append((t, x))
+        while self.maxs and self.maxs[-1][1] <= x:
+            self.maxs.pop()
+        self.maxs.append((t, x))
+        cutoff = t - self.window_s
+        items = self.items
+        while items[0][0] < cutoff:
+            _, old = items.popleft()
+            d = old - self.ref
+            self.sum -= d
+            self.sumsq -= d * d
+        while self.mins[0][0] < cutoff:
+            self.mins.popleft()
+        while self.maxs[0][0] < cutoff:
+            self.maxs.popleft()
+
+    def full(self, t):
+        return self.start is not None and t - self.start >= self.window_s
+
+    def value(self, agg):
+        n = len(self.items)
+        if agg == 'count':
+            return float(n)
+        if n == 0:
+            return None
+        if agg == 'mean':
+            return self.ref + self.sum / n
+        if agg == 'sum':
+            return self.ref * n + self.sum
+        if agg == 'min':
+            return self.mins[0][1]
+        if agg == 'max':
+            return self.maxs[0][1]
+        m = self.sum / n
+        return math.sqrt(max(0.0, self.sumsq / n - m * m))
+
+class _RuleState:
+    __slots__ = ('since', 'active', 'last_fired')
+
+    def __init__(self):
+        self.since = None
+        self.active = False
+        self.last_fired = None
+
+class RuleEngine:
+    """
+    Evaluates parsed rules on a stream of {signal: value} samples.
+    push(t, values) returns the alerts (dicts) raised or resolved by this
+    sample; signals that are missing or None leave their rules unchanged.
+    """
+    def __init__(self, rules):
+        rules = list(rules)
+        self.rules = rules if all(isinstance(r, Rule) for r in rules) else parse_rules(rules)
+        self._windows = {}    # (signal, window_s) -> _Window
+        self._by_signal = {}  # signal -> [(rule, window or None, baseline window or None, state)]
+        for rule in self.rules:
+            w = self._window(rule.signal, rule.window_s) if rule.window_s else None
+            b = self._window(rule.signal, rule.baseline[1]) if rule.baseline else None
+            self._by_signal.setdefault(rule.signal, []).append((rule, w, b, _RuleState()))
+        self._signal_windows = {}
+        for (signal, _), w in self._windows.items():
+            self._signal_windows.setdefault(signal, []).append(w)
+
+    def _window(self, signal, window_s):
+        key = (signal, window_s)
+        if key not in self._windows:
+            self._windows[key] = _Window(window_s)
+        return self._windows[key]
+
+    def push(self, t, values):
+        alerts = []
+        for signal, x in values.items():
+            entries = self._by_signal.get(signal)
+            if entries is None or x is None or x != x:
+                continue
+            for w in self._signal_windows.get(signal, ()):
+                w.push(t, x)
+            for rule, w, b, state in entries:
+                if w is None:
+                    v = x
+                elif not w.full(t):
+                    continue
+                else:
+                    v = w.value(rule.agg)
+                if b is None:
+                    threshold = rule.value
+                elif not b.full(t):
+                    continue
+                else:
+                    threshold = rule.baseline[2] * b.value(rule.baseline[0])
+                alert = self._update(rule, state, t, v, threshold, rule.op_fn(v, threshold))
+                if alert is not None:
+                    alerts.append(alert)
+        return alerts
+
+    @staticmethod
+    def _update(rule, state, t, v, threshold, holds):
+        if not holds:
+            state.since = None
+            if state.active:
+                state.active = False
+                return _alert(rule, 'resolved', t, v, threshold)
+            return None
+        if state.since is None:
+            state.since = t
+        if state.active or t - state.since < rule.for_s:
+            return None
+        if state.last_fired is not None and t - state.last_fired < rule.cooldown_s:
+            return None
+        state.active = True
+        state.last_fired = t
+        return _alert(rule, 'firing', t, v, threshold)
+
+    def active(self):
+        """IDs of the rules currently firing."""
+        return [rule.id for entries in self._by_signal.values() for rule, _, _, s in entries if s.active]
+
+def _alert(rule, state, t, value, threshold):
+    return {'rule': rule.id, 'state': state, 'severity': rule.severity, 'message': rule.message,
+            't': round(t, 4), 'value': value, 'threshold': threshold}
+
+class LiveFeatures:
+    """
+    Per-packet SIGNALS: knee / accel angle, IMU2 gyro norm, accel norms,
+    step events (online gyro-norm peaks over an adaptive threshold, as in
+    the pipeline's step_peaks stage, delayed by one sample), cadence over
+    the trailing cadence_window_s, and the time since the previous packet.
+    knee_angle_deg is the live estimator angle when given, else the
+    accel-vector angle, which is unsigned.
+    """
+    def __init__(self, step_height_factor=0.6, min_step_s=0.25, cadence_window_s=10.0, threshold_window_s=10.0):
+        self.step_height_factor = step_height_factor
+        self.min_step_s = min_step_s
+        self._gyro = _Window(threshold_window_s)
+        self._steps = _Window(cadence_window_s)
+        self._prev = None        # (t, gyro norm) of the previous sample
+        self._prev2 = None       # gyro norm two samples back
+        self._last_step = None
+
+    def _step(self, t, gn):
+        # the previous sample is a step if it is a local maximum above the threshold
+        step = 0.0
+        if self._prev is not None and self._prev2 is not None and self._gyro.items:
+            pt, pg = self._prev
+            th = self._gyro.value('mean') + self.step_height_factor * self._gyro.value('std')
+            if (pg > th and pg >= self._prev2 and pg > gn
+                    and (self._last_step is None or pt - self._last_step >= self.min_step_s)):
+                self._last_step = pt
+                step = 1.0
+        self._gyro.push(t, gn)
+        self._prev2 = self._prev[1] if self._prev is not None else None
+        return step
+
+    def gap(self, t):
+        """Time since the last packet (None before the first)."""
+        return t - self._prev[0] if self._prev is not None else None
+
+    def push(self, t, packet, gyro_norm=None, accel_angle=None, knee_angle=None, freezing=None):
+        imu1, imu2 = packet['IMU1'], packet['IMU2']
+        if gyro_norm is None:
+            gyro_norm = math.sqrt(imu2['Gx'] ** 2 + imu2['Gy'] ** 2 + imu2['Gz'] ** 2)
+        gap = self.gap(t)
+        step = self._step(t, gyro_norm) if math.isfinite(gyro_norm) else 0.0
+        self._prev = (t, gyro_norm)
+        self._steps.push(t, step)
+        cadence = None
+        if self._steps.full(t):
+            cadence = 60.0 * self._steps.value('sum') / self._steps.window_s
+        return {
+            'knee_angle_deg': accel_angle if knee_angle is None else knee_angle,
+            'accel_angle_deg': accel_angle,
+            'gyro_norm_dps': gyro_norm,
+            'acc1_norm': math.sqrt(imu1['Ax'] ** 2 + imu1['Ay'] ** 2 + imu1['Az'] ** 2),
+            'acc2_norm': math.sqrt(imu2['Ax'] ** 2 + imu2['Ay'] ** 2 + imu2['Az'] ** 2),
+            'step': step,
+            'cadence_spm': cadence,
+            'packet_gap_s': gap,
+            'freezing': None if freezing is None else float(freezing),
+        }
+
+class AlertMonitor:
+    """
+    LiveFeatures + RuleEngine for one session. push() returns the new
+    alerts, prints them and appends them to the alert log (flushed per
+    alert, so server.py can stream them to clients as they happen).
+    With the packet's arrival time (time.time()), alerts carry latency_ms
+    from arrival to alert.
+    """
+    def __init__(self, rules=None, log=None, **feature_kwargs):
+        self.engine = RuleEngine(parse_rules(DEFAULT_RULES) if rules is None else rules)
+        self.features = LiveFeatures(**feature_kwargs)
+        self.n_alerts = 0
+        self.fired = {}
+        self._log = None
+        if log:
+            os.makedirs(os.path.dirname(os.path.abspath(log)), exist_ok=True)
+            self._log = open(log, 'a')
+
+    def push(self, t, packet, arrival=None, **signals):
+        return self._emit(t, self.engine.push(t, self.features.push(t, packet, **signals)), arrival)
+
+    def tick(self, t):
+        """Call while no packets arrive, so packet_gap_s rules fire during the gap."""
+        gap = self.features.gap(t)
+        return self._emit(t, self.engine.push(t, {'packet_gap_s': gap}) if gap is not None else [], None)
+
+    def _emit(self, t, alerts, arrival):
+        for a in alerts:
+            if a['state'] == 'firing':
+                self.fired[a['rule']] = self.fired.get(a['rule'], 0) + 1
+            if arrival is not None:
+                a['latency_ms'] = round((time.time() - arrival) * 1e3, 3)
+            print(f"[ALERT] {a['severity']} {a['rule']} {a['state']} at t={t:.1f}s: {a['message']}", flush=True)
+            if self._log is not None:
+                self._log.write(json.dumps(a) + "\n")
+                self._log.flush()
+        self.n_alerts += len(alerts)
+        return alerts
+
+    def summary(self):
+        return {'n_rules': len(self.engine.rules), 'n_alerts': self.n_alerts, 'fired': dict(self.fired)}
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+def read_alerts(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,122 @@
+# src/api_helpers.py
+# Helpers for the read routes in server.py: cached JSON stores, field
+# projection, cursor pagination and conditional (ETag) responses.
+import os
+import json
+import base64
+import bisect
+import hashlib
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+
+_stores = {}
+
+def store_version(path):
+    """(mtime_ns, size) of a JSON store; changes whenever save_json rewrites it."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return (0, 0)
+    return (st.st_mtime_ns, st.st_size)
+
+class Store:
+    """Parsed JSON list plus lazily built indexes, shared by all requests until the file changes."""
+    def __init__(self, data):
+        self.data = data
+        self._indexes = {}
+
+    def index(self, name, build):
+        if name not in self._indexes:
+            self._indexes[name] = build(self.data)
+        return self._indexes[name]
+
+    def by_id(self):
+        return self.index('id', lambda rows: {r['id']: r for r in rows})
+
+    def sorted_by(self, name, key):
+        """(rows sorted by key, their keys) for paginate."""
+        def build(rows):
+            rows = sorted(rows, key=key)
+            return rows, [key(r) for r in rows]
+        return self.index(name, build)
+
+def load_store(path, loader):
+    """Cached, read-only view of a JSON store; callers must not mutate the rows."""
+    version = store_version(path)
+    hit = _stores.get(path)
+    if hit is None or hit[0] != version:
+        hit = (version, Store(loader(path)))
+        _stores[path] = hit
+    return hit[1]
+
+def project(obj, fields):
+    """
+    Keep only `fields` (e.g. ['id', 'name', 'recordings.id', 'recordings.metrics.cadence_spm']).
+    Dotted paths descend into dicts and apply element-wise to lists.
+    """
+    if not fields:
+        return obj
+    if isinstance(obj, list):
+        return [project(o, fields) for o in obj]
+    if not isinstance(obj, dict):
+        return obj
+    tree = {}
+    for f in fields:
+        head, _, rest = f.partition('.')
+        tree.setdefault(head, []).append(rest)
+    out = {}
+    for key, subs in tree.items():
+        if key in obj:
+            out[key] = obj[key] if '' in subs else project(obj[key], subs)
+    return out
+
+def parse_fields(fields):
+    return [f for f in fields.split(',') if f] if fields else None
+
+def encode_cursor(last_key):
+    return base64.urlsafe_b64encode(json.dumps(last_key).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return tuple(key) if isinstance(key, list) else key
+
+def paginate(rows, keys, limit=None, cursor=None):
+    """
+    Keyset page of `rows` after the key the cursor holds (the last key of the
+    previous page). keys: sort key of each row, ascending (tuples or strings).
+    Seeking to the first key after the cursor keeps a cursor valid when its
+    row has since been deleted. Returns (page, next_cursor or None).
+    """
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=422, detail="limit must be at least 1")
+    start = 0
+    if cursor:
+        last = decode_cursor(cursor)
+        try:
+            start = bisect.bisect_right(keys, last)
+        except TypeError:
+            # a cursor from another listing
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    if limit is None:
+        return rows[start:], None
+    page = rows[start:start + limit]
+    more = start + limit < len(rows)
+    return page, (encode_cursor(keys[start + limit - 1]) if more else None)
+
+def make_etag(*parts):
+    return 'W/"' + hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest() + '"'
+
+def not_modified(request: Request, etag):
+    """304 response if the client already has this version, else None."""
+    if etag in (t.strip() for t in request.headers.get('if-none-match', '').split(',')):
+        return Response(status_code=304, headers={'ETag': etag})
+    return None
+
+def json_response(content, etag, next_cursor=None):
+    headers = {'ETag': etag}
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+    return JSONResponse(content, headers=headers)
@@ -0,0 +1,310 @@
+# src/archive.py
+# Compressed archive format for recordings (stdlib codecs only):
+#   MAGIC | chunk 0 | chunk 1 | ... | index (JSON) | uint64 index length | MAGIC
+# A chunk holds `chunk_rows` consecutive rows of every column. Each column is
+# delta-encoded (exact decimal scaling when the values allow it, otherwise
+# the float64 bit patterns), narrowed to the smallest integer type and the
+# whole chunk is compressed. The index stores byte offset, row range and
+# time range of every chunk, so a time range decompresses only its chunks.
+import os
+import sys
+import time
+import json
+import zlib
+import lzma
+import struct
+import bisect
+import numpy as np
+from packets import packets_to_array, IMU_NAMES, IMU_FIELDS, ROW_SEQ, ROW_TIME, ROW_DATA, ROW_WIDTH
+
+MAGIC = b'IMUZ'
+ARCHIVE_EXT = '.imuz'
+_FOOTER = struct.Struct('<Q4s')
+_INT_TYPES = (np.int8, np.int16, np.int32, np.int64)
+_MAX_DECIMALS = 6
+
+CODECS = {
+    'zlib': (lambda b: zlib.compress(b, 9), zlib.decompress),
+    'lzma': (lambda b: lzma.compress(b, preset=6), lzma.decompress),
+}
+
+RAW_COLUMNS = ['seq', 't'] + [f"{imu}.{f}" for imu in IMU_NAMES for f in IMU_FIELDS]
+ANGLE_COLUMNS = ['time_s', 'angle_deg']
+
+def _encode_column(x):
+    """(decimals, int deltas): decimals = -1 means float64 bit patterns."""
+    if np.isfinite(x).all():
+        for k in range(_MAX_DECIMALS + 1):
+            scale = 10.0 ** k
+            q = np.round(x * scale)
+            # exact round trip only; never quantize
+            if np.abs(q).max(initial=0.0) < 2 ** 53 and np.array_equal(q / scale, x):
+                return k, np.diff(q.astype(np.int64), prepend=np.int64(0))
+    with np.errstate(over='ignore'):
+        return -1, np.diff(x.view(np.int64), prepend=np.int64(0))
+
+def _decode_column(decimals, deltas):
+    with np.errstate(over='ignore'):
+        q = np.cumsum(deltas.astype(np.int64))
+    if decimals < 0:
+        return q.view(np.float64)
+    return q / 10.0 ** decimals
+
+def _narrow(d):
+    m = int(np.abs(d).max(initial=0))
+    for k, t in enumerate(_INT_TYPES):
+        if m < np.iinfo(t).max:
+            return k, d.astype(t)
+    return len(_INT_TYPES) - 1, d
+
+def encode_chunk(block, codec='zlib'):
+    """(R, C) float64 rows -> (compressed bytes, per-column decimals, per-column int type)."""
+    block = np.ascontiguousarray(block, dtype=np.float64)
+    parts, decimals, types = [], [], []
+    for c in range(block.shape[1]):
+        k, d = _encode_column(block[:, c])
+        t, d = _narrow(d)
+        parts.append(d.astype(d.dtype.newbyteorder('<'), copy=False).tobytes())
+        decimals.append(k)
+        types.append(t)
+    return CODECS[codec][0](b''.join(parts)), decimals, types
+
+def decode_chunk(data, n_rows, decimals, types, codec='zlib'):
+    raw = CODECS[codec][1](data)
+    out = np.empty((n_rows, len(decimals)))
+    pos = 0
+    for c, (k, t) in enumerate(zip(decimals, types)):
+        dt = np.dtype(_INT_TYPES[t]).newbyteorder('<')
+        n_bytes = n_rows * dt.itemsize
+        out[:, c] = _decode_column(k, np.frombuffer(raw, dtype=dt, count=n_rows, offset=pos))
+        pos += n_bytes
+    return out
+
+def write_archive(path, rows, columns, time_column=None, chunk_rows=1024, codec='zlib', meta=None):
+    """
+    Write an (N, C) array as an archive. time_column names the column used
+    for time-range lookups (None: row number / meta['sampling_rate']).
+    The file is written under a temporary name and renamed when complete.
+    """
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(columns))
+    tcol = columns.index(time_column) if time_column else None
+    sampling_rate = (meta or {}).get('sampling_rate', 10.0)
+    index = {'version': 1, 'codec': codec, 'columns': list(columns), 'time_column': time_column,
+             'n_rows': int(len(rows)), 'chunk_rows': chunk_rows, 'meta': meta or {}, 'chunks': []}
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        for start in range(0, len(rows), chunk_rows):
+            block = rows[start:start + chunk_rows]
+            data, decimals, types = encode_chunk(block, codec)
+            if tcol is not None:
+                times = block[:, tcol]
+            else:
+                times = np.arange(start, start + len(block)) / sampling_rate
+            finite = times[np.isfinite(times)]
+            index['chunks'].append({
+                'offset': f.tell(), 'length': len(data), 'start_row': start, 'n_rows': int(len(block)),
+                't0': float(finite.min()) if len(finite) else None,
+                't1': float(finite.max()) if len(finite) else None,
+                'decimals': decimals, 'types': types,
+            })
+            f.write(data)
+        footer = json.dumps(index).encode()
+        f.write(footer)
+        f.write(_FOOTER.pack(len(footer), MAGIC))
+    os.replace(tmp, path)
+    return index
+
+class ArchiveReader:
+    """Random access into an archive: only the chunks a request touches are read."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            f.seek(-_FOOTER.size, os.SEEK_END)
+            length, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(f"Not an archive: {path}")
+            f.seek(-_FOOTER.size - length, os.SEEK_END)
+            self.index = json.loads(f.read(length))
+        self.columns = self.index['columns']
+        self.chunks = self.index['chunks']
+        self.n_rows = self.index['n_rows']
+        self._starts = [c['start_row'] for c in self.chunks]
+
+    def read_chunk(self, k):
+        c = self.chunks[k]
+        with open(self.path, 'rb') as f:
+            f.seek(c['offset'])
+            data = f.read(c['length'])
+        return decode_chunk(data, c['n_rows'], c['decimals'], c['types'], self.index['codec'])
+
+    def read_rows(self, start=0, stop=None):
+        """Rows [start, stop) as an (n, C) array."""
+        stop = self.n_rows if stop is None else min(stop, self.n_rows)
+        if stop <= start:
+            return np.zeros((0, len(self.columns)))
+        k0 = max(0, bisect.bisect_right(self._starts, start) - 1)
+        k1 = bisect.bisect_left(self._starts, stop)
+        block = np.concatenate([self.read_chunk(k) for k in range(k0, k1)])
+        first = self.chunks[k0]['start_row']
+        return block[start - first:stop - first]
+
+    def read_time_range(self, t0, t1):
+        """Rows with t0 <= t <= t1 (time column or row time); assumes t is non-decreasing."""
+        ks = [k for k, c in enumerate(self.chunks)
+              if c['t0'] is not None and c['t1'] >= t0 and c['t0'] <= t1]
+        if not ks:
+            return np.zeros((0, len(self.columns)))
+        block = np.concatenate([self.read_chunk(k) for k in ks])
+        tc = self.index['time_column']
+        if tc is not None:
+            t = block[:, self.columns.index(tc)]
+        else:
+            rows = np.concatenate([np.arange(self.chunks[k]['start_row'],
+                                             self.chunks[k]['start_row'] + self.chunks[k]['n_rows']) for k in ks])
+            t = rows / self.index['meta'].get('sampling_rate', 10.0)
+        return block[(t >= t0) & (t <= t1)]
+
+# ---------- recording files ----------
+def _raw_rows(packets):
+    """Rows [seq, t, 12 channels]; returns None if packets hold anything else."""
+    allowed = set(IMU_NAMES) | {'seq', 't'}
+    if not all(isinstance(p, dict) and set(IMU_NAMES) <= p.keys() <= allowed for p in packets):
+        return None
+    if not all(isinstance(p[imu], dict) and p[imu].keys() == set(IMU_FIELDS) for p in packets for imu in IMU_NAMES):
+        return None
+    rows = np.full((len(packets), ROW_WIDTH), np.nan)
+    rows[:, ROW_DATA] = packets_to_array(packets)
+    for key, col in (('seq', ROW_SEQ), ('t', ROW_TIME)):
+        rows[:, col] = [p.get(key, np.nan) for p in packets]
+    return rows
+
+def rows_to_packets(rows):
+    """Raw archive rows back to packet dicts (seq / t only where recorded)."""
+    n = len(IMU_FIELDS)
+    out = []
+    for row in rows.tolist():
+        vals = row[ROW_DATA]
+        p = {imu: dict(zip(IMU_FIELDS, vals[k * n:(k + 1) * n])) for k, imu in enumerate(IMU_NAMES)}
+        if row[ROW_SEQ] == row[ROW_SEQ]:
+            p['seq'] = int(row[ROW_SEQ])
+        if row[ROW_TIME] == row[ROW_TIME]:
+            p['t'] = row[ROW_TIME]
+        out.append(p)
+    return out
+
+def read_archive(path):
+    """
+    Whole archive in the form it was archived from: packet dicts for a raw
+    recording, an (N, 2) [time_s, angle_deg] array for an angle file.
+    """
+    reader = ArchiveReader(path)
+    rows = reader.read_rows()
+    if reader.index['meta'].get('kind') == 'raw':
+        return rows_to_packets(rows)
+    return rows
+
+def _same(a, b):
+    return a.shape == b.shape and np.array_equal(a, b, equal_nan=True)
+
+def archive_raw_jsonl(path, codec='zlib', chunk_rows=1024, sampling_rate=10.0):
+    """
+    Archive a raw_*.jsonl recording next to it (same stem, .imuz). Returns the
+    archive path, or None if the file has non-sample lines (left untouched).
+    The archive is read back and compared before the caller may delete path.
+    """
+    with open(path) as f:
+        packets = [json.loads(line) for line in f if line.strip()]
+    rows = _raw_rows(packets)
+    if rows is None or len(rows) == 0:
+        return None
+    # non-numeric values (e.g. numbers sent as strings) would not round-trip
+    if any(isinstance(p[imu][k], bool) or not isinstance(p[imu][k], (int, float))
+           for p in packets for imu in IMU_NAMES for k in IMU_FIELDS):
+        return None
+    has_t = not np.isnan(rows[:, ROW_TIME]).any()
+    out = os.path.splitext(path)[0] + ARCHIVE_EXT
+    write_archive(out, rows, RAW_COLUMNS, time_column='t' if has_t else None, chunk_rows=chunk_rows,
+                  codec=codec, meta={'kind': 'raw', 'sampling_rate': sampling_rate,
+                                     'source': os.path.basename(path)})
+    if not _same(ArchiveReader(out).read_rows(), rows):
+        os.remove(out)
+        return None
+    return out
+
+def archive_angles_csv(path, codec='zlib', chunk_rows=1024):
+    """Archive a time_s,angle_deg CSV (empty angle -> NaN). Same contract as archive_raw_jsonl."""
+    with open(path) as f:
+        header = f.readline().strip()
+        if header != ",".join(ANGLE_COLUMNS):
+            return None
+        try:
+            rows = np.array([[float(v) if v else np.nan for v in line.strip().split(',')]
+                             for line in f if line.strip()], dtype=float).reshape(-1, 2)
+        except ValueError:
+            return None
+    if len(rows) == 0:
+        return None
+    out = os.path.splitext(path)[0] + ARCHIVE_EXT
+    write_archive(out, rows, ANGLE_COLUMNS, time_column='time_s', chunk_rows=chunk_rows, codec=codec,
+                  meta={'kind': 'angles', 'source': os.path.basename(path)})
+    if not _same(ArchiveReader(out).read_rows(), rows):
+        os.remove(out)
+        return None
+    return out
+
+def compact_recordings(recording_dir, min_age_s=3600.0, codec='zlib', on_archived=None, skipped=None):
+    """
+    Archive raw .jsonl and angle .csv files older than min_age_s (in
+    recording_dir and its per-patient shards) and delete the originals once
+    the archive has been verified. Segmented session directories and the
+    manifest are left alone. on_archived(old, new) is called per file with
+    paths relative to recording_dir, before the original is deleted, so
+    metadata never points at a missing file; if it raises, the original
+    is kept. skipped: set of (path, mtime) the caller keeps between calls;
+    files that cannot be archived are added and not parsed again until they
+    change. Returns the list of (old, new).
+    """
+    now = time.time()
+    done = []
+    seen = set()
+    for dirpath, dirnames, filenames in os.walk(recording_dir):
+        if 'index.json' in filenames:
+            dirnames[:] = []
+            continue
+        for name in filenames:
+            if name.endswith('.jsonl') and name != 'manifest.jsonl':
+                archive = archive_raw_jsonl
+            elif name.endswith('.csv'):
+                archive = archive_angles_csv
+            else:
+                continue
+            path = os.path.join(dirpath, name)
+            mtime = os.path.getmtime(path)
+            if now - mtime < min_age_s:
+                continue
+            key = (path, mtime)
+            seen.add(key)
+            if skipped is not None and key in skipped:
+                continue
+            out = archive(path, codec=codec)
+            if out is None:
+                if skipped is not None:
+                    skipped.add(key)
+                continue
+            old, new = os.path.relpath(path, recording_dir), os.path.relpath(out, recording_dir)
+            if on_archived is not None:
+                on_archived(old, new)
+            os.remove(path)
+            done.append((old, new))
+    if skipped is not None:
+        # forget files that were changed, archived or deleted since
+        skipped &= seen
+    return done
+
+if __name__ == "__main__":
+    # python src/archive.py [recording_dir] [min_age_s]
+    rec_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), '..', 'data', 'recordings')
+    min_age = float(sys.argv[2]) if len(sys.argv) > 2 else 3600.0
+    for old, new in compact_recordings(rec_dir, min_age_s=min_age):
+        print(f"{old} -> {new}")
@@ -0,0 +1,405 @@
+# src/bilateral.py
+# Left / right leg recordings from two devices with independent clocks:
+# clock offset + drift estimation, resampling onto one timeline, and gait
+# symmetry indices.
+import sys
+import json
+import numpy as np
+from packets import packets_to_array, _packet_values, IMU1_ACC, IMU2_ACC, N_CHANNELS
+from pipeline import RecordingPipeline
+
+# Clock model: right device time = t + lag(t) for left device time t, with
+# lag(t) = offset_s + drift_ppm * 1e-6 * (t - t_ref_s).
+
+def alignment_signal(imu):
+    """
+    (N,) signal both legs share: summed accel norm of thigh and shank.
+    Heel strikes of either leg show up on both devices, so it correlates
+    between legs at the true lag (shank gyro is anti-phase between legs).
+    """
+    return np.linalg.norm(imu[:, IMU1_ACC], axis=1) + np.linalg.norm(imu[:, IMU2_ACC], axis=1)
+
+def _resample(t, x, grid):
+    # linear interpolation of (N,) or (N, C) x onto grid, per column over
+    # finite samples only; NaN outside the recorded span
+    x = np.asarray(x, dtype=float)
+    flat = x[:, None] if x.ndim == 1 else x
+    out = np.full((len(grid), flat.shape[1]), np.nan)
+    inside = (grid >= t[0]) & (grid <= t[-1])
+    for c in range(flat.shape[1]):
+        ok = np.isfinite(flat[:, c])
+        if ok.sum() >= 2:
+            out[inside, c] = np.interp(grid[inside], t[ok], flat[ok, c])
+    return out[:, 0] if x.ndim == 1 else out
+
+def window_lags(a, b, window, hop, max_lag):
+    """
+    Lag of b relative to a in sliding windows, by batched FFT cross-correlation.
+    a, b: (N,) signals on the same uniform grid (NaN = no data)
+    window, hop, max_lag: in samples; lags are searched in [-max_lag, max_lag]
+    Returns (starts, lags, peaks): window start indices, sub-sample lags
+    (parabolic peak interpolation) and normalized correlation at the peak
+    (NaN when a window has no usable data).
+    """
+    a = np.asarray(a, dtype=float)
+    n = len(a)
+    if n < window:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    span = window + 2 * max_lag
+    bp = np.concatenate([np.full(max_lag, np.nan), np.asarray(b, dtype=float), np.full(max_lag, np.nan)])
+    fa = np.lib.stride_tricks.sliding_window_view(a, window)[::hop]    # (F, window)
+    fb = np.lib.stride_tricks.sliding_window_view(bp, span)[::hop]     # (F, span), centred on fa
+    starts = np.arange(len(fa)) * hop
+
+    def demean(f):
+        ok = np.isfinite(f)
+        mean = np.where(ok, f, 0.0).sum(axis=1, keepdims=True) / np.maximum(ok.sum(axis=1, keepdims=True), 1)
+        return np.where(ok, f - mean, 0.0)
+
+    fa, fb = demean(fa), demean(fb)
+    # cc[m] = sum_k fa[k] * fb[k + m], m = 0..2*max_lag, i.e. lag m - max_lag
+    nfft = 1 << int(np.ceil(np.log2(window + span)))
+    cc = np.fft.irfft(np.conj(np.fft.rfft(fa, nfft, axis=1)) * np.fft.rfft(fb, nfft, axis=1), nfft, axis=1)
+    cc = cc[:, :2 * max_lag + 1]
+    # normalize by the energy of a and of the overlapping part of b
+    cs = np.concatenate([np.zeros((len(fb), 1)), np.cumsum(fb * fb, axis=1)], axis=1)
+    eb = cs[:, window:window + 2 * max_lag + 1] - cs[:, :2 * max_lag + 1]
+    ea = (fa * fa).sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cc = np.where((ea > 0) & (eb > 0), cc / np.sqrt(ea * eb), np.nan)
+
+    rows = np.arange(len(cc))
+    ok = np.isfinite(cc).any(axis=1)
+    m = np.argmax(np.where(np.isfinite(cc), cc, -np.inf), axis=1)
+    peaks = np.where(ok, cc[rows, m], np.nan)
+    # parabolic refinement around the peak
+    inner = (m > 0) & (m < 2 * max_lag)
+    y0 = cc[rows, np.maximum(m - 1, 0)]
+    y2 = cc[rows, np.minimum(m + 1, 2 * max_lag)]
+    denom = y0 - 2 * peaks + y2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where(inner & (denom < 0), 0.5 * (y0 - y2) / denom, 0.0)
+    delta = np.where(np.isfinite(delta), np.clip(delta, -0.5, 0.5), 0.0)
+    lags = np.where(ok, m - max_lag + delta, np.nan)
+    return starts, lags, peaks
+
+def _fit_clock(centres, lags, weights, t_ref, min_resid_s):
+    # weighted line through (centre, lag); one pass of MAD outlier rejection
+    keep = np.isfinite(lags) & np.isfinite(weights) & (weights > 0)
+    for _ in range(2):
+        if keep.sum() == 0:
+            return None
+        if keep.sum() == 1 or np.ptp(centres[keep]) == 0:
+            offset, drift = float(np.average(lags[keep], weights=weights[keep])), 0.0
+        else:
+            drift, offset = np.polyfit(centres[keep] - t_ref, lags[keep], 1, w=np.sqrt(weights[keep]))
+        resid = lags - (offset + drift * (centres - t_ref))
+        mad = 1.4826 * np.median(np.abs(resid[keep]))
+        keep &= np.abs(resid) <= max(3.0 * mad, min_resid_s)
+    rms = float(np.sqrt(np.mean(resid[keep] ** 2))) if keep.any() else None
+    return {'offset_s': float(offset), 'drift_ppm': float(drift) * 1e6, 't_ref_s': float(t_ref),
+            'n_windows': int(keep.sum()), 'residual_ms': None if rms is None else rms * 1e3}
+
+def clock_seed(t_left, arrivals_left, t_right, arrivals_right, q=5.0):
+    """
+    Coarse offset (s) from host arrival times of both streams: a low
+    percentile of (arrival - device time) estimates each device clock's
+    offset to the host clock, as network latency only ever adds to it.
+    """
+    c_left = np.percentile(np.asarray(arrivals_left) - np.asarray(t_left), q)
+    c_right = np.percentile(np.asarray(arrivals_right) - np.asarray(t_right), q)
+    return float(c_left - c_right)
+
+def estimate_clock_model(t_left, x_left, t_right, x_right, sampling_rate=50.0, window_s=8.0, hop_s=4.0,
+                         max_lag_s=0.15, seed_offset_s=0.0, min_corr=0.3):
+    """
+    Offset and drift of the right device clock relative to the left.
+    t_*, x_*: device timestamps (s) and alignment_signal values per stream
+    seed_offset_s: coarse offset (e.g. clock_seed); the lag search covers
+                   only +-max_lag_s around it, which keeps the correlation
+                   from locking onto the half-stride lag between legs
+    Windows whose peak correlation is below min_corr are not used.
+    Returns the clock model dict (offset_s, drift_ppm, t_ref_s, n_windows,
+    residual_ms), or None if no window correlated.
+    """
+    t_left, t_right = np.asarray(t_left, dtype=float), np.asarray(t_right, dtype=float)
+    dt = 1.0 / sampling_rate
+    t0 = max(t_left[0], t_right[0] - seed_offset_s)
+    t1 = min(t_left[-1], t_right[-1] - seed_offset_s)
+    if t1 <= t0:
+        return None
+    grid = np.arange(t0, t1, dt)
+    a = _resample(t_left, x_left, grid)
+    b = _resample(t_right, x_right, grid + seed_offset_s)
+    window = max(4, int(round(window_s * sampling_rate)))
+    hop = max(1, int(round(hop_s * sampling_rate)))
+    max_lag = max(1, int(round(max_lag_s * sampling_rate)))
+    starts, lags, peaks = window_lags(a, b, window, hop, max_lag)
+    if len(starts) == 0:
+        return None
+    centres = grid[starts] + 0.5 * window * dt
+    lags_s = seed_offset_s + lags * dt
+    weights = np.where(peaks >= min_corr, peaks, 0.0)
+    return _fit_clock(centres, lags_s, weights, t_ref=grid[0], min_resid_s=dt)
+
+def lag_at(model, t):
+    return model['offset_s'] + model['drift_ppm'] * 1e-6 * (np.asarray(t, dtype=float) - model['t_ref_s'])
+
+def to_left_clock(model, t_right):
+    """Map right device timestamps onto the left device clock (inverse of lag_at)."""
+    d = model['drift_ppm'] * 1e-6
+    return (np.asarray(t_right, dtype=float) - model['offset_s'] + d * model['t_ref_s']) / (1.0 + d)
+
+def align_streams(t_left, left, t_right, right, model, sampling_rate=50.0):
+    """
+    Resample both streams onto one uniform timeline (left device clock)
+    covering their overlap. left / right: (N, C) arrays.
+    Returns (times, left (M, C), right (M, C)).
+    """
+    t_left, t_right = np.asarray(t_left, dtype=float), np.asarray(t_right, dtype=float)
+    t0 = max(t_left[0], to_left_clock(model, t_right[0]))
+    t1 = min(t_left[-1], to_left_clock(model, t_right[-1]))
+    grid = np.arange(t0, t1, 1.0 / sampling_rate) if t1 > t0 else np.zeros(0)
+    return grid, _resample(t_left, left, grid), _resample(t_right, right, grid + lag_at(model, grid))
+
+# ---------- symmetry ----------
+def symmetry_index(left, right):
+    """Symmetry index (%) 100 * (L - R) / (0.5 * (L + R)), element-wise; 0 = symmetric."""
+    left, right = np.asarray(left, dtype=float), np.asarray(right, dtype=float)
+    mean = 0.5 * (left + right)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(mean != 0, 100.0 * (left - right) / mean, np.nan)
+
+def leg_strides(imu, sampling_rate=50.0, angles=None, valid=None, stance_factor=0.5):
+    """
+    Per-stride measures of one leg from its (N, 12) packet array.
+    Strides run between consecutive swing peaks of the shank gyro norm (the
+    pipeline's step_peaks); those spanning invalid samples are dropped.
+    Stance is where the shank gyro norm is below stance_factor times its mean.
+    angles: knee angle per sample (default: the pipeline's accel angle).
+    Returns dict of peak indices and per-stride knee ROM and stance ratio.
+    """
+    pipe = RecordingPipeline(sampling_rate=sampling_rate, imu=imu)
+    if valid is not None:
+        pipe.provide('valid', valid)
+    if angles is not None:
+        pipe.provide('angles', angles)
+    peaks = pipe['step_peaks']
+    empty = {'peaks': peaks, 'knee_rom_deg': np.zeros(0), 'stance_ratio': np.zeros(0)}
+    if len(peaks) < 2:
+        return empty
+    ang = np.array([np.nan if a is None else a for a in pipe['angles']], dtype=float)
+    g = pipe['gyro_norms']
+    still = (g < stance_factor * np.nanmean(g)).astype(float)
+
+    # segment i = [peaks[i], peaks[i + 1]); reduceat works on the slice from the first peak
+    lo, hi = peaks[0], peaks[-1]
+    idx = peaks[:-1] - lo
+    seg_ang = np.where(np.isfinite(ang[lo:hi]), ang[lo:hi], np.nan)
+    with np.errstate(invalid='ignore'):
+        rom = np.fmax.reduceat(seg_ang, idx) - np.fmin.reduceat(seg_ang, idx)
+    stance = np.add.reduceat(still[lo:hi], idx) / np.diff(peaks)
+    bad = np.cumsum(~pipe['valid'])
+    gap = bad[peaks[1:]] != bad[peaks[:-1]]
+    return {'peaks': peaks, 'knee_rom_deg': np.where(gap, np.nan, rom), 'stance_ratio': np.where(gap, np.nan, stance)}
+
+def _step_times(own, other, sampling_rate, bad, max_step):
+    # time from the contralateral swing peak before each own peak; steps
+    # across an invalid segment are not steps
+    j = np.searchsorted(other, own) - 1
+    ok = j >= 0
+    mine, prev = own[ok], other[j[ok]]
+    steps = (mine - prev) / sampling_rate
+    return steps[(bad[mine] == bad[prev]) & (steps > 0) & (steps <= max_step)]
+
+def _mean(x):
+    x = np.asarray(x, dtype=float)
+    x = x[np.isfinite(x)]
+    return float(x.mean()) if len(x) else None
+
+def bilateral_symmetry(left_imu, right_imu, sampling_rate=50.0, left_angles=None, right_angles=None,
+                       valid=None, max_step_s=2.0, stance_factor=0.5):
+    """
+    Symmetry of two aligned legs (same timeline, e.g. from align_streams).
+    Step time of a leg: from the other leg's swing peak to its own.
+    Returns {metric: {'left', 'right', 'si_pct'}} for step_time_s,
+    knee_rom_deg and stance_ratio, plus stride counts.
+    """
+    if valid is None:
+        valid = np.isfinite(left_imu).all(axis=1) & np.isfinite(right_imu).all(axis=1)
+    L = leg_strides(left_imu, sampling_rate, left_angles, valid, stance_factor)
+    R = leg_strides(right_imu, sampling_rate, right_angles, valid, stance_factor)
+    bad = np.cumsum(~valid)
+    step_l = _step_times(L['peaks'], R['peaks'], sampling_rate, bad, max_step_s)
+    step_r = _step_times(R['peaks'], L['peaks'], sampling_rate, bad, max_step_s)
+
+    out = {}
+    for name, lv, rv in (('step_time_s', step_l, step_r),
+                         ('knee_rom_deg', L['knee_rom_deg'], R['knee_rom_deg']),
+                         ('stance_ratio', L['stance_ratio'], R['stance_ratio'])):
+        ml, mr = _mean(lv), _mean(rv)
+        si = symmetry_index(ml, mr) if ml is not None and mr is not None else np.nan
+        out[name] = {'left': ml, 'right': mr, 'si_pct': float(si) if np.isfinite(si) else None}
+    out['n_strides'] = {'left': int(max(len(L['peaks']) - 1, 0)), 'right': int(max(len(R['peaks']) - 1, 0))}
+    return out
+
+# ---------- whole recordings ----------
+def _stream(packets, sampling_rate, times=None):
+    imu = packets_to_array(packets)
+    if times is None:
+        if packets and all('t' in p for p in packets):
+            times = [p['t'] for p in packets]
+        else:
+            times = np.arange(len(packets)) / sampling_rate
+    return np.asarray(times, dtype=float), imu
+
+def bilateral_summary(left_packets, right_packets, sampling_rate=50.0, left_times=None, right_times=None,
+                      left_arrivals=None, right_arrivals=None, **clock_kwargs):
+    """
+    Align a left and right leg recording and compute their symmetry.
+    *_times: device timestamps (default: packet 't', else sample index / rate)
+    *_arrivals: host arrival times; when given for both, they seed the offset.
+                Without them (or seed_offset_s) the device clocks must already
+                agree to within max_lag_s, e.g. NTP-synced firmware.
+    clock_kwargs: passed to estimate_clock_model
+    """
+    tl, left = _stream(left_packets, sampling_rate, left_times)
+    tr, right = _stream(right_packets, sampling_rate, right_times)
+    if len(tl) < 2 or len(tr) < 2:
+        return {'clock': None, 'n_samples': 0, 'symmetry': None}
+    if left_arrivals is not None and right_arrivals is not None:
+        clock_kwargs['seed_offset_s'] = clock_seed(tl, left_arrivals, tr, right_arrivals)
+    model = estimate_clock_model(tl, alignment_signal(left), tr, alignment_signal(right),
+                                 sampling_rate=sampling_rate, **clock_kwargs)
+    if model is None:
+        return {'clock': None, 'n_samples': 0, 'symmetry': None}
+    times, l, r = align_streams(tl, left, tr, right, model, sampling_rate)
+    return {'clock': model, 'n_samples': int(len(times)),
+            'symmetry': bilateral_symmetry(l, r, sampling_rate) if len(times) else None}
+
+# ---------- live ----------
+class BilateralAligner:
+    """
+    Live clock alignment of a left and right device stream.
+    Each side keeps the last buffer_s of samples in a preallocated ring of
+    [t, 12 channels] rows. Every hop_s of left device time one new window is
+    correlated around the current prediction (O(window log window), however
+    long the session) and folded into running weighted least-squares sums
+    for the clock line; `forget` discounts old windows so slow drift changes
+    (e.g. with board temperature) are followed.
+    """
+    def __init__(self, sampling_rate=50.0, window_s=8.0, hop_s=2.0, max_lag_s=0.15, buffer_s=30.0,
+                 min_corr=0.3, seed_offset_s=0.0, forget=0.995):
+        self.sampling_rate = sampling_rate
+        self.window = max(4, int(round(window_s * sampling_rate)))
+        self.max_lag = max(1, int(round(max_lag_s * sampling_rate)))
+        self.hop_s = hop_s
+        self.min_corr = min_corr
+        self.seed_offset_s = seed_offset_s
+        self.forget = forget
+        capacity = max(int(buffer_s * sampling_rate), 2 * (self.window + 2 * self.max_lag))
+        self._rings = {side: np.full((capacity, 1 + N_CHANNELS), np.nan) for side in ('left', 'right')}
+        self._pos = {'left': 0, 'right': 0}
+        self._count = {'left': 0, 'right': 0}
+        self._sums = np.zeros(5)  # w, w*t, w*t^2, w*lag, w*t*lag (t relative to t_ref)
+        self._resid = 0.0         # discounted mean squared residual
+        self._n = 0
+        self._t_ref = None
+        self._next_t = None
+        self.model = None
+
+    def push(self, side, t, packet):
+        """
+        Add one sample ('left' or 'right', device time in s, packet dict).
+        Returns the updated clock model when a new window was folded in, else None.
+        """
+        ring = self._rings[side]
+        row = ring[self._pos[side]]
+        row[0] = t
+        row[1:] = _packet_values(packet)
+        self._pos[side] = (self._pos[side] + 1) % len(ring)
+        self._count[side] += 1
+        if side != 'left':
+            return None
+        if self._next_t is None:
+            self._next_t = t + (self.window + self.max_lag) / self.sampling_rate
+        if t < self._next_t:
+            return None
+        self._next_t = t + self.hop_s
+        return self._update(t)
+
+    def recent(self, side):
+        """Buffered (n, 13) rows [t, 12 channels] of one side, oldest first."""
+        ring, pos = self._rings[side], self._pos[side]
+        if self._count[side] < len(ring):
+            return ring[:pos]
+        return np.concatenate([ring[pos:], ring[:pos]])
+
+    def predict(self, t):
+        """Predicted right-minus-left clock lag (s) at left device time t."""
+        return lag_at(self.model, t) if self.model is not None else self.seed_offset_s
+
+    def _update(self, t_now):
+        dt = 1.0 / self.sampling_rate
+        # newest window whose lagged right samples have had time to arrive
+        t_start = t_now - (self.window + self.max_lag) * dt
+        grid = t_start + np.arange(self.window) * dt
+        centre = grid[self.window // 2]
+        lag0 = self.predict(centre)
+        margin = (self.max_lag + 2) * dt
+        sig = []
+        for side, lo, hi in (('left', grid[0], grid[-1]), ('right', grid[0] + lag0, grid[-1] + lag0)):
+            rows = self.recent(side)
+            i, j = np.searchsorted(rows[:, 0], (lo - margin, hi + margin))
+            rows = rows[max(i - 1, 0):j + 1]
+            if len(rows) < 2:
+                return None
+            sig.append((rows[:, 0], alignment_signal(rows[:, 1:])))
+        a = _resample(sig[0][0], sig[0][1], grid)
+        b = _resample(sig[1][0], sig[1][1], grid + lag0)
+        _, lags, peaks = window_lags(a, b, self.window, self.window, self.max_lag)
+        if not peaks[0] >= self.min_corr:
+            return None
+        lag = lag0 + lags[0] * dt
+        if self.model is not None and self._n >= 3:
+            if abs(lag - lag0) > max(3.0 * np.sqrt(self._resid), 2 * dt):
+                return None  # outlier window
+            self._resid = self.forget * self._resid + (1 - self.forget) * (lag - lag0) ** 2
+        if self._t_ref is None:
+            self._t_ref = centre
+        x, w = centre - self._t_ref, peaks[0]
+        self._sums = self.forget * self._sums + w * np.array([1.0, x, x * x, lag, x * lag])
+        self._n += 1
+        s0, s1, s2, s3, s4 = self._sums
+        den = s0 * s2 - s1 * s1
+        if self._n < 2 or den <= 1e-12 * s0 * s0:
+            drift, offset = 0.0, s3 / s0
+        else:
+            drift = (s0 * s4 - s1 * s3) / den
+            offset = (s3 - drift * s1) / s0
+        self.model = {'offset_s': float(offset), 'drift_ppm': float(drift) * 1e6, 't_ref_s': float(self._t_ref),
+                      'n_windows': self._n, 'residual_ms': float(np.sqrt(self._resid)) * 1e3}
+        return self.model
+
+    def aligned(self):
+        """Buffered samples of both sides on one timeline: (times, left (M, 12), right (M, 12))."""
+        left, right = self.recent('left'), self.recent('right')
+        if self.model is None or len(left) < 2 or len(right) < 2:
+            return np.zeros(0), np.zeros((0, N_CHANNELS)), np.zeros((0, N_CHANNELS))
+        return align_streams(left[:, 0], left[:, 1:], right[:, 0], right[:, 1:], self.model, self.sampling_rate)
+
+    def symmetry(self, **kwargs):
+        """bilateral_symmetry over the buffered samples, or None before the clocks are aligned."""
+        times, left, right = self.aligned()
+        if len(times) == 0:
+            return None
+        return bilateral_symmetry(left, right, self.sampling_rate, **kwargs)
+
+def _load_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+if __name__ == "__main__":
+    # python src/bilateral.py left_raw.jsonl right_raw.jsonl [sampling_rate]
+    rate = float(sys.argv[3]) if len(sys.argv) > 3 else 50.0
+    print(json.dumps(bilateral_summary(_load_jsonl(sys.argv[1]), _load_jsonl(sys.argv[2]), sampling_rate=rate)))
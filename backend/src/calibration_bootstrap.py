@@ -0,0 +1,148 @@
+# src/calibration_bootstrap.py
+# Bootstrap confidence for the knee calibration: how far the joint axes
+# j1/j2 and positions o1/o2 move when the calibration rows are resampled.
+# Each replicate minimizes the same costs as IMUJointAngle.identify_joint_axis
+# / identify_joint_position, written as least-squares residuals with analytic
+# Jacobians: Levenberg-Marquardt warm-started from the main solution needs
+# only a few iterations. Replicates are spread over worker processes.
+import os
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from kinematic_chain import _sph_to_cart, _sph_partials, _cart_to_sph, _gamma_matrices
+
+ACC_COLS = [0, 1, 2, 9, 10, 11]
+GYR_COLS = [3, 4, 5, 12, 13, 14]
+GDOT_COLS = [6, 7, 8, 15, 16, 17]
+
+# gate used before measurement: replicate axes must stay within this cone
+MAX_CONE_DEG = 5.0
+
+def _split_rows(calibration_data):
+    # IMUJointAngle.collect_calibration_data rows -> acc, gyr, g_dot, each (N, 2, 3)
+    d = np.asarray(calibration_data, dtype=np.float64)
+    return tuple(d[:, cols].reshape(-1, 2, 3) for cols in (ACC_COLS, GYR_COLS, GDOT_COLS))
+
+def _axis_residuals(gyr):
+    # e_n = |g1 x j1| - |g2 x j2| over (phi1, theta1, phi2, theta2)
+    g1, g2 = gyr[:, 0], gyr[:, 1]
+    sq1, sq2 = np.einsum('nk,nk->n', g1, g1), np.einsum('nk,nk->n', g2, g2)
+
+    def parts(p):
+        out = []
+        for g, sq, (phi, theta) in ((g1, sq1, p[0:2]), (g2, sq2, p[2:4])):
+            d = g @ _sph_to_cart(phi, theta)
+            out.append((g, d, np.sqrt(np.maximum(sq - d * d, 1e-12)), _sph_partials(phi, theta)))
+        return out
+
+    def fun(p):
+        (_, _, n1, _), (_, _, n2, _) = parts(p)
+        return n1 - n2
+
+    def jac(p):
+        cols = []
+        for sign, (g, d, n, partials) in zip((1.0, -1.0), parts(p)):
+            cols += [sign * (-d / n) * (g @ dj) for dj in partials]
+        return np.stack(cols, axis=1)
+    return fun, jac
+
+def _position_residuals(acc, gyr, g_dot):
+    # e_n = |a1 - M1 o1| - |a2 - M2 o2| over (o1, o2)
+    M = _gamma_matrices(gyr, g_dot)
+
+    def parts(p):
+        r1 = acc[:, 0] - M[:, 0] @ p[0:3]
+        r2 = acc[:, 1] - M[:, 1] @ p[3:6]
+        return r1, r2, np.maximum(np.linalg.norm(r1, axis=1), 1e-12), np.maximum(np.linalg.norm(r2, axis=1), 1e-12)
+
+    def fun(p):
+        _, _, n1, n2 = parts(p)
+        return n1 - n2
+
+    def jac(p):
+        r1, r2, n1, n2 = parts(p)
+        return np.concatenate([-np.einsum('na,nab->nb', r1 / n1[:, None], M[:, 0]),
+                               np.einsum('na,nab->nb', r2 / n2[:, None], M[:, 1])], axis=1)
+    return fun, jac
+
+def _solve_replicates(acc, gyr, g_dot, reference, seeds, max_iter):
+    """Solve one bootstrap replicate per seed; returns (R, 4, 3) [j1, j2, o1, o2]."""
+    from scipy.optimize import least_squares
+
+    N = len(gyr)
+    j1, j2, o1, o2 = (np.asarray(v, dtype=np.float64) for v in reference)
+    x_axes = np.array(_cart_to_sph(j1) + _cart_to_sph(j2))
+    x_pos = np.concatenate([o1, o2])
+    out = np.empty((len(seeds), 4, 3))
+    for r, seed in enumerate(seeds):
+        idx = np.random.default_rng(int(seed)).integers(0, N, N)
+        fun, jac = _axis_residuals(gyr[idx])
+        p = least_squares(fun, x_axes, jac=jac, method='lm', max_nfev=max_iter).x
+        a1, a2 = _sph_to_cart(p[0], p[1]), _sph_to_cart(p[2], p[3])
+        fun, jac = _position_residuals(acc[idx], gyr[idx], g_dot[idx])
+        o = least_squares(fun, x_pos, jac=jac, method='lm', max_nfev=max_iter).x
+        # same projection onto the joint axes as identify_joint_position
+        shift = (o[0:3] @ a1 + o[3:6] @ a2) / 2.0
+        out[r] = a1, a2, o[0:3] - a1 * shift, o[3:6] - a2 * shift
+    return out
+
+def _solve_chunk(args):
+    return _solve_replicates(*args)
+
+def _pool_context():
+    # fork shares the already imported numpy / scipy with the workers;
+    # spawn would re-import them in every worker
+    return mp.get_context('fork' if 'fork' in mp.get_all_start_methods() else 'spawn')
+
+def bootstrap_calibration(calibration_data, j1, j2, o1, o2, n_boot=200, level=0.95, workers=None, seed=0,
+                          max_iter=20):
+    """
+    Bootstrap the calibration of one joint.
+    calibration_data: (N, 18) rows as from IMUJointAngle.collect_calibration_data
+                      (typically IMUJointAngle.informative_rows, to bound the cost)
+    j1, j2, o1, o2: main solution; every replicate starts from it
+    max_iter: function evaluations per least-squares solve
+    workers: processes (default: all cores); replicates are split evenly
+    Returns a JSON-friendly report:
+      j1_cone_deg / j2_cone_deg - `level` quantile of the angle between
+                                  replicate and main axis (sign-free)
+      o1_ci / o2_ci             - per-component [low, high] percentile intervals
+      o1_spread / o2_spread     - `level` quantile of |o_replicate - o|
+    """
+    start = time.perf_counter()
+    acc, gyr, g_dot = _split_rows(calibration_data)
+    reference = (j1, j2, o1, o2)
+    seeds = np.random.SeedSequence(seed).generate_state(n_boot)
+    workers = max(1, min(workers or os.cpu_count() or 1, n_boot))
+    chunks = [(acc, gyr, g_dot, reference, s, max_iter) for s in np.array_split(seeds, workers)]
+    if workers == 1:
+        reps = _solve_chunk(chunks[0])
+    else:
+        with ProcessPoolExecutor(workers, mp_context=_pool_context()) as pool:
+            reps = np.concatenate(list(pool.map(_solve_chunk, chunks)))
+
+    q = 100.0 * level
+    lo, hi = 50.0 - q / 2, 50.0 + q / 2
+    report = {'n_boot': int(n_boot), 'level': level, 'n_rows': int(len(gyr)), 'workers': workers}
+    for k, (name, ref) in enumerate((('j1', j1), ('j2', j2))):
+        cos = np.abs(reps[:, k] @ np.asarray(ref, dtype=float))
+        report[f'{name}_cone_deg'] = float(np.percentile(np.degrees(np.arccos(np.clip(cos, 0.0, 1.0))), q))
+    for k, (name, ref) in enumerate((('o1', o1), ('o2', o2)), start=2):
+        report[f'{name}_ci'] = np.percentile(reps[:, k], [lo, hi], axis=0).T.tolist()
+        report[f'{name}_spread'] = float(np.percentile(np.linalg.norm(reps[:, k] - np.asarray(ref), axis=1), q))
+    report['elapsed_s'] = time.perf_counter() - start
+    return report
+
+def calibration_trustworthy(report, max_cone_deg=MAX_CONE_DEG, max_spread=None):
+    """Gate on a bootstrap report: both axis cones (and optionally the position spreads) small enough."""
+    ok = report['j1_cone_deg'] <= max_cone_deg and report['j2_cone_deg'] <= max_cone_deg
+    if max_spread is not None:
+        ok = ok and report['o1_spread'] <= max_spread and report['o2_spread'] <= max_spread
+    return ok
+
+def format_report(report):
+    pct = round(100 * report['level'])
+    return (f"Calibration confidence ({pct}%, {report['n_boot']} replicates, {report['elapsed_s']:.2f}s): "
+            f"j1 within {report['j1_cone_deg']:.1f} deg, j2 within {report['j2_cone_deg']:.1f} deg, "
+            f"o1 +-{report['o1_spread']:.4f}, o2 +-{report['o2_spread']:.4f}")
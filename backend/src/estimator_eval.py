@@ -0,0 +1,316 @@
+# src/estimator_eval.py
+# A/B harness for the knee-angle estimators registered in estimators.py:
+# runs every estimator over a set of recordings, in parallel across
+# recordings, and reports per estimator
+#   accuracy   - against reference angles (e.g. optical motion capture, a
+#                CSV like the angle files main.py writes) or the ground truth
+#                of synthetic recordings; sign and constant offset are
+#                removed first, as estimators differ in both conventions
+#   throughput - samples/s of run_batch over the whole recording
+#   latency    - per-packet update() time (us), as in live capture
+# Every worker runs all estimators on its recording one after another, so
+# the estimators of a recording are timed under the same load.
+#
+#   python src/estimator_eval.py raw_1.jsonl:mocap_1.csv session_2/ --synthetic 4
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from packets import packets_to_array, IMU_FIELDS
+from estimators import ESTIMATORS, make_estimator
+
+GRAVITY = 9.81
+
+# ---------- recordings ----------
+def _smooth_noise(rng, t, n_terms=6, f_lo=0.2, f_hi=1.5):
+    # sum of random sinusoids: smooth, bounded, roughly unit amplitude
+    f = rng.uniform(f_lo, f_hi, n_terms)
+    ph = rng.uniform(0.0, 2 * np.pi, n_terms)
+    return np.sin(2 * np.pi * t[:, None] * f + ph).sum(axis=1) / np.sqrt(n_terms / 2.0)
+
+def synthetic_recording(duration_s=60.0, sampling_rate=50.0, calib_s=10.0, seed=0,
+                        acc_noise=0.05, gyro_noise=0.5):
+    """
+    Simulated hinge knee with known flexion (degrees).
+    The first calib_s seconds are calibration motion (thigh turning about
+    all axes, knee flexing), then walking at about 1 stride/s. Both sensors
+    are mounted with random rotations, away from the joint centre, so the
+    accelerometers also see the rotational terms the calibration models.
+    Returns (packets, true_angles).
+    """
+    from scipy.spatial.transform import Rotation
+
+    rng = np.random.default_rng(seed)
+    dt = 1.0 / sampling_rate
+    # two extra samples either side for the central differences
+    n = int(round(duration_s * sampling_rate))
+    t = (np.arange(-2, n + 2)) * dt
+    j = np.array([0.0, 1.0, 0.0])  # joint axis in the thigh frame
+
+    calib_rv = np.stack([_smooth_noise(rng, t) for _ in range(3)], axis=1) * np.radians(35.0)
+    calib_knee = 50.0 + 35.0 * _smooth_noise(rng, t)
+    f = rng.uniform(0.8, 1.1)
+    walk_rv = np.stack([np.radians(4.0) * _smooth_noise(rng, t),
+                        np.radians(22.0) * np.sin(2 * np.pi * f * t),
+                        np.radians(4.0) * _smooth_noise(rng, t)], axis=1)
+    walk_knee = 35.0 - 28.0 * np.cos(2 * np.pi * f * t) + 8.0 * np.sin(4 * np.pi * f * t)
+    w = 1.0 / (1.0 + np.exp(-(t - calib_s) * 4.0))  # ~1 s crossfade
+    thigh = Rotation.from_rotvec((1 - w)[:, None] * calib_rv + w[:, None] * walk_rv)
+    knee = np.clip((1 - w) * calib_knee + w * walk_knee, 0.0, 120.0)
+    shank = thigh * Rotation.from_rotvec(np.radians(knee)[:, None] * j)
+
+    readings = []
+    for seg, r in ((thigh, [0.02, -0.04, 0.18]), (shank, [-0.03, 0.05, -0.20])):
+        mount = Rotation.from_rotvec(rng.normal(0.0, 1.2, 3))
+        sensor = seg * mount
+        pos = seg.apply(r)
+        acc_world = np.gradient(np.gradient(pos, dt, axis=0), dt, axis=0) + [0.0, 0.0, GRAVITY]
+        acc = sensor.inv().apply(acc_world)
+        # body-frame angular velocity from neighbouring orientations
+        gyr = np.zeros_like(acc)
+        gyr[1:-1] = (sensor[:-2].inv() * sensor[2:]).as_rotvec() / (2 * dt)
+        acc += rng.normal(0.0, acc_noise, acc.shape)
+        gyr = np.degrees(gyr) + rng.normal(0.0, gyro_noise, gyr.shape)
+        readings.append(np.concatenate([acc, gyr], axis=1)[2:-2])
+    packets = [{'IMU1': dict(zip(IMU_FIELDS, r1)), 'IMU2': dict(zip(IMU_FIELDS, r2))}
+               for r1, r2 in zip(readings[0].tolist(), readings[1].tolist())]
+    return packets, knee[2:-2]
+
+def load_packets(path):
+    """Raw packets of a recording: a raw .jsonl file, its .imuz archive or a segmented session directory."""
+    if os.path.isdir(path):
+        from segments import SegmentReader
+        return SegmentReader(path).read_all()
+    if path.endswith('.imuz'):
+        from archive import read_archive
+        return read_archive(path)
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def stored_params(raw_path):
+    """
+    joint_params main.run stored with a {rid}_raw.jsonl / .imuz / {rid}_raw
+    recording ({rid}_calibration.json next to it), or None.
+    """
+    base = os.path.normpath(raw_path)
+    for suffix in ('_raw.jsonl', '_raw.imuz', '_raw'):
+        if base.endswith(suffix):
+            path = base[:-len(suffix)] + '_calibration.json'
+            if os.path.exists(path):
+                with open(path) as f:
+                    return json.load(f)
+    return None
+
+def load_reference(path, n, sampling_rate):
+    """Reference angles from a time_s,angle_deg CSV (or its .imuz archive), interpolated onto the n sample times (NaN outside)."""
+    times, angles = [], []
+    if path.endswith('.imuz'):
+        from archive import read_archive
+        rows = read_archive(path)
+        rows = rows[np.isfinite(rows).all(axis=1)]
+        times, angles = rows[:, 0], rows[:, 1]
+    else:
+        with open(path) as f:
+            next(f)
+            for line in f:
+                ts, _, a = line.strip().partition(',')
+                if ts and a:
+                    times.append(float(ts))
+                    angles.append(float(a))
+    return np.interp(np.arange(n) / sampling_rate, times, angles, left=np.nan, right=np.nan)
+
+def calibrate(packets, sampling_rate):
+    """
+    joint_params from calibration motion. Same axis / position costs as
+    main.calibration_phase, solved by the vectorized KinematicChain solver
+    (IMUJointAngle's scalar cost loop takes minutes per recording).
+    """
+    from kinematic_chain import KinematicChain
+
+    chain = KinematicChain(['IMU1', 'IMU2'], delta_t=1.0 / sampling_rate)
+    chain.calibrate(packets)
+    return {'delta_t': chain.delta_t, 'dtype': chain.dtype.name,
+            'j1': chain.j_prox[0].tolist(), 'j2': chain.j_dist[0].tolist(),
+            'o1': chain.o_prox[0].tolist(), 'o2': chain.o_dist[0].tolist()}
+
+# ---------- scoring ----------
+def angle_errors(angles, reference):
+    """
+    Agreement of estimated and reference angles after matching sign and
+    removing the mean offset. Returns n, sign, bias_deg, rmse_deg, corr.
+    """
+    ok = np.isfinite(angles) & np.isfinite(reference)
+    if ok.sum() < 2:
+        return {'n': int(ok.sum()), 'sign': 1, 'bias_deg': None, 'rmse_deg': None, 'corr': None}
+    a, r = angles[ok], reference[ok]
+    corr = np.corrcoef(a, r)[0, 1] if a.std() > 0 and r.std() > 0 else 0.0
+    sign = -1 if corr < 0 else 1
+    d = sign * a - r
+    bias = d.mean()
+    return {'n': int(ok.sum()), 'sign': sign, 'bias_deg': float(bias),
+            'rmse_deg': float(np.sqrt(np.mean((d - bias) ** 2))), 'corr': float(abs(corr))}
+
+def _time_estimator(name, params, imu, packets, sampling_rate, latency_samples):
+    est = make_estimator(name, params, sampling_rate)
+    t0 = time.perf_counter()
+    angles = est.run_batch(imu)
+    batch_s = time.perf_counter() - t0
+    live = make_estimator(name, params, sampling_rate)
+    lat = np.empty(min(latency_samples, len(packets)))
+    for i in range(len(lat)):
+        t0 = time.perf_counter()
+        live.update(packets[i])
+        lat[i] = time.perf_counter() - t0
+    return np.asarray(angles, dtype=float), batch_s, lat * 1e6
+
+def evaluate_recording(spec):
+    """
+    Run the estimators over one recording.
+    spec: {'name', 'raw' (path) or 'synthetic' (seed), 'reference' (CSV path,
+    optional), 'params' (joint_params, optional), 'sampling_rate', 'calib_s',
+    'settle_s', 'estimators', 'latency_samples'}.
+    Without params, raw recordings use the calibration stored with them
+    (stored_params); otherwise the first calib_s seconds calibrate the
+    knee and are left out of the evaluation; the first settle_s seconds evaluated are
+    skipped for accuracy while the filters converge.
+    """
+    rate = spec['sampling_rate']
+    calib_n = int(spec['calib_s'] * rate)
+    if 'synthetic' in spec:
+        packets, reference = synthetic_recording(duration_s=spec.get('duration_s', 60.0), sampling_rate=rate,
+                                                 calib_s=spec['calib_s'], seed=spec['synthetic'])
+    else:
+        packets = load_packets(spec['raw'])
+        reference = None
+        if spec.get('reference'):
+            reference = load_reference(spec['reference'], len(packets), rate)
+    params = spec.get('params')
+    if params is None and 'raw' in spec:
+        params = stored_params(spec['raw'])
+    start = 0
+    if params is None:
+        params = calibrate(packets[:calib_n], rate)
+        start = calib_n
+    packets = packets[start:]
+    if reference is not None:
+        reference = np.array(reference[start:], dtype=float)
+        reference[:int(spec['settle_s'] * rate)] = np.nan
+    imu = packets_to_array(packets)
+
+    results = {}
+    for name in spec['estimators']:
+        angles, batch_s, lat = _time_estimator(name, params, imu, packets, rate, spec['latency_samples'])
+        results[name] = {
+            'n_samples': len(imu),
+            'coverage': float(np.isfinite(angles).mean()) if len(angles) else 0.0,
+            'accuracy': angle_errors(angles, reference) if reference is not None else None,
+            'batch_s': batch_s,
+            'latency_us': lat,
+        }
+    return spec['name'], results
+
+def _summarize(per_recording, names):
+    summary = {}
+    for name in names:
+        rows = [res[name] for res in per_recording.values()]
+        acc = [r['accuracy'] for r in rows if r['accuracy'] and r['accuracy']['rmse_deg'] is not None]
+        n_acc = sum(a['n'] for a in acc)
+        lat = np.concatenate([r['latency_us'] for r in rows]) if rows else np.zeros(0)
+        n = sum(r['n_samples'] for r in rows)
+        batch_s = sum(r['batch_s'] for r in rows)
+        summary[name] = {
+            'n_recordings': len(rows),
+            'n_samples': n,
+            # pooled over recordings, weighted by compared samples
+            'rmse_deg': float(np.sqrt(sum(a['n'] * a['rmse_deg'] ** 2 for a in acc) / n_acc)) if n_acc else None,
+            'corr': float(sum(a['n'] * a['corr'] for a in acc) / n_acc) if n_acc else None,
+            'samples_per_s': n / batch_s if batch_s > 0 else None,
+            'latency_p50_us': float(np.percentile(lat, 50)) if len(lat) else None,
+            'latency_p99_us': float(np.percentile(lat, 99)) if len(lat) else None,
+        }
+    return summary
+
+def evaluate(recordings, estimators=None, workers=None, sampling_rate=50.0, calib_s=10.0, settle_s=5.0,
+             params=None, latency_samples=2000):
+    """
+    A/B evaluation of the estimators over recordings.
+    recordings: raw paths, (raw, reference CSV) pairs or {'synthetic': seed} dicts
+    estimators: names from estimators.ESTIMATORS (default: all)
+    params: joint_params shared by all recordings; default is each
+            recording's stored calibration, else its first calib_s seconds
+    Returns {'summary': {estimator: ...}, 'recordings': {name: {estimator: ...}}}.
+    """
+    names = list(estimators or ESTIMATORS)
+    for name in names:
+        if name not in ESTIMATORS:
+            raise ValueError(f"Unknown estimator: {name}")
+    specs = []
+    for k, rec in enumerate(recordings):
+        spec = {'sampling_rate': sampling_rate, 'calib_s': calib_s, 'settle_s': settle_s, 'estimators': names,
+                'latency_samples': latency_samples, 'params': params}
+        if isinstance(rec, dict):
+            spec.update(rec)
+        elif isinstance(rec, (tuple, list)):
+            spec['raw'], spec['reference'] = rec
+        else:
+            spec['raw'] = rec
+        spec.setdefault('name', f"synthetic_{spec['synthetic']}" if 'synthetic' in spec
+                        else os.path.basename(os.path.normpath(spec['raw'])))
+        specs.append(spec)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(specs)))
+    if workers == 1:
+        done = [evaluate_recording(s) for s in specs]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            done = list(pool.map(evaluate_recording, specs))
+    per_recording = dict(done)
+    out = {'summary': _summarize(per_recording, names), 'recordings': per_recording}
+    for res in per_recording.values():
+        for r in res.values():
+            lat = r.pop('latency_us')
+            r['latency_p50_us'] = float(np.percentile(lat, 50)) if len(lat) else None
+    return out
+
+def format_summary(summary):
+    fmt = lambda v, spec: '-' if v is None else format(v, spec)
+    lines = [f"{'estimator':<22}{'rmse_deg':>10}{'corr':>8}{'samples/s':>12}{'p50_us':>9}{'p99_us':>9}"]
+    for name, s in summary.items():
+        lines.append(f"{name:<22}{fmt(s['rmse_deg'], '.2f'):>10}{fmt(s['corr'], '.3f'):>8}"
+                     f"{fmt(s['samples_per_s'], '.0f'):>12}{fmt(s['latency_p50_us'], '.1f'):>9}"
+                     f"{fmt(s['latency_p99_us'], '.1f'):>9}")
+    return "\n".join(lines)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare knee-angle estimators on recordings.")
+    parser.add_argument("recordings", nargs="*",
+                        help="raw .jsonl file or session directory, optionally :reference.csv")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="N", help="add N synthetic recordings")
+    parser.add_argument("--estimators", default=None, help=f"comma-separated subset of {', '.join(ESTIMATORS)}")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--sampling-rate", type=float, default=50.0)
+    parser.add_argument("--calib-s", type=float, default=10.0,
+                        help="leading seconds used to calibrate recordings without a stored calibration")
+    parser.add_argument("--calibration", default=None,
+                        help="joint_params JSON to use for every recording instead")
+    parser.add_argument("--json", default=None, help="write the full report here")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    recs = [tuple(r.rsplit(':', 1)) if ':' in r else r for r in args.recordings]
+    recs += [{'synthetic': seed} for seed in range(args.synthetic)]
+    if not recs:
+        sys.exit("No recordings given (paths or --synthetic N).")
+    params = None
+    if args.calibration:
+        with open(args.calibration) as f:
+            params = json.load(f)
+    report = evaluate(recs, estimators=args.estimators.split(',') if args.estimators else None,
+                      workers=args.workers, sampling_rate=args.sampling_rate, calib_s=args.calib_s, params=params)
+    print(format_summary(report['summary']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,143 @@
+# src/estimators.py
+# Knee-angle estimators behind one interface, selected by name (main.py
+# --estimator, the multi-process analysis worker and the A/B harness in
+# estimator_eval.py). An estimator is built from the picklable calibration
+# state of an IMUJointAngle (joint_params; None when uncalibrated) and has
+#   run_batch(imu, valid=None) -> (N,) angles in degrees, NaN where undefined,
+#                                 for an (N, 12) packets_to_array block
+#   update(packet)             -> angle (or None) for one packet, live capture
+# Both continue the estimator's state, so a recording can be fed in blocks.
+import numpy as np
+from packets import array_to_packets
+from processors import process_packet_accel_angle
+from pipeline import accel_angles
+
+# name -> (estimator class, needs calibrated joint axes)
+ESTIMATORS = {}
+
+def estimator(name, needs_calibration=True):
+    """Register an estimator class under `name`."""
+    def register(cls):
+        cls.name = name
+        ESTIMATORS[name] = (cls, needs_calibration)
+        return cls
+    return register
+
+def joint_params(joint_system):
+    """Picklable calibration state of an IMUJointAngle (None if uncalibrated)."""
+    if joint_system is None or joint_system.j1 is None:
+        return None
+    as_list = lambda v: None if v is None else np.asarray(v).tolist()
+    return {
+        'delta_t': joint_system.delta_t,
+        'dtype': joint_system.dtype.name,
+        'j1': as_list(joint_system.j1),
+        'j2': as_list(joint_system.j2),
+        'o1': as_list(joint_system.o1),
+        'o2': as_list(joint_system.o2),
+    }
+
+def needs_calibration(name):
+    return ESTIMATORS[name][1]
+
+def make_estimator(name, params=None, sampling_rate=10.0):
+    """
+    Estimator `name` for calibration `params` (joint_params).
+    Estimators that need calibration fall back to 'accel' without it;
+    .name on the result tells which one was built.
+    """
+    if name not in ESTIMATORS:
+        raise ValueError(f"Unknown estimator: {name}")
+    cls, needs = ESTIMATORS[name]
+    if needs and params is None:
+        cls = ESTIMATORS['accel'][0]
+    return cls(params, sampling_rate)
+
+@estimator('complementary')
+class ComplementaryEstimator:
+    """IMUJointAngle.calculate_angle per sample: gyro integration about j1/j2 with accel correction."""
+    def __init__(self, params, sampling_rate=10.0):
+        from imu_joint_angle import IMUJointAngle
+
+        self.joint = IMUJointAngle(delta_t=params['delta_t'], dtype=params.get('dtype'))
+        for key in ('j1', 'j2', 'o1', 'o2'):
+            if params[key] is not None:
+                setattr(self.joint, key, np.array(params[key]))
+
+    def update(self, packet):
+        try:
+            return self.joint.calculate_angle(packet['IMU1'], packet['IMU2'])
+        except Exception:
+            return process_packet_accel_angle(packet)
+
+    def run_batch(self, imu, valid=None):
+        # invalid rows are skipped, so the filter state bridges the gap
+        out = np.full(len(imu), np.nan)
+        for i, p in enumerate(array_to_packets(imu)):
+            if valid is None or valid[i]:
+                angle = self.update(p)
+                if angle is not None:
+                    out[i] = angle
+        return out
+
+@estimator('complementary_batch')
+class ChainComplementaryEstimator:
+    """The 'complementary' filter vectorized over whole blocks (KinematicChain.angles, one joint)."""
+    def __init__(self, params, sampling_rate=10.0):
+        from kinematic_chain import KinematicChain
+
+        self.chain = KinematicChain(['IMU1', 'IMU2'], delta_t=params['delta_t'], dtype=params.get('dtype'))
+        for key, name in (('j1', 'j_prox'), ('j2', 'j_dist'), ('o1', 'o_prox'), ('o2', 'o_dist')):
+            if params[key] is not None:
+                setattr(self.chain, name, np.array([params[key]]))
+
+    def update(self, packet):
+        return float(self.chain.update(packet)[0])
+
+    def run_batch(self, imu, valid=None):
+        imu = np.asarray(imu).reshape(len(imu), 2, 6)
+        if valid is not None:
+            # zero rows hold the filter state across unrepaired gaps
+            imu = np.where(valid[:, None, None], imu, 0.0)
+        out = self.chain.angles(imu)[:, 0].astype(float)
+        return out if valid is None else np.where(valid, out, np.nan)
+
+class _FlexionFilterEstimator:
+    """Quaternion filter per segment, flexion about j1/j2 (orientation.FlexionEstimator)."""
+    method = None
+
+    def __init__(self, params, sampling_rate=10.0):
+        from orientation import FlexionEstimator
+
+        self.fusion = FlexionEstimator(params['j1'], params['j2'], method=self.method, dt=1.0 / sampling_rate)
+
+    def update(self, packet):
+        return self.fusion.update(packet['IMU1'], packet['IMU2'])
+
+    def run_batch(self, imu, valid=None):
+        if valid is not None:
+            # zero rows hold the filter state across unrepaired gaps
+            imu = np.where(valid[:, None], imu, 0.0)
+        out = self.fusion.run_batch(imu)
+        return out if valid is None else np.where(valid, out, np.nan)
+
+@estimator('madgwick')
+class MadgwickEstimator(_FlexionFilterEstimator):
+    method = 'madgwick'
+
+@estimator('mahony')
+class MahonyEstimator(_FlexionFilterEstimator):
+    method = 'mahony'
+
+@estimator('accel', needs_calibration=False)
+class AccelEstimator:
+    """Angle between the two accel vectors; needs no calibration."""
+    def __init__(self, params=None, sampling_rate=10.0):
+        pass
+
+    def update(self, packet):
+        return process_packet_accel_angle(packet)
+
+    def run_batch(self, imu, valid=None):
+        out = accel_angles(np.asarray(imu))
+        return out if valid is None else np.where(valid, out, np.nan)
@@ -0,0 +1,102 @@
+# src/gait_cycles.py
+import numpy as np
+
+def _as_float_array(values):
+    # angle lists from measurement_phase may contain None for invalid samples
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+def normalize_cycles(angles, event_idx, n_points=101):
+    """
+    Time-normalize a signal to 0..100% of each cycle.
+    angles: sequence (N,) of angle samples (None/NaN allowed)
+    event_idx: sorted sample indices of cycle events (steps or heel strikes);
+               consecutive events bound one cycle
+    n_points: samples per normalized cycle (101 -> 1% resolution)
+    Returns (curves, starts, ends) with curves of shape (n_cycles, n_points).
+    All cycles are resampled in one batched linear interpolation over a
+    2-D index grid, so cost is independent of the number of Python objects.
+    """
+    a = angles if isinstance(angles, np.ndarray) else _as_float_array(angles)
+    ev = np.asarray(event_idx, dtype=np.int64)
+    ev = ev[(ev >= 0) & (ev < len(a))]
+    if len(a) < 2 or len(ev) < 2:
+        empty = np.zeros(0, dtype=np.int64)
+        return np.zeros((0, n_points)), empty, empty
+    starts = ev[:-1]
+    ends = ev[1:]
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+
+    frac = np.linspace(0.0, 1.0, n_points)
+    pos = starts[:, None] + frac[None, :] * (ends - starts)[:, None]
+    i0 = np.minimum(np.floor(pos).astype(np.int64), len(a) - 2)
+    w = pos - i0
+    curves = a[i0] * (1.0 - w) + a[i0 + 1] * w
+    return curves, starts, ends
+
+def flag_outlier_cycles(curves, outlier_z=3.5):
+    """
+    Flag cycles whose RMS distance from the ensemble mean is unusually large.
+    Uses a robust z-score (median / MAD) so a few bad strides cannot hide
+    themselves by inflating the spread. Returns (is_outlier, rms_distance).
+    """
+    n = curves.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=bool), np.zeros(0)
+    mean_curve = np.nanmean(curves, axis=0)
+    rms = np.sqrt(np.nanmean((curves - mean_curve[None, :]) ** 2, axis=1))
+    # cycles that are entirely NaN cannot be compared; treat them as outliers
+    bad = ~np.isfinite(rms)
+    if n < 3:
+        return bad, rms
+    med = np.nanmedian(rms)
+    mad = 1.4826 * np.nanmedian(np.abs(rms - med))
+    if not np.isfinite(mad) or mad < 1e-9:
+        return bad, rms
+    z = (rms - med) / mad
+    return bad | (z > outlier_z), rms
+
+def _json_list(arr):
+    return [None if not np.isfinite(v) else float(v) for v in arr]
+
+def gait_cycle_summary(angles, event_idx, sampling_rate=10.0, n_points=101,
+                       min_cycle_s=0.4, max_cycle_s=3.0, outlier_z=3.5, valid=None):
+    """
+    Ensemble-average knee angle vs % gait cycle.
+    angles: per-sample angles (degrees, None allowed)
+    event_idx: step / heel-strike sample indices from the same leg
+    min_cycle_s/max_cycle_s: cycles outside this duration are discarded
+    (missed or double-detected events)
+    valid: optional (N,) bool mask; cycles touching an invalid sample
+    (e.g. a long packet-loss gap) are discarded
+    Returns a JSON-serializable dict with mean and SD curves, per-cycle
+    durations and the indices of cycles flagged as outliers.
+    """
+    curves, starts, ends = normalize_cycles(angles, event_idx, n_points=n_points)
+    durations = (ends - starts) / float(sampling_rate)
+    keep = (durations >= min_cycle_s) & (durations <= max_cycle_s)
+    if valid is not None and len(starts):
+        bad = np.concatenate(([0], np.cumsum(~np.asarray(valid, dtype=bool))))
+        keep &= bad[ends + 1] == bad[starts]
+    curves, starts, durations = curves[keep], starts[keep], durations[keep]
+
+    is_outlier, rms = flag_outlier_cycles(curves, outlier_z=outlier_z)
+    inliers = curves[~is_outlier]
+    if inliers.shape[0] > 0:
+        mean_curve = np.nanmean(inliers, axis=0)
+        sd_curve = np.nanstd(inliers, axis=0)
+    else:
+        mean_curve = np.full(n_points, np.nan)
+        sd_curve = np.full(n_points, np.nan)
+
+    return {
+        'n_cycles': int(curves.shape[0]),
+        'n_outliers': int(is_outlier.sum()),
+        'percent_cycle': np.linspace(0.0, 100.0, n_points).tolist(),
+        'mean_curve_deg': _json_list(mean_curve),
+        'sd_curve_deg': _json_list(sd_curve),
+        'cycle_start_times_s': (starts / float(sampling_rate)).tolist(),
+        'cycle_durations_s': durations.tolist(),
+        'cycle_rms_deviation_deg': _json_list(rms),
+        'outlier_cycles': np.flatnonzero(is_outlier).tolist(),
+    }
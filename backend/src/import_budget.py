@@ -0,0 +1,69 @@
+# src/import_budget.py
+"""
+Import-time benchmark for the CLI and server entry points.
+
+Each target runs in a fresh interpreter a few times; the best wall time is
+compared against its budget. Exits non-zero when any target is over budget
+and prints the slowest imports (from `python -X importtime`) for it.
+
+    python src/import_budget.py            # from backend/
+    python src/import_budget.py --runs 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# name -> (python argv, budget seconds). Budgets include interpreter startup.
+TARGETS = {
+    'main --help': (['main.py', '--help'], 0.6),
+    'import main': (['-c', 'import main'], 0.6),
+    'import server': (['-c', 'import server'], 1.5),
+}
+
+def time_target(argv, runs):
+    best = float('inf')
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable] + argv, cwd=SRC_DIR, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def slowest_imports(argv, top=8):
+    # -X importtime writes "import time: self | cumulative | name" to stderr
+    cmd = [sys.executable, '-X', 'importtime'] + argv
+    res = subprocess.run(cmd, cwd=SRC_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    rows = []
+    for line in res.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        rows.append((int(parts[1]), parts[2].rstrip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check entry-point import times against budgets.")
+    parser.add_argument('--runs', type=int, default=3, help="runs per target (best time is used)")
+    args = parser.parse_args(argv)
+
+    failed = []
+    for name, (target_argv, budget) in TARGETS.items():
+        elapsed = time_target(target_argv, args.runs)
+        status = 'OK' if elapsed <= budget else 'OVER'
+        print(f"[{status}] {name:<15} {elapsed * 1000:7.0f} ms  (budget {budget * 1000:.0f} ms)")
+        if elapsed > budget:
+            failed.append((name, target_argv))
+
+    for name, target_argv in failed:
+        print(f"\nSlowest imports for '{name}' (cumulative us):")
+        for cum_us, mod in slowest_imports(target_argv):
+            print(f"  {cum_us:>9}  {mod}")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
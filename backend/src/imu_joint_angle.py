@@ -1,26 +1,88 @@
 # src/imu_joint_angle.py
 import numpy as np
-from scipy.optimize import minimize
+from packets import resolve_dtype
+from sample_selection import select_informative
 
 class IMUJointAngle:
-    def __init__(self, delta_t=0.1):
+    def __init__(self, delta_t=0.1, gdot_lag=2, dtype=None):
         """
         Initialize IMU-based joint angle measurement system
         delta_t: sampling period in seconds
+        gdot_lag: samples of delay for the live angular-acceleration estimate
+                  (0..4). 2 gives the centred 5-point stencil used by
+                  collect_calibration_data; smaller lags use one-sided
+                  5-point stencils with less delay and more noise.
+        dtype: precision of the calibration matrix and gyro history
+               (packets.resolve_dtype); the optimizers and the filter state
+               stay float64.
         """
         self.delta_t = delta_t
+        self.dtype = resolve_dtype(dtype)
         self.j1 = None
         self.j2 = None
         self.o1 = None
         self.o2 = None
+        self.calibration_ci = None
 
         self.prev_angle_gyr = 0.0
         self.prev_angle_acc_gyr = 0.0
         self.lambda_filter = 0.01
 
+        # fixed 5-sample gyro history [g1, g2] for g_dot in calculate_angle
+        self.gdot_lag = gdot_lag
+        self._gdot_weights = self._stencil_weights(gdot_lag, delta_t)
+        self._gyro_hist = np.zeros((5, 6), dtype=self.dtype)
+        self._hist_pos = 0
+        self._hist_count = 0
+
+    @staticmethod
+    def _stencil_weights(lag, delta_t):
+        """
+        First-derivative weights over the last 5 samples, evaluated `lag`
+        samples back, pre-rotated for every ring-buffer write position:
+        row p holds the weights per buffer slot when the newest sample is in slot p.
+        """
+        if not 0 <= lag <= 4:
+            raise ValueError("gdot_lag must be between 0 and 4")
+        offsets = np.arange(-4, 1) + lag  # oldest..newest, relative to the evaluation sample
+        A = np.vander(offsets, 5, increasing=True).T
+        b = np.zeros(5)
+        b[1] = 1.0
+        w = np.linalg.solve(A, b) / delta_t
+        rotated = np.zeros((5, 5))
+        for p in range(5):
+            for k in range(5):
+                rotated[p, (p + 1 + k) % 5] = w[k]
+        return rotated
+
+    def _update_gyro_derivative(self, g1, g2):
+        """Push one gyro sample pair, return (g_dot1, g_dot2). O(1), in place."""
+        pos = self._hist_pos
+        hist = self._gyro_hist
+        hist[pos, 0:3] = g1
+        hist[pos, 3:6] = g2
+        self._hist_count += 1
+        if self._hist_count >= 5:
+            g_dot = self._gdot_weights[pos] @ hist
+        elif self._hist_count >= 2:
+            # not enough history yet: backward difference fallback
+            g_dot = (hist[pos] - hist[(pos - 1) % 5]) / self.delta_t
+        else:
+            g_dot = np.zeros(6)
+        self._hist_pos = (pos + 1) % 5
+        return g_dot[0:3], g_dot[3:6]
+
+    def reset_stream_state(self):
+        """Forget filter and gyro history, e.g. between recordings."""
+        self.prev_angle_gyr = 0.0
+        self.prev_angle_acc_gyr = 0.0
+        self._gyro_hist[:] = 0.0
+        self._hist_pos = 0
+        self._hist_count = 0
+
     def collect_calibration_data(self, imu1_data, imu2_data):
         N = len(imu1_data)
-        data = np.zeros((N, 18))
+        data = np.zeros((N, 18), dtype=self.dtype)
         for i in range(N):
             data[i, 0:3] = [imu1_data[i]['Ax'], imu1_data[i]['Ay'], imu1_data[i]['Az']]
             data[i, 3:6] = [imu1_data[i]['Gx'], imu1_data[i]['Gy'], imu1_data[i]['Gz']]
@@ -45,7 +107,23 @@ class IMUJointAngle:
 
         return data
 
-    def identify_joint_axis(self, calibration_data, max_iter=200):
+    def informative_rows(self, calibration_data, max_samples=400):
+        """
+        Bounded, well-spread subset of calibration_data rows for the
+        optimizers (sample_selection.select_informative); None keeps all rows.
+        """
+        if max_samples is None:
+            return calibration_data
+        gyr = calibration_data[:, [3, 4, 5, 12, 13, 14]].reshape(-1, 2, 3)
+        g_dot = calibration_data[:, [6, 7, 8, 15, 16, 17]].reshape(-1, 2, 3)
+        return calibration_data[select_informative(gyr, g_dot, max_samples=max_samples)]
+
+    def identify_joint_axis(self, calibration_data, max_iter=200, max_samples=400):
+        # scipy.optimize is slow to import; only pay for it when calibrating
+        from scipy.optimize import minimize
+
+        rows = self.informative_rows(calibration_data, max_samples)
+
         def sph_to_cart(phi, theta):
             return np.array([np.cos(phi) * np.cos(theta),
                              np.cos(phi) * np.sin(theta),
@@ -55,9 +133,9 @@ class IMUJointAngle:
             j1 = sph_to_cart(phi1, theta1)
             j2 = sph_to_cart(phi2, theta2)
             error = 0.0
-            for i in range(len(calibration_data)):
-                g1 = calibration_data[i, 3:6]
-                g2 = calibration_data[i, 12:15]
+            for i in range(len(rows)):
+                g1 = rows[i, 3:6]
+                g2 = rows[i, 12:15]
                 cross1 = np.cross(g1, j1)
                 cross2 = np.cross(g2, j2)
                 error += (np.linalg.norm(cross1) - np.linalg.norm(cross2))**2
@@ -68,6 +146,7 @@ class IMUJointAngle:
         phi1, theta1, phi2, theta2 = result.x
         self.j1 = sph_to_cart(phi1, theta1)
         self.j2 = sph_to_cart(phi2, theta2)
+        # sign matching looks at a contiguous window, so it needs the full recording
         self._match_joint_axis_signs(calibration_data)
         return result
 
@@ -115,7 +194,11 @@ class IMUJointAngle:
         if corr_neg > corr_pos:
             self.j2 = -self.j2
 
-    def identify_joint_position(self, calibration_data, max_iter=200):
+    def identify_joint_position(self, calibration_data, max_iter=200, max_samples=400):
+        from scipy.optimize import minimize
+
+        rows = self.informative_rows(calibration_data, max_samples)
+
         def gamma(g, g_dot, o):
             return np.cross(g, np.cross(g, o)) + np.cross(g_dot, o)
 
@@ -123,13 +206,13 @@ class IMUJointAngle:
             o1 = params[0:3]
             o2 = params[3:6]
             error = 0.0
-            for i in range(len(calibration_data)):
-                a1 = calibration_data[i, 0:3]
-                g1 = calibration_data[i, 3:6]
-                g_dot1 = calibration_data[i, 6:9]
-                a2 = calibration_data[i, 9:12]
-                g2 = calibration_data[i, 12:15]
-                g_dot2 = calibration_data[i, 15:18]
+            for i in range(len(rows)):
+                a1 = rows[i, 0:3]
+                g1 = rows[i, 3:6]
+                g_dot1 = rows[i, 6:9]
+                a2 = rows[i, 9:12]
+                g2 = rows[i, 12:15]
+                g_dot2 = rows[i, 15:18]
                 shifted_a1 = a1 - gamma(g1, g_dot1, o1)
                 shifted_a2 = a2 - gamma(g2, g_dot2, o2)
                 error += (np.linalg.norm(shifted_a1) - np.linalg.norm(shifted_a2))**2
@@ -147,6 +230,23 @@ class IMUJointAngle:
         self.o2 = o2_hat - self.j2 * shift
         return result
 
+    def bootstrap(self, calibration_data, n_boot=200, level=0.95, workers=None, max_samples=400, **kwargs):
+        """
+        Confidence of the current calibration: resamples the (informative)
+        calibration rows and re-solves axes and positions in parallel.
+        Returns the calibration_bootstrap report (axis cones in degrees,
+        position intervals) and keeps it as self.calibration_ci.
+        """
+        # kinematic_chain imports this module; defer the import to call time
+        from calibration_bootstrap import bootstrap_calibration
+
+        if self.j1 is None or self.o1 is None:
+            raise ValueError("Calibrate axes and positions before bootstrapping.")
+        self.calibration_ci = bootstrap_calibration(self.informative_rows(calibration_data, max_samples),
+                                                    self.j1, self.j2, self.o1, self.o2,
+                                                    n_boot=n_boot, level=level, workers=workers, **kwargs)
+        return self.calibration_ci
+
     def calculate_angle(self, imu1_reading, imu2_reading):
         if self.j1 is None or self.j2 is None:
             raise ValueError("Joint axes not identified.")
@@ -157,10 +257,9 @@ class IMUJointAngle:
 
         angle_gyr_increment = (np.dot(g1, self.j1) - np.dot(g2, self.j2)) * self.delta_t
         angle_gyr = self.prev_angle_gyr + angle_gyr_increment
+        g_dot1, g_dot2 = self._update_gyro_derivative(g1, g2)
 
         if self.o1 is not None and self.o2 is not None:
-            g_dot1 = np.zeros(3)
-            g_dot2 = np.zeros(3)
             gamma1 = np.cross(g1, np.cross(g1, self.o1)) + np.cross(g_dot1, self.o1)
             gamma2 = np.cross(g2, np.cross(g2, self.o2)) + np.cross(g_dot2, self.o2)
             a1_shifted = a1 - gamma1
@@ -0,0 +1,351 @@
+# src/kinematic_chain.py
+import json
+import warnings
+import numpy as np
+from packets import packets_to_array, resolve_dtype, IMU_FIELDS
+from imu_joint_angle import IMUJointAngle
+from sample_selection import select_informative
+
+# default chain: the original two-sensor knee setup
+DEFAULT_CHAIN = {'sensors': ['IMU1', 'IMU2'], 'joints': ['knee']}
+
+def load_chain_config(path):
+    """
+    Chain config JSON, e.g.
+      {"sensors": ["PELVIS", "THIGH", "SHANK", "FOOT"], "joints": ["hip", "knee", "ankle"]}
+    sensors are packet keys from proximal to distal; joint k connects
+    sensors k and k + 1, so len(joints) == len(sensors) - 1.
+    """
+    with open(path) as f:
+        return json.load(f)
+
+def _sph_to_cart(phi, theta):
+    # (...,) angles -> (..., 3) unit vectors, same convention as IMUJointAngle
+    return np.stack([np.cos(phi) * np.cos(theta), np.cos(phi) * np.sin(theta), np.sin(phi)], axis=-1)
+
+def _cart_to_sph(j):
+    # inverse of _sph_to_cart: (..., 3) unit vectors -> (phi, theta)
+    return np.arcsin(np.clip(j[..., 2], -1.0, 1.0)), np.arctan2(j[..., 1], j[..., 0])
+
+def _sph_partials(phi, theta):
+    d_phi = np.stack([-np.sin(phi) * np.cos(theta), -np.sin(phi) * np.sin(theta), np.cos(phi)], axis=-1)
+    d_theta = np.stack([-np.cos(phi) * np.sin(theta), np.cos(phi) * np.cos(theta), np.zeros_like(phi)], axis=-1)
+    return d_phi, d_theta
+
+def _plane_basis(j):
+    """(J, 3) axes -> orthonormal (x, y) spanning each axis' normal plane."""
+    x = np.cross(j, np.array([1.0, 0.0, 0.0]))
+    degenerate = np.linalg.norm(x, axis=-1) < 1e-6
+    x[degenerate] = (0.0, 1.0, 0.0)
+    x /= np.linalg.norm(x, axis=-1, keepdims=True)
+    return x, np.cross(j, x)
+
+def _skew(v):
+    # (..., 3) -> (..., 3, 3) cross-product matrices
+    z = np.zeros(v.shape[:-1], dtype=v.dtype)
+    return np.stack([np.stack([z, -v[..., 2], v[..., 1]], -1),
+                     np.stack([v[..., 2], z, -v[..., 0]], -1),
+                     np.stack([-v[..., 1], v[..., 0], z], -1)], -2)
+
+def _gamma_matrices(g, g_dot):
+    """M with M o = g x (g x o) + g_dot x o (the IMUJointAngle gamma), shape (..., 3, 3)."""
+    gg = np.einsum('...i,...j->...ij', g, g)
+    sq = np.einsum('...i,...i->...', g, g)[..., None, None]
+    return gg - sq * np.eye(3, dtype=gg.dtype) + _skew(g_dot)
+
+def joint_angle_summary(angles, joints):
+    """JSON-friendly per-joint stats from (N, J) angles (NaN = no estimate)."""
+    finite = np.isfinite(angles)
+    out = {}
+    with warnings.catch_warnings():
+        # all-NaN joints are reported as None below
+        warnings.simplefilter('ignore', RuntimeWarning)
+        stats = {
+            'mean_deg': np.nanmean(angles, axis=0),
+            'std_deg': np.nanstd(angles, axis=0),
+            'min_deg': np.nanmin(angles, axis=0),
+            'max_deg': np.nanmax(angles, axis=0),
+        }
+    for k, name in enumerate(joints):
+        if not finite[:, k].any():
+            out[name] = None
+            continue
+        out[name] = {key: float(v[k]) for key, v in stats.items()}
+        out[name]['rom_deg'] = out[name]['max_deg'] - out[name]['min_deg']
+    return out
+
+class KinematicChain:
+    """
+    Chain of S IMUs and S - 1 hinge joints, each joint handled exactly like
+    IMUJointAngle (axis and position identification, complementary filter),
+    but with every step stacked across joints:
+    - calibration: one BFGS problem over all joints, vectorized cost and
+      analytic gradient (the per-joint problems are independent, so this
+      is the same optimum as solving them one by one)
+    - angles: one call per batch of samples returns (N, J) angles; the
+      filter recursion is evaluated in closed form over blocks of samples
+    Per-joint arrays: j_prox/j_dist (J, 3) axes in the proximal/distal
+    sensor frames, o_prox/o_dist (J, 3) joint positions.
+    """
+    BLOCK = 256  # filter block length; keeps the running products well above underflow
+
+    def __init__(self, sensors=None, joints=None, delta_t=0.1, gdot_lag=2, lambda_filter=0.01, dtype=None):
+        sensors = list(sensors or DEFAULT_CHAIN['sensors'])
+        if len(sensors) < 2:
+            raise ValueError("A chain needs at least two sensors")
+        joints = list(joints or [f"{a}-{b}" for a, b in zip(sensors[:-1], sensors[1:])])
+        if len(joints) != len(sensors) - 1:
+            raise ValueError("A chain of N sensors has N - 1 joints")
+        # names key packets and the metrics: joint k is implied by sensors k, k + 1, so it is a name, not a pair
+        for kind, names in (('sensor', sensors), ('joint', joints)):
+            bad = [n for n in names if not isinstance(n, str) or not n]
+            if bad:
+                raise ValueError(f"Chain {kind}s must be non-empty strings, got {bad!r}")
+            if len(set(names)) != len(names):
+                raise ValueError(f"Chain {kind} names must be unique")
+        self.sensors = sensors
+        self.joints = joints
+        self.delta_t = delta_t
+        self.lambda_filter = lambda_filter
+        # sample / angle precision (packets.resolve_dtype); optimizers and filter state stay float64
+        self.dtype = resolve_dtype(dtype)
+        self.j_prox = self.j_dist = self.o_prox = self.o_dist = None
+        # causal 5-point stencil, same weights as the live IMUJointAngle estimate
+        self._gdot_weights = IMUJointAngle._stencil_weights(gdot_lag, delta_t)[4]
+        self.reset_stream_state()
+
+    @classmethod
+    def from_config(cls, config, delta_t=0.1, **kwargs):
+        if isinstance(config, str):
+            config = load_chain_config(config)
+        return cls(config['sensors'], config.get('joints'), delta_t=delta_t, **kwargs)
+
+    @property
+    def n_joints(self):
+        return len(self.joints)
+
+    @property
+    def calibrated(self):
+        return self.j_prox is not None
+
+    def reset_stream_state(self):
+        J = len(self.sensors) - 1
+        self._angle = np.zeros(J)
+        self._angle_gyr = np.zeros(J)
+        self._gyro_hist = np.zeros((0, len(self.sensors), 3), dtype=self.dtype)
+        self._n_seen = 0
+
+    # ---------- data layout ----------
+    def to_array(self, packets):
+        """Packets -> (N, S, 6) [Ax Ay Az Gx Gy Gz] per sensor."""
+        return packets_to_array(packets, imus=self.sensors, dtype=self.dtype).reshape(len(packets), len(self.sensors),
+                                                                    len(IMU_FIELDS))
+
+    def calibration_derivatives(self, gyr):
+        """Centred 5-point gyro derivative over (N, S, 3), as collect_calibration_data."""
+        N = len(gyr)
+        g_dot = np.zeros_like(gyr)
+        dt = self.delta_t
+        if N >= 5:
+            g_dot[2:N - 2] = (gyr[:N - 4] - 8 * gyr[1:N - 3] + 8 * gyr[3:N - 1] - gyr[4:]) / (12 * dt)
+        head = np.arange(min(2, N))
+        g_dot[head] = (gyr[np.minimum(N - 1, head + 1)] - gyr[head]) / dt
+        tail = np.arange(max(2, N - 2), N)
+        g_dot[tail] = (gyr[tail] - gyr[np.maximum(0, tail - 1)]) / dt
+        return g_dot
+
+    def _stream_derivatives(self, gyr):
+        # causal derivative continuing the gyro history of previous batches
+        G = np.concatenate([self._gyro_hist, gyr])
+        k = len(self._gyro_hist)
+        t = k + np.arange(len(gyr))
+        seen = self._n_seen + np.arange(len(gyr))
+        g_dot = np.zeros_like(gyr)
+        full = seen >= 4
+        if full.any():
+            windows = np.lib.stride_tricks.sliding_window_view(G, 5, axis=0)  # (M, S, 3, 5)
+            g_dot[full] = windows[t[full] - 4] @ self._gdot_weights
+        early = (seen >= 1) & ~full
+        g_dot[early] = (G[t[early]] - G[t[early] - 1]) / self.delta_t
+        self._gyro_hist = G[-4:].copy()
+        self._n_seen += len(gyr)
+        return g_dot
+
+    # ---------- calibration ----------
+    def identify_joint_axes(self, gyr, max_iter=200, rows=None):
+        """
+        gyr: (N, S, 3). Sets j_prox / j_dist for all joints at once.
+        rows: optional sample indices for the cost (see calibrate); sign
+              matching always uses the full, contiguous recording.
+        """
+        from scipy.optimize import minimize
+
+        J = self.n_joints
+        sel = np.asarray(gyr if rows is None else gyr[rows], dtype=np.float64)
+        g1, g2 = sel[:, :-1], sel[:, 1:]  # (N, J, 3) proximal / distal
+        sq1 = np.einsum('njk,njk->nj', g1, g1)
+        sq2 = np.einsum('njk,njk->nj', g2, g2)
+
+        def cost(params):
+            p = params.reshape(J, 4)
+            j1, j2 = _sph_to_cart(p[:, 0], p[:, 1]), _sph_to_cart(p[:, 2], p[:, 3])
+            d1 = np.einsum('njk,jk->nj', g1, j1)
+            d2 = np.einsum('njk,jk->nj', g2, j2)
+            # |g x j| for unit j
+            n1 = np.sqrt(np.maximum(sq1 - d1 * d1, 1e-12))
+            n2 = np.sqrt(np.maximum(sq2 - d2 * d2, 1e-12))
+            e = n1 - n2
+            grad = np.empty((J, 4))
+            for col, (j, g, d, n, sign) in enumerate(((p[:, 0:2], g1, d1, n1, 1.0), (p[:, 2:4], g2, d2, n2, -1.0))):
+                dphi, dtheta = _sph_partials(j[:, 0], j[:, 1])
+                w = 2.0 * e * sign * (-d / n)  # d cost / d (g . j) * ... per sample
+                grad[:, 2 * col] = np.einsum('nj,njk,jk->j', w, g, dphi)
+                grad[:, 2 * col + 1] = np.einsum('nj,njk,jk->j', w, g, dtheta)
+            return float(np.sum(e * e)), grad.ravel()
+
+        result = minimize(cost, np.zeros(4 * J), jac=True, method='BFGS', options={'maxiter': max_iter})
+        p = result.x.reshape(J, 4)
+        self.j_prox = _sph_to_cart(p[:, 0], p[:, 1])
+        self.j_dist = _sph_to_cart(p[:, 2], p[:, 3])
+        self._match_axis_signs(gyr)
+        return result
+
+    def _match_axis_signs(self, gyr, window=5):
+        # IMUJointAngle._match_joint_axis_signs for all joints: around the least
+        # active sample, flip j_dist if the in-plane gyro projections anti-correlate
+        g1, g2 = gyr[:, :-1], gyr[:, 1:]
+        N = len(gyr)
+        activity = np.abs(np.einsum('njk,jk->nj', g1, self.j_prox)) + np.abs(np.einsum('njk,jk->nj', g2, self.j_dist))
+        centre = np.argmin(activity, axis=0)  # (J,)
+        idx = centre[:, None] + np.arange(-window, window)[None, :]  # (J, 2w)
+        in_range = (idx >= 0) & (idx < N)
+        idx = np.clip(idx, 0, N - 1)
+        joints = np.arange(self.n_joints)[:, None]
+        x1, y1 = _plane_basis(self.j_prox)
+        x2, y2 = _plane_basis(self.j_dist)
+        w1, w2 = g1[idx, joints], g2[idx, joints]  # (J, 2w, 3)
+        p1 = np.stack([np.einsum('jwk,jk->jw', w1, x1), np.einsum('jwk,jk->jw', w1, y1)], -1)
+        p2 = np.stack([np.einsum('jwk,jk->jw', w2, x2), np.einsum('jwk,jk->jw', w2, y2)], -1)
+        m = np.repeat(in_range[..., None], 2, axis=-1).astype(float)
+        cnt = m.sum(axis=(1, 2))
+        mu1 = (p1 * m).sum(axis=(1, 2)) / cnt
+        mu2 = (p2 * m).sum(axis=(1, 2)) / cnt
+        cov = (((p1 - mu1[:, None, None]) * (p2 - mu2[:, None, None])) * m).sum(axis=(1, 2))
+        # corr(p1, -p2) > corr(p1, p2)  <=>  covariance < 0
+        self.j_dist = np.where((cov < 0)[:, None], -self.j_dist, self.j_dist)
+
+    def identify_joint_positions(self, acc, gyr, g_dot, max_iter=200):
+        """acc, gyr, g_dot: (N, S, 3) (or a row subset). Sets o_prox / o_dist (needs the axes)."""
+        from scipy.optimize import minimize
+
+        if not self.calibrated:
+            raise ValueError("Joint axes must be identified first.")
+        J = self.n_joints
+        acc, gyr, g_dot = (np.asarray(v, dtype=np.float64) for v in (acc, gyr, g_dot))
+        M = _gamma_matrices(gyr, g_dot)  # (N, S, 3, 3)
+        M1, M2 = M[:, :-1], M[:, 1:]
+        a1, a2 = acc[:, :-1], acc[:, 1:]
+
+        def cost(params):
+            o = params.reshape(J, 2, 3)
+            r1 = a1 - np.einsum('njab,jb->nja', M1, o[:, 0])
+            r2 = a2 - np.einsum('njab,jb->nja', M2, o[:, 1])
+            n1 = np.maximum(np.linalg.norm(r1, axis=-1), 1e-12)
+            n2 = np.maximum(np.linalg.norm(r2, axis=-1), 1e-12)
+            e = n1 - n2
+            grad = np.empty((J, 2, 3))
+            grad[:, 0] = -np.einsum('nj,njab,nja->jb', 2.0 * e / n1, M1, r1)
+            grad[:, 1] = np.einsum('nj,njab,nja->jb', 2.0 * e / n2, M2, r2)
+            return float(np.sum(e * e)), grad.ravel()
+
+        result = minimize(cost, np.full(6 * J, 0.05), jac=True, method='BFGS', options={'maxiter': max_iter})
+        o = result.x.reshape(J, 2, 3)
+        # project to the joint axis, as IMUJointAngle.identify_joint_position
+        shift = (np.einsum('jk,jk->j', o[:, 0], self.j_prox) + np.einsum('jk,jk->j', o[:, 1], self.j_dist)) / 2.0
+        self.o_prox = o[:, 0] - self.j_prox * shift[:, None]
+        self.o_dist = o[:, 1] - self.j_dist * shift[:, None]
+        return result
+
+    def calibrate(self, packets, max_iter=200, max_samples=400):
+        """
+        Axes and positions of every joint from calibration packets.
+        max_samples: bound on the rows the optimizers see
+                     (sample_selection.select_informative); None uses all.
+        """
+        imu = self.to_array(packets)
+        acc, gyr = imu[..., 0:3], imu[..., 3:6]
+        g_dot = self.calibration_derivatives(gyr)
+        rows = None if max_samples is None else select_informative(gyr, g_dot, max_samples=max_samples)
+        self.identify_joint_axes(gyr, max_iter=max_iter, rows=rows)
+        if rows is not None:
+            acc, gyr, g_dot = acc[rows], gyr[rows], g_dot[rows]
+        self.identify_joint_positions(acc, gyr, g_dot, max_iter=max_iter)
+
+    # ---------- angles ----------
+    def angles(self, imu):
+        """
+        Joint angles (deg) for a batch of samples, continuing the filter
+        state of earlier calls (stream in batches of any size, incl. 1).
+        imu: (N, S, 6) from to_array, or packets. Returns (N, J).
+        """
+        if not self.calibrated:
+            raise ValueError("Joint axes not identified.")
+        if not isinstance(imu, np.ndarray):
+            imu = self.to_array(imu)
+        dt = self.dtype
+        imu = imu.astype(dt, copy=False)
+        j_prox, j_dist = self.j_prox.astype(dt), self.j_dist.astype(dt)
+        acc, gyr = imu[..., 0:3], imu[..., 3:6]
+        N = len(imu)
+        g_dot = self._stream_derivatives(gyr)
+        g1, g2 = gyr[:, :-1], gyr[:, 1:]
+        increment = (np.einsum('njk,jk->nj', g1, j_prox) - np.einsum('njk,jk->nj', g2, j_dist)) * dt.type(self.delta_t)
+        angle_gyr = self._angle_gyr + np.cumsum(increment, axis=0, dtype=np.float64)
+        if N:
+            self._angle_gyr = angle_gyr[-1].copy()
+        if self.o_prox is None:
+            return angle_gyr.astype(dt)
+
+        M = _gamma_matrices(gyr, g_dot)
+        s1 = acc[:, :-1] - np.einsum('njab,jb->nja', M[:, :-1], self.o_prox.astype(dt))
+        s2 = acc[:, 1:] - np.einsum('njab,jb->nja', M[:, 1:], self.o_dist.astype(dt))
+        x1, y1 = (v.astype(dt) for v in _plane_basis(self.j_prox))
+        x2, y2 = (v.astype(dt) for v in _plane_basis(self.j_dist))
+        p1x, p1y = np.einsum('nja,ja->nj', s1, x1), np.einsum('nja,ja->nj', s1, y1)
+        p2x, p2y = np.einsum('nja,ja->nj', s2, x2), np.einsum('nja,ja->nj', s2, y2)
+        valid = (np.hypot(p1x, p1y) > 1e-6) & (np.hypot(p2x, p2y) > 1e-6)
+        angle_acc = np.degrees(np.arctan2(p1y, p1x) - np.arctan2(p2y, p2x))
+
+        # angle_t = c_t * angle_{t-1} + x_t with c = 1 - lambda (accel usable)
+        # or 1 (accel unusable: the previous output stands in for it)
+        lam = dt.type(self.lambda_filter)
+        c = np.where(valid, 1 - lam, dt.type(1))
+        x = np.where(valid, lam * angle_acc, dt.type(0)) + (1 - lam) * increment
+        out = np.empty((N, self.n_joints), dtype=dt)
+        y = self._angle
+        for start in range(0, N, self.BLOCK):
+            sl = slice(start, start + self.BLOCK)
+            P = np.exp(np.cumsum(np.log(c[sl]), axis=0))
+            out[sl] = P * (y + np.cumsum(x[sl] / P, axis=0, dtype=np.float64))
+            y = out[sl][-1]
+        self._angle = y.copy()
+        return out
+
+    def update(self, packet):
+        """One packet -> (J,) joint angles."""
+        return self.angles(self.to_array([packet]))[0]
+
+    def params(self):
+        """Picklable calibration state (see estimators.joint_params)."""
+        as_list = lambda v: None if v is None else np.asarray(v).tolist()
+        return {'sensors': self.sensors, 'joints': self.joints, 'delta_t': self.delta_t, 'dtype': self.dtype.name,
+                'j_prox': as_list(self.j_prox), 'j_dist': as_list(self.j_dist),
+                'o_prox': as_list(self.o_prox), 'o_dist': as_list(self.o_dist)}
+
+    @classmethod
+    def from_params(cls, params):
+        chain = cls(params['sensors'], params['joints'], delta_t=params['delta_t'], dtype=params.get('dtype'))
+        for key in ('j_prox', 'j_dist', 'o_prox', 'o_dist'):
+            if params[key] is not None:
+                setattr(chain, key, np.array(params[key]))
+        return chain
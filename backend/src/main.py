@@ -2,118 +2,595 @@
 import time
 import os
 import json
+import argparse
+import uuid
+from array import array
+import numpy as np
 from ws_reader import IMUWebSocketReader
 from imu_joint_angle import IMUJointAngle
-from processors import process_packet_accel_angle, compute_stream_metrics
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
+from processors import process_packet_accel_angle, compute_stream_metrics, gyro_norm
+from spectral import FreezeMonitor
+from packets import packets_to_array, resolve_dtype, DTYPES, IMU_NAMES
+from sequence import SequenceTracker, repair_gaps
+from segments import SegmentWriter, SegmentReader
+from manifest import RecordingManifest, path_id
+from kinematic_chain import KinematicChain, joint_angle_summary
+from pipeline import RecordingPipeline, json_safe
+from sketches import knee_quantiles
+from estimators import ESTIMATORS, make_estimator, joint_params, needs_calibration
+from quality import assess_signal_quality, print_quality_report
+from alerts import AlertMonitor, load_rules, log_path as alert_log_path
+import profiling
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'recordings')
+# per-sample series of the metrics; the angles CSV and raw file hold them,
+# so the summary stored with the recording (recordings.json) leaves them out
+PER_SAMPLE_KEYS = ('times', 'angles', 'gyro_norms')
 os.makedirs(DATA_DIR, exist_ok=True)
 
-def calibration_phase(ws, joint_system, num_samples=80, timeout_s=20):
+@profiling.profiled()
+def calibration_phase(ws, joint_system, num_samples=80, timeout_s=20, early_check_s=1.0, chain=None, bootstrap=0):
+    """
+    chain: optional KinematicChain calibrated from the same motion (all its
+           joints in one stacked optimization); packets must carry its sensors.
+    bootstrap: number of bootstrap replicates (0 = off); the calibration is
+               rejected when the joint axes are not stable under resampling.
+    """
     print("=== Calibration Phase ===")
+    sensors = ('IMU1', 'IMU2') + tuple(chain.sensors if chain is not None else ())
     imu1 = []
     imu2 = []
+    packets = []
+    arrivals = []
+    early_checked = False
     start = time.time()
     while len(imu1) < num_samples and (time.time() - start) < timeout_s:
         pkt = ws.read_packet()
-        if pkt and 'IMU1' in pkt and 'IMU2' in pkt:
+        if pkt and all(s in pkt for s in sensors):
             imu1.append(pkt['IMU1'])
             imu2.append(pkt['IMU2'])
+            packets.append(pkt)
+            arrivals.append(time.time())
             if len(imu1) % 10 == 0:
                 print(f"Collected {len(imu1)}/{num_samples}")
         else:
             time.sleep(0.01)
+        # hardware problems (dead/saturated IMU) are visible within a second;
+        # do not make the operator finish the motion before telling them
+        if not early_checked and len(packets) >= 5 and (time.time() - start) >= early_check_s:
+            early_checked = True
+            report = assess_signal_quality(packets_to_array(packets), arrival_times=arrivals,
+                                           require_excitation=False, min_samples=5)
+            if not report['ok']:
+                print_quality_report(report)
+                print("Calibration aborted: fix the sensors and redo the motion")
+                return False
     if len(imu1) < 10:
         print("Calibration failed: not enough valid packets")
         return False
+    report = assess_signal_quality(packets_to_array(packets), arrival_times=arrivals)
+    print_quality_report(report)
+    if not report['ok']:
+        print("Calibration rejected: redo the calibration motion")
+        return False
     calib_data = joint_system.collect_calibration_data(imu1, imu2)
     print("Identifying joint axis...")
     joint_system.identify_joint_axis(calib_data)
     print("Identifying joint position...")
     joint_system.identify_joint_position(calib_data)
+    if bootstrap:
+        from calibration_bootstrap import calibration_trustworthy, format_report
+        report = joint_system.bootstrap(calib_data, n_boot=bootstrap)
+        print(format_report(report))
+        if not calibration_trustworthy(report):
+            print("Calibration rejected: joint axes are not well determined; redo the motion with more varied rotation")
+            joint_system.j1 = joint_system.j2 = joint_system.o1 = joint_system.o2 = None
+            return False
+    if chain is not None:
+        print(f"Calibrating {chain.n_joints} chain joints ({', '.join(chain.joints)})...")
+        chain.calibrate(packets)
     return True
 
-def measurement_phase(ws, joint_system=None, duration_s=30, sampling_rate_est=10.0, out_filename="joint_angles.csv"):
+@profiling.profiled()
+def measurement_phase(ws, joint_system=None, duration_s=30, sampling_rate_est=10.0, out_filename="joint_angles.csv",
+                      estimator='complementary', estimator_mode='batch', segment_s=None, raw_path=None,
+                      chain=None, alert_rules=None, alert_log=None):
+    """
+    estimator: name in estimators.ESTIMATORS: 'complementary'
+               (IMUJointAngle.calculate_angle), 'complementary_batch' (same
+               filter, vectorized), 'madgwick' or 'mahony' (quaternion filter
+               per IMU, flexion about j1/j2), or 'accel' (accel-vector
+               fallback). All but 'accel' need calibration.
+    estimator_mode: 'batch' computes the angles after capture over the packet
+                    array; 'stream' updates the estimator per packet during capture.
+    segment_s: for long sessions, stream raw packets to disk during capture
+               as rolling segments of this many seconds (see segments.py)
+               instead of one raw_{ts}.jsonl written at the end. Packets are
+               then not kept in memory; the analysis reads them back.
+    raw_path: raw file (or session directory) to write; default
+              DATA_DIR/raw_{ts}.jsonl (session_{ts} when segmented).
+    chain: calibrated KinematicChain; adds per-joint angle stats to the metrics.
+    alert_rules: rule specs (see alerts.py) evaluated live on every packet;
+                 alerts are printed and appended to alert_log. None = no alerts.
+                 Rules on knee_angle_deg run the estimator live (also in
+                 batch mode) and are dropped when it is not calibrated.
+    """
+    if estimator not in ESTIMATORS:
+        raise ValueError(f"Unknown estimator: {estimator}")
     print("\n=== Measurement Phase ===")
+    params = joint_params(joint_system)
+    alert_rules = _knee_alert_rules(alert_rules, estimator, params)
+    live = None
+    if needs_calibration(estimator) and params is None:
+        print(f"{estimator} needs calibrated joint axes; using accel-angle fallback.")
+    elif estimator_mode == 'stream' or _uses_knee_angle(alert_rules):
+        # in batch mode only for the alert rules; the recorded angles still come from run_batch
+        live = make_estimator(estimator, params, sampling_rate_est)
+    # live angles as compact doubles (NaN = no angle); long sessions add up
+    stream_angles = array('d')
     packets = []
+    arrivals = []
+    seq_tracker = SequenceTracker()
+    # live freezing-of-gait detection on IMU2 gyro norm + accel knee angle
+    fog = FreezeMonitor(sampling_rate=sampling_rate_est)
+    segments = None
+    if segment_s:
+        session_dir = raw_path or os.path.join(DATA_DIR, f"session_{int(time.time())}")
+        segments = SegmentWriter(session_dir, max_segment_s=segment_s)
+    alerts = AlertMonitor(alert_rules, log=alert_log) if alert_rules is not None else None
     start = time.time()
     last = time.time()
     while (time.time() - start) < duration_s:
         pkt = ws.read_packet()
         if pkt and 'IMU1' in pkt and 'IMU2' in pkt:
-            packets.append(pkt)
+            arrival = time.time()
+            if segments is None:
+                packets.append(pkt)
+                arrivals.append(arrival)
+            if 'seq' in pkt:
+                seq_tracker.observe(pkt['seq'])
+            gn, acc_angle = gyro_norm(pkt['IMU2']), process_packet_accel_angle(pkt)
+            knee = acc_angle
+            if live is not None:
+                knee = live.update(pkt)
+                if estimator_mode == 'stream':
+                    stream_angles.append(np.nan if knee is None else knee)
+            msg = fog.push(gn, acc_angle)
+            if msg:
+                print(msg)
+            if alerts is not None:
+                alerts.push(arrival - start, pkt, arrival=arrival, gyro_norm=gn, accel_angle=acc_angle,
+                            knee_angle=knee, freezing=fog.freezing)
+            if segments is not None:
+                # same time base as the multi-process ring rows: the packet's
+                # device 't' when it has one, else the host arrival time
+                segments.write(pkt, arrival, sample=(acc_angle, gn))
+        elif alerts is not None:
+            alerts.tick(time.time() - start)
         # small sleep to avoid busy loop
         time.sleep(0.005)
-    # Save raw JSON lines
-    ts = int(time.time())
-    raw_path = os.path.join(DATA_DIR, f"raw_{ts}.jsonl")
-    with open(raw_path, 'w') as f:
-        for p in packets:
-            f.write(json.dumps(p) + "\n")
-    print(f"Saved raw packets to {raw_path} (N={len(packets)})")
-
-    # If joint_system has been calibrated, use it; if not, fallback to accel-angle
-    angles = []
-    for p in packets:
-        if joint_system is not None and joint_system.j1 is not None:
-            try:
-                angle = joint_system.calculate_angle(p['IMU1'], p['IMU2'])
-            except Exception:
-                angle = process_packet_accel_angle(p)
-        else:
-            angle = process_packet_accel_angle(p)
-        angles.append(angle)
+    if segments is not None:
+        segments.close()
+        print(f"Saved raw packets to {session_dir} ({len(segments.segments)} segments, N={segments.n_samples})")
+    else:
+        # Save raw JSON lines
+        ts = int(time.time())
+        raw_path = raw_path or os.path.join(DATA_DIR, f"raw_{ts}.jsonl")
+        with open(raw_path, 'w') as f:
+            for p in packets:
+                f.write(json.dumps(p) + "\n")
+        print(f"Saved raw packets to {raw_path} (N={len(packets)})")
+    if seq_tracker.received:
+        print(f"Packet loss: {seq_tracker.stats()}")
+    if alerts is not None:
+        alerts.close()
+
+    angles = None
+    if live is not None and estimator_mode == 'stream':
+        angles = [None if np.isnan(a) else a for a in stream_angles]
+    if segments is not None:
+        metrics = analyze_session(session_dir, joint_system=joint_system, sampling_rate_est=sampling_rate_est,
+                                  out_filename=out_filename, estimator=estimator, angles=angles, chain=chain)
+    else:
+        metrics = analyze_measurement(packets, arrivals, joint_system=joint_system,
+                                      sampling_rate_est=sampling_rate_est, out_filename=out_filename,
+                                      estimator=estimator, angles=angles, chain=chain)
+    if metrics and alerts is not None:
+        metrics['alerts'] = alerts.summary()
+    return metrics
 
-    # Save angles to CSV
-    out_path = os.path.join(DATA_DIR, out_filename)
+@profiling.profiled()
+def analyze_measurement(packets, arrivals, joint_system=None, sampling_rate_est=10.0, out_filename="joint_angles.csv",
+                        estimator='complementary', angles=None, chain=None, dtype=None, imu=None, seqs=None,
+                        chain_imu=None):
+    """
+    Post-capture processing shared by the single- and multi-process paths:
+    knee angles (unless already computed live and passed as `angles`),
+    angle CSV, quality report and summary metrics.
+    Packets that carry sequence numbers are first placed on the sequence
+    grid (per run between counter resets, see sequence.repair_gaps): short
+    losses are interpolated, long ones become invalid segments that the
+    metrics skip. Packets without one are kept as received.
+    dtype: working precision of the sample arrays and the angle CSV
+           (packets.resolve_dtype); defaults to the joint system's.
+    imu / seqs / chain_imu: the samples already as arrays (packets_to_array,
+           sequence numbers or None, chain.to_array) in place of `packets`,
+           see analyze_session.
+    """
+    if dtype is None and joint_system is not None:
+        dtype = joint_system.dtype
+    dtype = resolve_dtype(dtype)
+    seq_info = None
+    valid = None
+    joint_angles = None
+    if imu is None:
+        imu = packets_to_array(packets, dtype=dtype)
+        if any('seq' in p for p in packets):
+            seqs = [p.get('seq') for p in packets]
+    else:
+        imu = imu.astype(dtype, copy=False)
+    if chain is not None and chain.calibrated:
+        joint_angles = _chain_angles(chain, chain.to_array(packets) if chain_imu is None else chain_imu, seqs)
+    if seqs is not None and len(seqs):
+        imu, valid, seq_info = repair_gaps(imu, seqs)
+        if angles is not None:
+            # live angles were computed per received packet; move them onto the grid
+            grid_angles = [None] * len(imu)
+            for pos, a in zip(seq_info['positions'], angles):
+                if pos >= 0:
+                    grid_angles[pos] = a
+            angles = grid_angles
+
+    # one memoized processing graph per recording: the fallback angles, the
+    # metrics and the gait-cycle / spectral stages share its intermediates
+    pipe = RecordingPipeline(sampling_rate=sampling_rate_est, arrival_times=arrivals, dtype=dtype, imu=imu)
+    if valid is not None:
+        pipe.provide('valid', valid)
+
+    if angles is not None:
+        angles = list(angles)
+    else:
+        # uncalibrated systems get the accel-angle fallback
+        est = make_estimator(estimator, joint_params(joint_system), sampling_rate_est)
+        angles = [None if np.isnan(a) else float(a) for a in est.run_batch(pipe.get('imu'), valid)]
+    if valid is not None:
+        angles = [a if ok else None for a, ok in zip(angles, valid)]
+    pipe.provide('angles', angles)
+
+    # Save angles to CSV; float32 mode stores the shortest float32 repr
+    out_path = os.path.join(DATA_DIR, out_filename)  # absolute paths (manifest shards) pass through
+    fmt = str if dtype == np.float64 else (lambda a: str(dtype.type(a)))
     with open(out_path, 'w') as f:
         f.write("time_s,angle_deg\n")
         for i, a in enumerate(angles):
-            f.write(f"{i/sampling_rate_est:.3f},{a if a is not None else ''}\n")
+            f.write(f"{i/sampling_rate_est:.3f},{fmt(a) if a is not None else ''}\n")
     print(f"Saved angles to {out_path}")
 
-    # compute summary metrics
-    metrics = compute_stream_metrics(packets, sampling_rate=sampling_rate_est)
+    quality = pipe.get('quality')
+    print_quality_report(quality)
+
+    # compute summary metrics; JSON-safe (NaN of unrepaired gaps -> None) before anything prints them
+    metrics = json_safe(compute_stream_metrics(packets, sampling_rate=sampling_rate_est, pipeline=pipe))
     print("Summary metrics:")
     for k, v in metrics.items():
         print(f"  {k}: {v}")
+
+    # knee angle vs % gait cycle, segmented by the detected IMU2 steps
+    if metrics:
+        metrics['quality'] = quality
+        metrics['gait_cycles'] = pipe.get('gait_cycles')
+        gc = metrics['gait_cycles']
+        print(f"Gait cycles: {gc['n_cycles']} normalized, {gc['n_outliers']} flagged as outliers")
+        metrics['spectral'] = pipe.get('spectral')
+        ff = metrics['spectral']['freezing_fraction']
+        print(f"Freezing fraction: {ff:.2f}" if ff is not None else
+              "Freezing fraction: n/a (sampling rate too low for the freeze band)")
+        # mergeable distributions: patient / cohort views combine these
+        sketches = pipe.get('sketches')
+        metrics['sketches'] = sketches.to_dict()
+        metrics.update(knee_quantiles(sketches))
+        if joint_angles is not None:
+            metrics['joints'] = joint_angle_summary(joint_angles, chain.joints)
+        if seq_info is not None:
+            metrics['sequence'] = {k: v for k, v in seq_info.items() if k != 'positions'}
+            print(f"Packet loss: {seq_info['n_missing']} missing, {seq_info['n_interpolated']} interpolated, "
+                  f"{len(seq_info['invalid_segments'])} invalid segments")
+    return json_safe(metrics)
+
+def analyze_session(session_dir, chain=None, dtype=None, **kwargs):
+    """
+    analyze_measurement for a segmented session (segments.SegmentWriter).
+    The samples are collected into arrays one segment at a time, so the
+    session's packet dicts are never all in memory; the packets' 't' stand
+    in for the arrival times. kwargs as analyze_measurement.
+    """
+    if dtype is None and kwargs.get('joint_system') is not None:
+        dtype = kwargs['joint_system'].dtype
+    imus, chain_imus, seqs, times = [], [], [], []
+    for packets in SegmentReader(session_dir).iter_segments():
+        imus.append(packets_to_array(packets, dtype=dtype))
+        if chain is not None:
+            chain_imus.append(chain.to_array(packets))
+        seqs.append(np.array([p.get('seq', np.nan) for p in packets], dtype=float))
+        times.append(np.array([p['t'] for p in packets], dtype=float))
+    if not imus:
+        return analyze_measurement([], [], chain=chain, dtype=dtype, **kwargs)
+    return analyze_measurement(None, np.concatenate(times), chain=chain, dtype=dtype,
+                               imu=np.concatenate(imus), seqs=_sequenced(np.concatenate(seqs)),
+                               chain_imu=np.concatenate(chain_imus) if chain is not None else None, **kwargs)
+
+def _sequenced(seqs):
+    # sequence numbers for repair_gaps, None when no packet carries one
+    return seqs if np.isfinite(seqs).any() else None
+
+def _chain_angles(chain, imu, seqs=None):
+    """(N, J) chain joint angles for one recording, placed on the sequence grid like the knee angles."""
+    if seqs is not None and len(seqs):
+        flat, ok, _ = repair_gaps(imu.reshape(len(imu), -1), seqs)
+        imu = flat.reshape(len(flat), *imu.shape[1:])
+    else:
+        ok = np.isfinite(imu).all(axis=(1, 2))
+    # zero rows hold the filter state across samples without data
+    chain.reset_stream_state()
+    angles = chain.angles(np.where(ok[:, None, None], imu, 0.0))
+    angles[~ok] = np.nan
+    return angles
+
+def _uses_knee_angle(alert_rules):
+    return bool(alert_rules) and any(r.get('signal') == 'knee_angle_deg' for r in alert_rules)
+
+def _knee_alert_rules(alert_rules, estimator, params):
+    """
+    alert_rules without its knee_angle_deg rules (with a warning) when no
+    calibrated estimator gives a signed knee angle: the accel-angle
+    fallback is never negative, so e.g. a '< 0' threshold could not fire.
+    """
+    if not _uses_knee_angle(alert_rules) or (needs_calibration(estimator) and params is not None):
+        return alert_rules
+    dropped = [r.get('id') for r in alert_rules if r.get('signal') == 'knee_angle_deg']
+    print(f"WARNING: no calibrated knee angle; dropping alert rules {', '.join(dropped)} "
+          "(use accel_angle_deg for the unsigned accel angle)")
+    return [r for r in alert_rules if r.get('signal') != 'knee_angle_deg']
+
+def _check_ring_sensors(chain):
+    # the shared ring's row layout (packets.IMU_NAMES) would silently drop other chain sensors
+    extra = [s for s in chain.sensors if s not in IMU_NAMES] if chain is not None else []
+    if extra:
+        raise ValueError(f"Multi-process capture records {', '.join(IMU_NAMES)} only; chain sensors "
+                         f"{', '.join(extra)} need single-process capture (drop --multiprocess)")
+
+@profiling.profiled()
+def _await_result(results, proc, poll_s=1.0):
+    """
+    The worker's result from `results`, polling so a worker that died
+    without putting one raises instead of blocking the session forever.
+    """
+    import queue
+    while True:
+        try:
+            live = results.get(timeout=poll_s)
+            break
+        except queue.Empty:
+            if not proc.is_alive():
+                # it may have put its result just before exiting
+                try:
+                    live = results.get(timeout=poll_s)
+                    break
+                except queue.Empty:
+                    raise RuntimeError(f"Analysis worker exited (code {proc.exitcode}) without a result")
+    if live.get('error'):
+        raise RuntimeError(f"Analysis worker failed: {live['error']}")
+    return live
+
+def measurement_phase_multiprocess(esp_ip, joint_system=None, duration_s=30, sampling_rate_est=10.0,
+                                   out_filename="joint_angles.csv", estimator='complementary',
+                                   capacity=1 << 16, segment_s=None, raw_path=None, chain=None,
+                                   alert_rules=None, alert_log=None):
+    """
+    Same recording as measurement_phase, split over processes that share a
+    SharedRingBuffer: an ingest process only receives and decodes packets,
+    a writer process streams them to the raw file and an analysis process
+    computes live angles and freezing flags. Slow analysis can no longer
+    stall recv(). The ESP connection is opened by the ingest process.
+    segment_s, raw_path, chain, alert_rules, alert_log: as in measurement_phase
+    (alerts are evaluated by the analysis process). Ring rows hold IMU1 and
+    IMU2 only, so chains with other sensors are rejected.
+    """
+    import multiprocessing as mp
+    from shm_ring import SharedRingBuffer
+    from mp_pipeline import ingest_worker, writer_worker, analysis_worker
+
+    if estimator not in ESTIMATORS:
+        raise ValueError(f"Unknown estimator: {estimator}")
+    _check_ring_sensors(chain)
+    print("\n=== Measurement Phase (multi-process) ===")
+    alert_rules = _knee_alert_rules(alert_rules, estimator, joint_params(joint_system))
+    ts = int(time.time())
+    if raw_path is None:
+        raw_path = os.path.join(DATA_DIR, f"session_{ts}" if segment_s else f"raw_{ts}.jsonl")
+    ring = SharedRingBuffer.create(capacity=capacity)
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    # readers start first so they are at seq 0 before the first packet lands
+    readers = [
+        ctx.Process(target=writer_worker, args=(ring.name, capacity, raw_path, segment_s)),
+        ctx.Process(target=analysis_worker, args=(ring.name, capacity, sampling_rate_est, estimator,
+                                                  joint_params(joint_system), results, alert_rules, alert_log)),
+    ]
+    ingest = ctx.Process(target=ingest_worker, args=(esp_ip, ring.name, capacity, duration_s))
+    try:
+        for p in readers:
+            p.start()
+        ingest.start()
+        ingest.join()
+        live = _await_result(results, readers[1])
+        for p in readers:
+            p.join()
+    finally:
+        ring.release()
+
+    packets = []
+    if segment_s:
+        n = SegmentReader(raw_path).n_samples
+    else:
+        if os.path.exists(raw_path):
+            with open(raw_path) as f:
+                packets = [json.loads(line) for line in f if line.strip()]
+        n = len(packets)
+    print(f"Saved raw packets to {raw_path} (N={n})")
+    if live['lost']:
+        print(f"WARNING: analysis fell behind and skipped {live['lost']} samples")
+    if live['sequence']['received']:
+        print(f"Packet loss: {live['sequence']}")
+    angles = live['angles'] if len(live['angles']) == n else None
+    if segment_s:
+        metrics = analyze_session(raw_path, joint_system=joint_system, sampling_rate_est=sampling_rate_est,
+                                  out_filename=out_filename, estimator=estimator, angles=angles, chain=chain)
+    else:
+        metrics = analyze_measurement(packets, [p['t'] for p in packets], joint_system=joint_system,
+                                      sampling_rate_est=sampling_rate_est, out_filename=out_filename,
+                                      estimator=estimator, angles=angles, chain=chain)
+    if metrics and live.get('alerts') is not None:
+        metrics['alerts'] = live['alerts']
     return metrics
 
-def run(esp_ip, do_calibration=True):
+def run(esp_ip, do_calibration=True, duration_s=30, sampling_rate_est=10.0,
+        estimator='complementary', estimator_mode='batch', multiprocess=False, segment_s=None,
+        recording_id=None, patient_id=None, chain_config=None, dtype=None, bootstrap=0,
+        alert_rules=None, alert_log=None):
+    """
+    recording_id / patient_id: the outputs go to the patient's shard of
+    DATA_DIR as {recording_id}_raw.jsonl / {recording_id}_angles.csv (plus
+    {recording_id}_calibration.json, the estimators.joint_params, when
+    calibrated) and are registered in the recording manifest, where
+    server.analyze_patient looks them up by ID.
+    chain_config: kinematic chain JSON (see kinematic_chain.load_chain_config)
+                  for multi-joint setups; its joints are calibrated with the
+                  knee and summarized in metrics['joints'].
+    dtype: 'float64' (default) or 'float32' working precision for sample
+           arrays, calibration matrices and angle outputs; see
+           packets.FLOAT32_TOLERANCE for the effect on the metrics.
+    bootstrap: calibration bootstrap replicates gating the measurement (0 = off).
+    alert_rules: live alert rule specs (alerts.py; None = no alerts), logged
+                 to alert_log, default alerts.log_path(recording_id).
+    Profiling ($IMU_PROFILE / --profile, see profiling.py) tags its files
+    with the recording ID.
+    """
+    chain = (KinematicChain.from_config(chain_config, delta_t=1.0 / sampling_rate_est, dtype=dtype)
+             if chain_config else None)
+    if multiprocess:
+        # before calibrating, not after
+        _check_ring_sensors(chain)
     ws = IMUWebSocketReader(esp_ip)
     if not ws.connect():
         print("Cannot connect to ESP32. Exiting.")
         return
 
     # Adjust delta_t estimate if you want
-    joint_system = IMUJointAngle(delta_t=0.1)
+    joint_system = IMUJointAngle(delta_t=1.0 / sampling_rate_est, dtype=dtype)
+    metrics = None
+    manifest = RecordingManifest(DATA_DIR)
+    # IDs name the output files and the patient's shard directory
+    recording_id = path_id(recording_id or f"r{int(time.time())}_{uuid.uuid4().hex[:6]}")
+    profiling.configure(tag=recording_id)
+    rec_dir = manifest.shard_dir(patient_id)
+    raw_path = os.path.join(rec_dir, f"{recording_id}_raw" if segment_s else f"{recording_id}_raw.jsonl")
+    out_path = os.path.join(rec_dir, f"{recording_id}_angles.csv")
+    calib_path = os.path.join(rec_dir, f"{recording_id}_calibration.json")
+    alert_log = alert_log or alert_log_path(recording_id)
 
     try:
         if do_calibration:
-            ok = calibration_phase(ws, joint_system, num_samples=80, timeout_s=25)
+            ok = calibration_phase(ws, joint_system, num_samples=80, timeout_s=25, chain=chain,
+                                   bootstrap=bootstrap)
             if not ok:
                 print("Calibration incomplete; proceeding with accel-based angle fallback.")
         if os.getenv("AUTO_START", "0") != "1":
             try:
-                input("Press Enter to start measurement (will run 30s)...")
+                input(f"Press Enter to start measurement (will run {duration_s:g}s)...")
             except Exception:
                 # if somehow running headless and input() raises, proceed
                 print("Proceeding without interactive confirmation.")
         else:
             print("AUTO_START=1 detected — starting measurement without prompt.")
-        measurement_phase(ws, joint_system=joint_system, duration_s=30, sampling_rate_est=10.0)
+        if multiprocess:
+            # the ingest process opens its own connection
+            ws.close()
+            metrics = measurement_phase_multiprocess(esp_ip, joint_system=joint_system, duration_s=duration_s,
+                                                     sampling_rate_est=sampling_rate_est, estimator=estimator,
+                                                     out_filename=out_path, segment_s=segment_s,
+                                                     raw_path=raw_path, chain=chain,
+                                                     alert_rules=alert_rules, alert_log=alert_log)
+        else:
+            metrics = measurement_phase(ws, joint_system=joint_system, duration_s=duration_s,
+                                        sampling_rate_est=sampling_rate_est,
+                                        out_filename=out_path, estimator=estimator,
+                                        estimator_mode=estimator_mode, segment_s=segment_s,
+                                        raw_path=raw_path, chain=chain,
+                                        alert_rules=alert_rules, alert_log=alert_log)
     finally:
         ws.close()
 
+    if metrics is not None:
+        files = {'raw': raw_path, 'angles': out_path}
+        params = joint_params(joint_system)
+        if params is not None:
+            # re-analysis (estimator_eval) needs the session's own calibration
+            with open(calib_path, 'w') as f:
+                json.dump(params, f)
+            files['calibration'] = calib_path
+        manifest.add(recording_id, patient_id, files)
+        print(f"Registered recording {recording_id}")
+
+    # last stdout line is parsed by server.analyze_patient and stored with the recording
+    if metrics is not None:
+        summary = {k: v for k, v in metrics.items() if k not in PER_SAMPLE_KEYS}
+        print(json.dumps(json_safe(summary), allow_nan=False))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate the knee IMUs and record a gait session.")
+    parser.add_argument("--esp-ip", default=None, help="ESP32 address (default: $ESP_IP)")
+    parser.add_argument("--no-calibration", action="store_true", help="skip calibration, use accel-angle fallback")
+    parser.add_argument("--duration", type=float, default=30.0, help="measurement duration in seconds")
+    parser.add_argument("--sampling-rate", type=float, default=10.0,
+                        help="estimated ESP sampling rate (Hz); freezing of gait needs >= 16")
+    parser.add_argument("--estimator", choices=ESTIMATORS, default="complementary",
+                        help="knee-angle estimator")
+    parser.add_argument("--estimator-mode", choices=("batch", "stream"), default="batch",
+                        help="run the estimator after capture or per packet")
+    parser.add_argument("--multiprocess", action="store_true",
+                        help="separate ingest, writer and analysis processes over shared memory")
+    parser.add_argument("--segment-s", type=float, default=None,
+                        help="long sessions: write raw packets as rolling segments of this many seconds")
+    parser.add_argument("--chain", default=None,
+                        help="kinematic chain config JSON for multi-sensor setups (sensors + joints)")
+    parser.add_argument("--dtype", choices=tuple(DTYPES), default=None,
+                        help="working precision (default: $IMU_DTYPE, else float64)")
+    parser.add_argument("--profile", default=None, metavar="MODES",
+                        help="profile the phases: cpu, mem or cpu,mem (default: $IMU_PROFILE); see profiling.py")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                        help="check the calibration with N bootstrap replicates before measuring (e.g. 200)")
+    parser.add_argument("--alert-rules", default=None, metavar="PATH",
+                        help="live alert rules JSON (default: $ALERT_RULES, else the built-in rules); see alerts.py")
+    parser.add_argument("--no-alerts", action="store_true", help="do not evaluate live alert rules")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    # Replace with your ESP IP or accept CLI args
-    ESP_IP = os.getenv("ESP_IP")
+    args = parse_args()
+    # Load environment variables from .env file (after --help, which needs none)
+    from dotenv import load_dotenv
+    load_dotenv()
+    if args.profile or os.getenv("IMU_PROFILE"):
+        profiling.configure(modes=args.profile or os.getenv("IMU_PROFILE"), out_dir=os.getenv("IMU_PROFILE_DIR"))
+    ESP_IP = args.esp_ip or os.getenv("ESP_IP")
     print(ESP_IP)
-    run(ESP_IP, do_calibration=True)
+    alert_rules = None if args.no_alerts else load_rules(args.alert_rules or os.getenv("ALERT_RULES"))
+    run(ESP_IP, do_calibration=not args.no_calibration, duration_s=args.duration,
+        sampling_rate_est=args.sampling_rate, estimator=args.estimator,
+        estimator_mode=args.estimator_mode, multiprocess=args.multiprocess, segment_s=args.segment_s,
+        recording_id=os.getenv("RECORDING_ID"), patient_id=os.getenv("PATIENT_ID"), chain_config=args.chain,
+        dtype=args.dtype or os.getenv("IMU_DTYPE"), bootstrap=args.bootstrap,
+        alert_rules=alert_rules, alert_log=os.getenv("ALERT_LOG"))
 
 
 
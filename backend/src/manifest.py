@@ -0,0 +1,121 @@
+# src/manifest.py
+import os
+import re
+import json
+import hashlib
+
+MANIFEST_NAME = 'manifest.jsonl'
+UNASSIGNED = 'unassigned'
+
+# patient / recording IDs become file and directory names (shards, trends, alert logs)
+_PATH_ID = re.compile(r'[A-Za-z0-9_\-][A-Za-z0-9_.\-]{0,127}')
+
+def is_path_id(value):
+    """True if value is safe as one path component: no separators, no leading dot (so no '..')."""
+    return isinstance(value, str) and _PATH_ID.fullmatch(value) is not None
+
+def path_id(value):
+    """value, or ValueError when it is not a safe path component (see is_path_id)."""
+    if not is_path_id(value):
+        raise ValueError(f"Invalid ID {value!r}: use letters, digits, '_', '-' and '.' (not leading)")
+    return value
+
+def file_info(path):
+    """Size and sha256 of a file; for a segmented session directory, its total size and the index hash."""
+    if os.path.isdir(path):
+        size = sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+        path = os.path.join(path, 'index.json')
+    else:
+        size = os.path.getsize(path)
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return {'size': size, 'sha256': h.hexdigest()}
+
+class RecordingManifest:
+    """
+    Index of recording outputs: recording ID -> {kind: {path, size, sha256}}.
+    Files live in per-patient shard directories under `root`; paths are
+    stored relative to root. The manifest is an append-only JSONL log, so
+    writers (main.py runs) add an entry in O(1) and readers pick up new
+    lines incrementally; get() never scans the recording directory.
+    Later lines for the same ID replace earlier ones.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, MANIFEST_NAME)
+        self.entries = {}
+        self._offset = 0
+        os.makedirs(root, exist_ok=True)
+        self.refresh()
+
+    def refresh(self):
+        """Read log lines appended since the last call (e.g. by another process)."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            f.seek(self._offset)
+            while True:
+                line = f.readline()
+                if not line.endswith("\n"):
+                    break  # missing or partially written last line
+                self._offset = f.tell()
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries[entry['id']] = entry
+
+    def shard_dir(self, patient_id=None):
+        d = os.path.join(self.root, path_id(patient_id) if patient_id else UNASSIGNED)
+        os.makedirs(d, exist_ok=True)
+        return d
+
+    def _append(self, entry):
+        # one write per line keeps concurrent appends from interleaving
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + "\n")
+        self.entries[entry['id']] = entry
+
+    def add(self, rec_id, patient_id, files):
+        """Register outputs {kind: absolute path} of one recording; missing files are skipped."""
+        entry = {'id': rec_id, 'patient_id': patient_id, 'files': {}}
+        for kind, path in files.items():
+            if path and os.path.exists(path):
+                entry['files'][kind] = dict(path=os.path.relpath(path, self.root), **file_info(path))
+        self._append(entry)
+        return entry
+
+    def get(self, rec_id):
+        if rec_id not in self.entries:
+            self.refresh()
+        return self.entries.get(rec_id)
+
+    def file_path(self, rec_id, kind):
+        """Absolute path of one output, or None."""
+        entry = self.get(rec_id)
+        if entry is None or kind not in entry['files']:
+            return None
+        return os.path.join(self.root, entry['files'][kind]['path'])
+
+    def rename(self, renamed):
+        """Update entries after files moved ({old relative path: new relative path}, e.g. archival)."""
+        self.refresh()
+        for entry in list(self.entries.values()):
+            changed = False
+            for info in entry['files'].values():
+                if info['path'] in renamed:
+                    info['path'] = renamed[info['path']]
+                    info.update(file_info(os.path.join(self.root, info['path'])))
+                    changed = True
+            if changed:
+                self._append(entry)
+
+    def compact(self):
+        """Rewrite the log with one line per recording (while no writer is running)."""
+        self.refresh()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp, self.path)
+        self._offset = os.path.getsize(self.path)
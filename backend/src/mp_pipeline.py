@@ -0,0 +1,143 @@
+# src/mp_pipeline.py
+# Worker processes for main.measurement_phase_multiprocess. All of them
+# attach to the same SharedRingBuffer by name; only ingest_worker writes.
+import json
+import time
+import numpy as np
+from shm_ring import SharedRingBuffer, RingReader
+from segments import SegmentWriter
+from packets import row_to_packet, ROW_SEQ, ROW_TIME, ROW_DATA, IMU2_GYR
+
+def ingest_worker(esp_ip, ring_name, capacity, duration_s):
+    """Receive and decode packets into the ring; nothing else runs here."""
+    from ws_reader import IMUWebSocketReader
+
+    ring = SharedRingBuffer.attach(ring_name, capacity)
+    ws = IMUWebSocketReader(esp_ip)
+    try:
+        if not ws.connect():
+            print("Cannot connect to ESP32 from ingest process.")
+            return
+        start = time.time()
+        while (time.time() - start) < duration_s:
+            # decode straight into the next ring slot; commit only real samples
+            _, row = ring.slot()
+            if ws.read_row(row):
+                if row[ROW_TIME] != row[ROW_TIME]:  # NaN: frame carries no device time
+                    row[ROW_TIME] = time.time()
+                # a missing device seq stays NaN (the ring's own counter is a
+                # different numbering); sequence repair leaves those rows as received
+                ring.commit()
+            elif ws.ws is None:
+                break
+    finally:
+        ring.close_writer()
+        ws.close()
+        ring.release()
+
+def writer_worker(ring_name, capacity, raw_path, segment_s=None, poll_s=0.02):
+    """
+    Stream ring rows to the raw JSONL file (same packet layout plus seq/t),
+    or, with segment_s, to a segmented session directory at raw_path.
+    """
+    ring = SharedRingBuffer.attach(ring_name, capacity)
+    reader = RingReader(ring)
+    try:
+        if segment_s:
+            from pipeline import accel_angles
+
+            with SegmentWriter(raw_path, max_segment_s=segment_s) as out:
+                while not reader.finished():
+                    blocks = reader.poll()
+                    if not blocks:
+                        time.sleep(poll_s)
+                        continue
+                    for block in blocks:
+                        # segment sketches: accel angle and IMU2 gyro norm, per block
+                        data = block[:, ROW_DATA]
+                        accel = accel_angles(data)
+                        gnorms = np.linalg.norm(data[:, IMU2_GYR], axis=1)
+                        for row, a, gn in zip(block, accel, gnorms):
+                            out.write(row_to_packet(row), row[ROW_TIME], sample=(float(a), float(gn)))
+                    reader.lost += reader.overwritten()
+        else:
+            with open(raw_path, 'w') as f:
+                while not reader.finished():
+                    blocks = reader.poll()
+                    if not blocks:
+                        time.sleep(poll_s)
+                        continue
+                    for block in blocks:
+                        f.write("".join(json.dumps(row_to_packet(row)) + "\n" for row in block))
+                    reader.lost += reader.overwritten()
+        if reader.lost:
+            print(f"WARNING: writer skipped {reader.lost} samples")
+    finally:
+        ring.release()
+
+def analysis_worker(ring_name, capacity, sampling_rate, estimator, params, results, alert_rules=None,
+                    alert_log=None, poll_s=0.01):
+    """
+    Live knee angles, freezing-of-gait flags and, with alert_rules, live
+    alerts (alerts.AlertMonitor, logged to alert_log) from the ring.
+    Puts {'angles': [...], 'lost': n, 'sequence': {...}, 'alerts': {...},
+    'error': ...} on `results` when the stream ends or the worker fails;
+    'sequence' is the SequenceTracker loss accounting, 'alerts' the
+    AlertMonitor summary (None without rules), 'error' the exception repr
+    (None on success).
+    """
+    from processors import process_packet_accel_angle
+    from spectral import FreezeMonitor
+    from sequence import SequenceTracker
+    from estimators import make_estimator
+    from alerts import AlertMonitor
+
+    fog = FreezeMonitor(sampling_rate=sampling_rate)
+    seq_tracker = SequenceTracker()
+    ring = reader = alerts = error = last_row = None
+    angles = []
+    # setup inside the try: a result is put even if it fails, so the
+    # parent's results.get() never waits on a worker that already died
+    try:
+        # params: estimators.joint_params of the calibrated system, or None
+        angle_fn = make_estimator(estimator, params, sampling_rate).update
+        ring = SharedRingBuffer.attach(ring_name, capacity)
+        reader = RingReader(ring)
+        alerts = AlertMonitor(alert_rules, log=alert_log) if alert_rules is not None else None
+        while not reader.finished():
+            blocks = reader.poll()
+            if not blocks:
+                if alerts is not None and last_row is not None:
+                    # row clock (device or ingest time) advanced by the host time since the last row
+                    alerts.tick(last_row[0] + time.monotonic() - last_row[1])
+                time.sleep(poll_s)
+                continue
+            for block in blocks:
+                last_row = (float(block[-1, ROW_TIME]), time.monotonic())
+                gnorms = np.linalg.norm(block[:, ROW_DATA][:, IMU2_GYR], axis=1)
+                for row, gn in zip(block, gnorms):
+                    if row[ROW_SEQ] == row[ROW_SEQ]:  # NaN: no device seq
+                        seq_tracker.observe(row[ROW_SEQ])
+                    p = row_to_packet(row)
+                    angles.append(angle_fn(p))
+                    acc_angle = process_packet_accel_angle(p)
+                    msg = fog.push(gn, acc_angle)
+                    if msg:
+                        print(msg, flush=True)
+                    if alerts is not None:
+                        # row times are device (or ingest) times: no arrival latency here
+                        alerts.push(float(row[ROW_TIME]), p, gyro_norm=float(gn), accel_angle=acc_angle,
+                                    knee_angle=angles[-1], freezing=fog.freezing)
+            reader.lost += reader.overwritten()
+    except Exception as e:
+        error = repr(e)
+        raise
+    finally:
+        summary = None
+        if alerts is not None:
+            alerts.close()
+            summary = alerts.summary()
+        results.put({'angles': angles, 'lost': reader.lost if reader is not None else 0,
+                     'sequence': seq_tracker.stats(), 'alerts': summary, 'error': error})
+        if ring is not None:
+            ring.release()
@@ -0,0 +1,266 @@
+# src/orientation.py
+import math
+import numpy as np
+
+# Quaternions are (w, x, y, z) and describe sensor orientation in a world
+# frame whose z axis points along measured gravity: v_world = q v_sensor q*.
+# No magnetometer is used, so world heading is arbitrary per sensor; the two
+# segment filters are heading-aligned on the joint axis at start-up.
+
+def _madgwick_step(q0, q1, q2, q3, gx, gy, gz, ax, ay, az, beta, dt):
+    # Madgwick (2010) IMU update, gradient-descent gravity correction
+    qd0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+    qd1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+    qd2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+    qd3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+    n = math.sqrt(ax * ax + ay * ay + az * az)
+    if n > 0.0:
+        ax /= n; ay /= n; az /= n
+        _2q0 = 2.0 * q0; _2q1 = 2.0 * q1; _2q2 = 2.0 * q2; _2q3 = 2.0 * q3
+        _4q0 = 4.0 * q0; _4q1 = 4.0 * q1; _4q2 = 4.0 * q2
+        _8q1 = 8.0 * q1; _8q2 = 8.0 * q2
+        q0q0 = q0 * q0; q1q1 = q1 * q1; q2q2 = q2 * q2; q3q3 = q3 * q3
+        s0 = _4q0 * q2q2 + _2q2 * ax + _4q0 * q1q1 - _2q1 * ay
+        s1 = (_4q1 * q3q3 - _2q3 * ax + 4.0 * q0q0 * q1 - _2q0 * ay - _4q1
+              + _8q1 * q1q1 + _8q1 * q2q2 + _4q1 * az)
+        s2 = (4.0 * q0q0 * q2 + _2q0 * ax + _4q2 * q3q3 - _2q3 * ay - _4q2
+              + _8q2 * q1q1 + _8q2 * q2q2 + _4q2 * az)
+        s3 = 4.0 * q1q1 * q3 - _2q1 * ax + 4.0 * q2q2 * q3 - _2q2 * ay
+        sn = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+        if sn > 0.0:
+            qd0 -= beta * s0 / sn
+            qd1 -= beta * s1 / sn
+            qd2 -= beta * s2 / sn
+            qd3 -= beta * s3 / sn
+    q0 += qd0 * dt; q1 += qd1 * dt; q2 += qd2 * dt; q3 += qd3 * dt
+    n = math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+    return q0 / n, q1 / n, q2 / n, q3 / n
+
+def _mahony_step(q0, q1, q2, q3, ix, iy, iz, gx, gy, gz, ax, ay, az, kp, ki, dt):
+    # Mahony (2008) IMU update, PI correction towards measured gravity
+    n = math.sqrt(ax * ax + ay * ay + az * az)
+    if n > 0.0:
+        ax /= n; ay /= n; az /= n
+        hvx = q1 * q3 - q0 * q2
+        hvy = q0 * q1 + q2 * q3
+        hvz = q0 * q0 - 0.5 + q3 * q3
+        hex_ = ay * hvz - az * hvy
+        hey = az * hvx - ax * hvz
+        hez = ax * hvy - ay * hvx
+        if ki > 0.0:
+            ix += 2.0 * ki * hex_ * dt
+            iy += 2.0 * ki * hey * dt
+            iz += 2.0 * ki * hez * dt
+            gx += ix; gy += iy; gz += iz
+        gx += 2.0 * kp * hex_
+        gy += 2.0 * kp * hey
+        gz += 2.0 * kp * hez
+    gx *= 0.5 * dt; gy *= 0.5 * dt; gz *= 0.5 * dt
+    qa, qb, qc = q0, q1, q2
+    q0 += -qb * gx - qc * gy - q3 * gz
+    q1 += qa * gx + qc * gz - q3 * gy
+    q2 += qa * gy - qb * gz + q3 * gx
+    q3 += qa * gz + qb * gy - qc * gx
+    n = math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+    return q0 / n, q1 / n, q2 / n, q3 / n, ix, iy, iz
+
+def tilt_quaternion(acc):
+    """Quaternion rotating the measured accel direction onto world +z (zero heading)."""
+    a = np.asarray(acc, dtype=float)
+    n = np.linalg.norm(a)
+    if n < 1e-9:
+        return (1.0, 0.0, 0.0, 0.0)
+    a = a / n
+    # half-way quaternion between a and z: (1 + a.z, a x z)
+    w = 1.0 + a[2]
+    x, y, z = a[1], -a[0], 0.0
+    if w < 1e-9:
+        return (0.0, 1.0, 0.0, 0.0)  # upside down: 180 deg about x
+    n = math.sqrt(w * w + x * x + y * y)
+    return (w / n, x / n, y / n, z / n)
+
+def rotate(q, v):
+    """Rotate vectors v by quaternions q (broadcasting over leading dims)."""
+    q = np.asarray(q, dtype=float)
+    v = np.asarray(v, dtype=float)
+    w = q[..., 0:1]
+    u = q[..., 1:4]
+    t = 2.0 * np.cross(u, v)
+    return v + w * t + np.cross(u, t)
+
+def _quat_mul(a, b):
+    aw, ax, ay, az = a
+    bw, bx, by, bz = b
+    return (aw * bw - ax * bx - ay * by - az * bz,
+            aw * bx + ax * bw + ay * bz - az * by,
+            aw * by - ax * bz + ay * bw + az * bx,
+            aw * bz + ax * by - ay * bx + az * bw)
+
+def align_heading(q_ref, j_ref, q, j):
+    """
+    Rotate q about world z so that its joint axis j points the same way (in
+    the horizontal plane) as j_ref under q_ref. Without a magnetometer the two
+    filters start with unrelated headings; the hinge constraint fixes that.
+    """
+    u_ref = rotate(q_ref, j_ref)
+    u = rotate(q, j)
+    h_ref = math.hypot(u_ref[0], u_ref[1])
+    h = math.hypot(u[0], u[1])
+    if h_ref < 1e-3 or h < 1e-3:
+        return tuple(q)  # joint axis (near) vertical: heading is irrelevant
+    yaw = math.atan2(u[0] * u_ref[1] - u[1] * u_ref[0], u[0] * u_ref[0] + u[1] * u_ref[1])
+    qz = (math.cos(yaw / 2.0), 0.0, 0.0, math.sin(yaw / 2.0))
+    return _quat_mul(qz, tuple(q))
+
+def _x_axis(j):
+    # same in-plane reference as IMUJointAngle.calculate_angle
+    x = np.cross(j, np.array([1.0, 0.0, 0.0]))
+    if np.linalg.norm(x) < 1e-6:
+        x = np.array([0.0, 1.0, 0.0])
+    return x / np.linalg.norm(x)
+
+def flexion_angles(q1, q2, j1, j2):
+    """
+    Flexion angle (degrees) about the calibrated hinge from segment orientations.
+    q1, q2: (N, 4) or (4,) quaternions of IMU1 and IMU2
+    Sign follows IMUJointAngle: the angle rate is (g1.j1 - g2.j2).
+    """
+    j1 = np.asarray(j1, dtype=float)
+    j2 = np.asarray(j2, dtype=float)
+    jw = rotate(q1, j1) + rotate(q2, j2)
+    jw = jw / np.linalg.norm(jw, axis=-1, keepdims=True)
+    w1 = rotate(q1, _x_axis(j1))
+    w2 = rotate(q2, _x_axis(j2))
+    s = np.sum(jw * np.cross(w2, w1), axis=-1)
+    c = np.sum(w2 * w1, axis=-1)
+    return np.degrees(np.arctan2(s, c))
+
+class OrientationFilter:
+    """
+    Streaming quaternion filter for one IMU with O(1) state.
+    method: 'madgwick' or 'mahony'
+    dt: sampling period (s); gyro_in_degrees: convert deg/s input to rad/s
+    """
+    def __init__(self, method='madgwick', dt=0.1, beta=0.1, kp=1.0, ki=0.0, gyro_in_degrees=True):
+        if method not in ('madgwick', 'mahony'):
+            raise ValueError(f"Unknown orientation filter: {method}")
+        self.method = method
+        self.dt = dt
+        self.beta = beta
+        self.kp = kp
+        self.ki = ki
+        self.gyro_scale = math.pi / 180.0 if gyro_in_degrees else 1.0
+        self.q = None
+        self._integral = (0.0, 0.0, 0.0)
+
+    def reset(self, q=None):
+        self.q = None if q is None else tuple(float(v) for v in q)
+        self._integral = (0.0, 0.0, 0.0)
+
+    def update(self, gx, gy, gz, ax, ay, az):
+        if self.q is None:
+            self.q = tilt_quaternion((ax, ay, az))
+            return self.q
+        s = self.gyro_scale
+        q0, q1, q2, q3 = self.q
+        if self.method == 'madgwick':
+            self.q = _madgwick_step(q0, q1, q2, q3, gx * s, gy * s, gz * s, ax, ay, az, self.beta, self.dt)
+        else:
+            ix, iy, iz = self._integral
+            q0, q1, q2, q3, ix, iy, iz = _mahony_step(q0, q1, q2, q3, ix, iy, iz, gx * s, gy * s, gz * s,
+                                                      ax, ay, az, self.kp, self.ki, self.dt)
+            self.q = (q0, q1, q2, q3)
+            self._integral = (ix, iy, iz)
+        return self.q
+
+    def run_batch(self, imu6, out=None):
+        """
+        Filter a block of samples, continuing from the current state.
+        imu6: array (N, 6) [Ax, Ay, Az, Gx, Gy, Gz] (packets.py column order)
+        out: optional preallocated (N, 4) array for the quaternions
+        The loop works on Python floats only; no arrays are created per sample.
+        """
+        N = len(imu6)
+        if out is None:
+            out = np.empty((N, 4))
+        if N == 0:
+            return out
+        cols = np.asarray(imu6, dtype=float).T.tolist()
+        axl, ayl, azl, gxl, gyl, gzl = cols
+        s = self.gyro_scale
+        dt = self.dt
+        start = 0
+        if self.q is None:
+            self.q = tilt_quaternion((axl[0], ayl[0], azl[0]))
+            out[0] = self.q
+            start = 1
+        q0, q1, q2, q3 = self.q
+        if self.method == 'madgwick':
+            beta = self.beta
+            for i in range(start, N):
+                q0, q1, q2, q3 = _madgwick_step(q0, q1, q2, q3, gxl[i] * s, gyl[i] * s, gzl[i] * s,
+                                                axl[i], ayl[i], azl[i], beta, dt)
+                out[i, 0] = q0; out[i, 1] = q1; out[i, 2] = q2; out[i, 3] = q3
+        else:
+            kp, ki = self.kp, self.ki
+            ix, iy, iz = self._integral
+            for i in range(start, N):
+                q0, q1, q2, q3, ix, iy, iz = _mahony_step(q0, q1, q2, q3, ix, iy, iz,
+                                                          gxl[i] * s, gyl[i] * s, gzl[i] * s,
+                                                          axl[i], ayl[i], azl[i], kp, ki, dt)
+                out[i, 0] = q0; out[i, 1] = q1; out[i, 2] = q2; out[i, 3] = q3
+            self._integral = (ix, iy, iz)
+        self.q = (q0, q1, q2, q3)
+        return out
+
+class FlexionEstimator:
+    """
+    Knee flexion from one orientation filter per segment, about the
+    calibrated joint axes j1/j2 (from IMUJointAngle.identify_joint_axis).
+    update() is the streaming mode (O(1) state, one call per packet);
+    run_batch() processes a whole (N, 12) packet array.
+    """
+    def __init__(self, j1, j2, method='madgwick', dt=0.1, **filter_kwargs):
+        self.j1 = np.asarray(j1, dtype=float)
+        self.j2 = np.asarray(j2, dtype=float)
+        self.f1 = OrientationFilter(method=method, dt=dt, **filter_kwargs)
+        self.f2 = OrientationFilter(method=method, dt=dt, **filter_kwargs)
+
+    def _init(self, acc1, acc2):
+        q1 = tilt_quaternion(acc1)
+        q2 = align_heading(q1, self.j1, tilt_quaternion(acc2), self.j2)
+        self.f1.reset(q1)
+        self.f2.reset(q2)
+
+    def update(self, imu1_reading, imu2_reading):
+        r1, r2 = imu1_reading, imu2_reading
+        if self.f1.q is None:
+            self._init((r1['Ax'], r1['Ay'], r1['Az']), (r2['Ax'], r2['Ay'], r2['Az']))
+        else:
+            self.f1.update(r1['Gx'], r1['Gy'], r1['Gz'], r1['Ax'], r1['Ay'], r1['Az'])
+            self.f2.update(r2['Gx'], r2['Gy'], r2['Gz'], r2['Ax'], r2['Ay'], r2['Az'])
+        return float(flexion_angles(self.f1.q, self.f2.q, self.j1, self.j2))
+
+    def run_batch(self, imu, out=None):
+        """
+        imu: array (N, 12) from packets.packets_to_array
+        out: optional preallocated (N,) array for the angles (degrees)
+        """
+        imu = np.asarray(imu, dtype=float)
+        N = imu.shape[0]
+        if out is None:
+            out = np.empty(N)
+        if N == 0:
+            return out
+        quats = np.empty((2, N, 4))
+        if self.f1.q is None:
+            self._init(imu[0, 0:3], imu[0, 6:9])
+            quats[0, 0] = self.f1.q
+            quats[1, 0] = self.f2.q
+            self.f1.run_batch(imu[1:, 0:6], out=quats[0, 1:])
+            self.f2.run_batch(imu[1:, 6:12], out=quats[1, 1:])
+        else:
+            self.f1.run_batch(imu[:, 0:6], out=quats[0])
+            self.f2.run_batch(imu[:, 6:12], out=quats[1])
+        out[:] = flexion_angles(quats[0], quats[1], self.j1, self.j2)
+        return out
@@ -0,0 +1,191 @@
+# src/packets.py
+import json
+import struct
+import numpy as np
+
+# ESP packet schema: {"IMU1": {"Ax":..,"Ay":..,"Az":..,"Gx":..,"Gy":..,"Gz":..}, "IMU2": {...}}
+IMU_NAMES = ('IMU1', 'IMU2')
+IMU_FIELDS = ('Ax', 'Ay', 'Az', 'Gx', 'Gy', 'Gz')
+N_CHANNELS = len(IMU_NAMES) * len(IMU_FIELDS)
+
+# column slices into a packet array of shape (N, 12)
+IMU1_ACC = slice(0, 3)
+IMU1_GYR = slice(3, 6)
+IMU2_ACC = slice(6, 9)
+IMU2_GYR = slice(9, 12)
+
+# Working precision of sample arrays, calibration matrices and angle outputs.
+# The MPU sensors are 16-bit, so float32 (24-bit mantissa) holds their
+# samples without loss and halves memory and bandwidth for long or batch
+# workloads. Angle filters keep float64 state and the calibration
+# optimizers work in float64, so float32 results stay within
+# FLOAT32_TOLERANCE of float64 (measured on 10 min synthetic walks at 50 Hz;
+# step counts, cadence and step times are identical).
+DTYPES = {'float64': np.float64, 'float32': np.float32}
+FLOAT32_TOLERANCE = {
+    'angle_deg': 1e-3,        # per-sample knee / chain angles and their stats (mean, SD, ROM, cycle curves)
+    'gyro_dps': 1e-4,         # gyro norms
+    'ratio': 1e-6,            # harmonic ratios, freeze index, freezing fraction
+}
+
+def resolve_dtype(dtype=None):
+    """numpy dtype for a precision option: None (float64), 'float32' / 'float64', or a numpy float type."""
+    if dtype is None:
+        return np.dtype(np.float64)
+    if isinstance(dtype, str):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype!r}; use one of {', '.join(DTYPES)}")
+        return np.dtype(DTYPES[dtype])
+    return np.dtype(dtype)
+
+def _packet_values(p, imus=IMU_NAMES):
+    try:
+        return [p[imu][f] for imu in imus for f in IMU_FIELDS]
+    except (KeyError, TypeError):
+        return [np.nan] * (len(imus) * len(IMU_FIELDS))
+
+def packets_to_array(packets, imus=IMU_NAMES, dtype=None):
+    """
+    Convert a list of packet dicts to a float array of shape (N, 12):
+    [IMU1 Ax Ay Az Gx Gy Gz, IMU2 Ax Ay Az Gx Gy Gz].
+    imus: sensor keys to read, in order (e.g. a kinematic chain's sensors);
+          the result then has 6 columns per sensor.
+    dtype: working precision (resolve_dtype), float64 by default.
+    Packets missing a field become a row of NaN.
+    """
+    dtype = resolve_dtype(dtype)
+    if len(packets) == 0:
+        return np.zeros((0, len(imus) * len(IMU_FIELDS)), dtype=dtype)
+    return np.array([_packet_values(p, imus) for p in packets], dtype=dtype)
+
+def array_to_packets(arr):
+    """Inverse of packets_to_array: list of {'IMU1': {...}, 'IMU2': {...}} dicts."""
+    n = len(IMU_FIELDS)
+    return [{imu: dict(zip(IMU_FIELDS, vals[k * n:(k + 1) * n])) for k, imu in enumerate(IMU_NAMES)}
+            for vals in np.asarray(arr, dtype=float).tolist()]
+
+# fixed-width sample row used between processes: [seq, t, 12 channels]
+ROW_SEQ = 0
+ROW_TIME = 1
+ROW_DATA = slice(2, 2 + N_CHANNELS)
+ROW_WIDTH = 2 + N_CHANNELS
+
+def packet_to_row(packet, seq, t, out=None):
+    """Write one packet into a (ROW_WIDTH,) float row; returns the row."""
+    if out is None:
+        out = np.empty(ROW_WIDTH)
+    out[ROW_SEQ] = seq
+    out[ROW_TIME] = t
+    out[ROW_DATA] = _packet_values(packet)
+    return out
+
+def row_to_packet(row):
+    """Inverse of packet_to_row: packet dict with 't' and, unless it is NaN (no device seq), 'seq'."""
+    vals = row[ROW_DATA].tolist()
+    n = len(IMU_FIELDS)
+    packet = {imu: dict(zip(IMU_FIELDS, vals[k * n:(k + 1) * n])) for k, imu in enumerate(IMU_NAMES)}
+    if row[ROW_SEQ] == row[ROW_SEQ]:
+        packet['seq'] = int(row[ROW_SEQ])
+    packet['t'] = float(row[ROW_TIME])
+    return packet
+
+# Optional compact binary frame for newer firmware (little endian, 56 bytes):
+# uint32 seq, uint32 device time (ms), 12 x float32 in IMU_NAMES x IMU_FIELDS order.
+# It has the same field order as a row, so one unpack fills a whole row.
+BINARY_FRAME = struct.Struct('<II12f')
+BINARY_DTYPE = np.dtype([('seq', '<u4'), ('t_ms', '<u4'), ('data', '<f4', (N_CHANNELS,))])
+
+def _number_or_nan(v):
+    # seq / t are optional; a malformed one (e.g. "7a") must not stop ingest
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        return np.nan
+    return v if np.isfinite(v) else np.nan
+
+class PacketDecoder:
+    """
+    Decode raw ESP websocket messages straight into fixed-width rows
+    ([seq, t, 12 channels], see ROW_*), skipping the per-packet dicts.
+    - binary frames (BINARY_FRAME): one struct unpack
+    - JSON text in the known {IMU1:{Ax..Gz}, IMU2:{...}} shape: one
+      json.loads and direct key reads (fast path)
+    - anything else: generic, tolerant conversion (fallback), or rejected
+      for non-sample messages such as ESP status lines
+    seq / t are NaN when the message does not carry them; t is device time
+    in seconds. counts tracks how many messages took each path.
+    """
+    def __init__(self):
+        self.counts = {'binary': 0, 'json_fast': 0, 'json_fallback': 0, 'rejected': 0}
+
+    def decode_into(self, raw, out):
+        """Fill `out` (ROW_WIDTH,) from one message. Returns True for a sample."""
+        if isinstance(raw, (bytes, bytearray, memoryview)):
+            if len(raw) != BINARY_FRAME.size:
+                self.counts['rejected'] += 1
+                return False
+            out[:] = BINARY_FRAME.unpack(raw)
+            out[ROW_TIME] *= 1e-3
+            self.counts['binary'] += 1
+            return True
+        try:
+            p = json.loads(raw)
+        except ValueError:
+            self.counts['rejected'] += 1
+            return False
+        if not isinstance(p, dict) or 'IMU1' not in p or 'IMU2' not in p:
+            self.counts['rejected'] += 1
+            return False
+        try:
+            i1 = p['IMU1']
+            i2 = p['IMU2']
+            out[ROW_DATA] = (i1['Ax'], i1['Ay'], i1['Az'], i1['Gx'], i1['Gy'], i1['Gz'],
+                             i2['Ax'], i2['Ay'], i2['Az'], i2['Gx'], i2['Gy'], i2['Gz'])
+            self.counts['json_fast'] += 1
+        except (KeyError, TypeError, ValueError):
+            # e.g. numbers sent as strings or a missing field
+            vals = []
+            for imu in IMU_NAMES:
+                for f in IMU_FIELDS:
+                    try:
+                        vals.append(float(p[imu][f]))
+                    except (KeyError, TypeError, ValueError):
+                        vals.append(np.nan)
+            out[ROW_DATA] = vals
+            self.counts['json_fallback'] += 1
+        out[ROW_SEQ] = _number_or_nan(p.get('seq'))
+        out[ROW_TIME] = _number_or_nan(p.get('t'))
+        return True
+
+    def decode_packet(self, raw):
+        """Decode one message to a packet dict (binary frames included), or None."""
+        if isinstance(raw, (bytes, bytearray, memoryview)):
+            row = np.empty(ROW_WIDTH)
+            return row_to_packet(row) if self.decode_into(raw, row) else None
+        p = json.loads(raw)
+        if isinstance(p, dict):
+            # as in decode_into: a malformed seq / t counts as missing
+            for key in ('seq', 't'):
+                if key in p:
+                    v = _number_or_nan(p[key])
+                    if v != v:
+                        del p[key]
+                    else:
+                        p[key] = int(v) if key == 'seq' and v.is_integer() else v
+        return p
+
+def decode_binary_frames(buf):
+    """
+    Batch-decode concatenated binary frames into an (N, ROW_WIDTH) array with
+    one vectorized view over the buffer.
+    """
+    frames = np.frombuffer(buf, dtype=BINARY_DTYPE)
+    rows = np.empty((len(frames), ROW_WIDTH))
+    rows[:, ROW_SEQ] = frames['seq']
+    rows[:, ROW_TIME] = frames['t_ms'] * 1e-3
+    rows[:, ROW_DATA] = frames['data']
+    return rows
+
+def encode_binary_frame(seq, t, values):
+    """Pack one sample as a BINARY_FRAME (t in seconds); for tests and simulators."""
+    return BINARY_FRAME.pack(int(seq) & 0xFFFFFFFF, int(round(t * 1000)) & 0xFFFFFFFF, *values)
@@ -0,0 +1,213 @@
+# src/pipeline.py
+import time
+import numpy as np
+from packets import packets_to_array, resolve_dtype, IMU1_ACC, IMU2_ACC, IMU2_GYR
+from quality import assess_signal_quality
+from gait_cycles import gait_cycle_summary
+from spectral import spectral_summary
+from sketches import RecordingSketches
+
+# name -> (function, dependency names). Stage functions take the pipeline
+# followed by the values of their dependencies, in declaration order.
+STAGES = {}
+
+def stage(name, deps=()):
+    """Register a pipeline stage computing `name` from `deps`."""
+    def register(fn):
+        STAGES[name] = (fn, tuple(deps))
+        return fn
+    return register
+
+DEFAULT_PARAMS = {
+    'step_height_factor': 0.6,
+    'min_step_s': 0.25,
+}
+
+class RecordingPipeline:
+    """
+    Lazily evaluated, memoized processing graph for one recording.
+    Each stage is computed on first request from its dependencies and cached,
+    so e.g. cadence and knee peaks share the same angle and gyro-norm arrays.
+    Values can be injected up front (or later with provide()) to override a
+    stage, e.g. calibrated angles or a pre-decoded packet array.
+    timings holds the wall time (s) spent in each computed stage.
+    dtype: working precision of the sample arrays (packets.resolve_dtype);
+           stages keep the dtype of their inputs.
+    """
+    def __init__(self, packets=None, sampling_rate=10.0, params=None, dtype=None, **provided):
+        self.packets = packets if packets is not None else []
+        self.sampling_rate = sampling_rate
+        self.dtype = resolve_dtype(dtype)
+        self.params = dict(DEFAULT_PARAMS, **(params or {}))
+        self._cache = dict(provided)
+        self.timings = {}
+
+    def provide(self, name, value):
+        self._cache[name] = value
+
+    def get(self, name):
+        if name in self._cache:
+            return self._cache[name]
+        if name not in STAGES:
+            raise KeyError(f"Unknown pipeline stage: {name}")
+        fn, deps = STAGES[name]
+        args = [self.get(d) for d in deps]
+        t0 = time.perf_counter()
+        value = fn(self, *args)
+        self.timings[name] = time.perf_counter() - t0
+        self._cache[name] = value
+        return value
+
+    __getitem__ = get
+
+    def stream_metrics(self):
+        """Same result dict as processors.compute_stream_metrics."""
+        if self.get('n_samples') == 0:
+            return {}
+        results = {
+            'times': self.get('times').tolist(),
+            'angles': self.get('accel_angle_list'),
+            'gyro_norms': finite_list(self.get('gyro_norms')),
+        }
+        results.update(self.get('step_stats'))
+        results.update(self.get('angle_stats'))
+        return results
+
+def finite_list(values):
+    """List for JSON: non-finite entries (e.g. NaN rows of repaired gaps) become None."""
+    return [float(v) if np.isfinite(v) else None for v in values]
+
+def json_safe(obj):
+    """obj with every non-finite float in nested dicts / lists / arrays replaced by None."""
+    if isinstance(obj, dict):
+        return {k: json_safe(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [json_safe(v) for v in obj]
+    if isinstance(obj, np.ndarray):
+        return json_safe(obj.tolist())
+    if isinstance(obj, (float, np.floating)):
+        return float(obj) if np.isfinite(obj) else None
+    if isinstance(obj, np.integer):
+        return int(obj)
+    return obj
+
+# ---------- stages ----------
+@stage('imu')
+def _imu(pipe):
+    return packets_to_array(pipe.packets, dtype=pipe.dtype)
+
+@stage('n_samples', deps=('imu',))
+def _n_samples(pipe, imu):
+    return int(imu.shape[0])
+
+@stage('arrival_times')
+def _arrival_times(pipe):
+    return None
+
+@stage('valid', deps=('imu',))
+def _valid(pipe, imu):
+    # samples usable by metrics; sequence repair provides its own mask with
+    # long packet-loss gaps marked False
+    return np.isfinite(imu).all(axis=1)
+
+@stage('times', deps=('n_samples',))
+def _times(pipe, n):
+    return np.arange(n) / pipe.sampling_rate
+
+def accel_angles(imu):
+    """Vectorized processors.process_packet_accel_angle over an (N, 12) packet array; NaN where undefined."""
+    a1 = imu[:, IMU1_ACC]
+    a2 = imu[:, IMU2_ACC]
+    n1 = np.linalg.norm(a1, axis=1)
+    n2 = np.linalg.norm(a2, axis=1)
+    ok = (n1 >= 1e-9) & (n2 >= 1e-9)
+    # atan2(|a1 x a2|, a1 . a2): same angle as arccos of the normalized dot,
+    # but well conditioned near 0 and 180 deg (matters in float32)
+    cross = np.linalg.norm(np.cross(a1, a2), axis=1)
+    angles = np.degrees(np.arctan2(cross, np.einsum('ij,ij->i', a1, a2)))
+    return np.where(ok, angles, np.nan)
+
+@stage('accel_angles', deps=('imu',))
+def _accel_angles(pipe, imu):
+    return accel_angles(imu)
+
+@stage('accel_angle_list', deps=('accel_angles',))
+def _accel_angle_list(pipe, angles):
+    return [None if np.isnan(a) else float(a) for a in angles]
+
+@stage('angles', deps=('accel_angle_list',))
+def _angles(pipe, accel_angle_list):
+    # best available knee angle; measurement_phase provides calibrated angles
+    return accel_angle_list
+
+@stage('gyro_norms', deps=('imu',))
+def _gyro_norms(pipe, imu):
+    return np.linalg.norm(imu[:, IMU2_GYR], axis=1)
+
+@stage('step_peaks', deps=('gyro_norms',))
+def _step_peaks(pipe, gnorms):
+    # scipy.signal takes ~1 s to import; defer until steps are actually needed
+    from scipy.signal import find_peaks
+
+    # step detection: peaks above mean + k*std, min distance
+    finite = np.isfinite(gnorms)
+    if not finite.any():
+        return np.zeros(0, dtype=np.int64)
+    th = np.mean(gnorms[finite]) + pipe.params['step_height_factor'] * np.std(gnorms[finite])
+    min_dist_samples = max(1, int(pipe.params['min_step_s'] * pipe.sampling_rate))
+    # invalid samples (lost packets) can never be peaks
+    signal = np.where(finite, gnorms, -np.inf) if not finite.all() else gnorms
+    peaks, _ = find_peaks(signal, height=th, distance=min_dist_samples)
+    return peaks
+
+@stage('step_stats', deps=('step_peaks', 'valid'))
+def _step_stats(pipe, peaks, valid):
+    step_times = (peaks / pipe.sampling_rate).tolist()
+    results = {
+        'step_times': step_times,
+        'step_indices': peaks.tolist(),
+        'detected_steps': int(len(peaks)),
+    }
+    # step intervals that span an invalid segment are not real step times
+    bad = np.cumsum(~valid)
+    spans_gap = bad[peaks[1:]] != bad[peaks[:-1]] if len(peaks) >= 2 else np.zeros(0, dtype=bool)
+    intervals = np.diff(step_times)[~spans_gap] if len(step_times) >= 2 else np.zeros(0)
+    if len(intervals) >= 1:
+        mean_step_time = float(np.mean(intervals))
+        results['mean_step_time_s'] = mean_step_time
+        results['cadence_spm'] = 60.0 / mean_step_time if mean_step_time > 0 else None
+    else:
+        results['mean_step_time_s'] = None
+        results['cadence_spm'] = None
+    return results
+
+@stage('angle_stats', deps=('accel_angles',))
+def _angle_stats(pipe, angles):
+    valid = angles[~np.isnan(angles)]
+    if len(valid) == 0:
+        # e.g. a dead IMU: every accel vector is zero
+        return {'mean_knee_angle_deg': None, 'std_knee_angle_deg': None, 'peak_knee_angle_deg': None}
+    return {
+        'mean_knee_angle_deg': float(np.mean(valid)),
+        'std_knee_angle_deg': float(np.std(valid)),
+        'peak_knee_angle_deg': float(np.max(valid)),
+    }
+
+@stage('quality', deps=('imu', 'arrival_times'))
+def _quality(pipe, imu, arrival_times):
+    return assess_signal_quality(imu, arrival_times=arrival_times, require_excitation=False)
+
+@stage('gait_cycles', deps=('angles', 'step_peaks', 'valid'))
+def _gait_cycles(pipe, angles, peaks, valid):
+    return gait_cycle_summary(angles, peaks, sampling_rate=pipe.sampling_rate, valid=valid)
+
+@stage('spectral', deps=('gyro_norms', 'angles'))
+def _spectral(pipe, gnorms, angles):
+    return spectral_summary(gnorms, angles, sampling_rate=pipe.sampling_rate)
+
+@stage('sketches', deps=('angles', 'accel_angles', 'gyro_norms', 'valid'))
+def _sketches(pipe, angles, accel, gnorms, valid):
+    knee = np.array([np.nan if a is None else a for a in angles], dtype=float)
+    sk = RecordingSketches()
+    sk.update_batch(np.where(valid, knee, np.nan), np.where(valid, gnorms, np.nan), np.where(valid, accel, np.nan))
+    return sk
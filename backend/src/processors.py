@@ -1,6 +1,8 @@
 # src/processors.py
 import numpy as np
-from scipy.signal import find_peaks
+from pipeline import RecordingPipeline
+from bilateral import bilateral_summary
+import profiling
 
 def gyro_norm(gyro):
     g = np.array([gyro['Gx'], gyro['Gy'], gyro['Gz']], dtype=float)
@@ -23,49 +25,31 @@ def process_packet_accel_angle(packet):
     angle_rad = np.arccos(dot)
     return float(np.degrees(angle_rad))
 
-def compute_stream_metrics(packets, sampling_rate=10.0, step_height_factor=0.6, min_step_s=0.25):
+@profiling.profiled()
+def compute_stream_metrics(packets, sampling_rate=10.0, step_height_factor=0.6, min_step_s=0.25, pipeline=None):
     """
     packets: list of dicts (each packet JSON from ESP)
+    pipeline: optional RecordingPipeline already built for these packets, so
+              intermediates computed elsewhere are reused
     returns dict with times, angles, gyro_norms, step_times, cadence, etc.
     """
-    N = len(packets)
-    times = np.arange(N) / sampling_rate
-    angles = []
-    gnorms = []
-    for p in packets:
-        angle = process_packet_accel_angle(p)
-        gnorm = gyro_norm(p['IMU2'])
-        angles.append(angle)
-        gnorms.append(gnorm)
-    gnorms = np.array(gnorms)
-    # step detection: peaks above mean + k*std, min distance
-    if N == 0:
-        return {}
-    th = np.mean(gnorms) + step_height_factor * np.std(gnorms)
-    min_dist_samples = max(1, int(min_step_s * sampling_rate))
-    peaks, props = find_peaks(gnorms, height=th, distance=min_dist_samples)
-    step_times = (peaks / sampling_rate).tolist()
-
-    results = {
-        'times': times.tolist(),
-        'angles': angles,
-        'gyro_norms': gnorms.tolist(),
-        'step_times': step_times,
-        'detected_steps': int(len(peaks)),
-    }
-    if len(step_times) >= 2:
-        intervals = np.diff(step_times)
-        mean_step_time = float(np.mean(intervals))
-        results['mean_step_time_s'] = mean_step_time
-        results['cadence_spm'] = 60.0 / mean_step_time if mean_step_time > 0 else None
-    else:
-        results['mean_step_time_s'] = None
-        results['cadence_spm'] = None
-
-    results['mean_knee_angle_deg'] = float(np.nanmean([a for a in angles if a is not None]))
-    results['std_knee_angle_deg'] = float(np.nanstd([a for a in angles if a is not None]))
-    results['peak_knee_angle_deg'] = float(np.nanmax([a for a in angles if a is not None]))
-    return results
+    if pipeline is None:
+        pipeline = RecordingPipeline(packets, sampling_rate=sampling_rate,
+                                     params={'step_height_factor': step_height_factor,
+                                             'min_step_s': min_step_s})
+    return pipeline.stream_metrics()
+
+@profiling.profiled()
+def compute_bilateral_metrics(left_packets, right_packets, sampling_rate=50.0, left_arrivals=None,
+                              right_arrivals=None):
+    """
+    Left and right leg recordings from two devices (independent clocks):
+    returns {'clock': offset / drift model, 'n_samples', 'symmetry': step
+    time, knee ROM and stance ratio per leg with symmetry indices}.
+    See bilateral.bilateral_summary.
+    """
+    return bilateral_summary(left_packets, right_packets, sampling_rate=sampling_rate,
+                             left_arrivals=left_arrivals, right_arrivals=right_arrivals)
 
 
 
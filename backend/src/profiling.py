@@ -0,0 +1,222 @@
+# src/profiling.py
+# Opt-in profiling of recording sessions and server routes. Off unless
+# enabled by $IMU_PROFILE (main.py --profile) or POST /admin/profiling:
+#   cpu - cProfile of each wrapped call -> <tag>_<name>_<time>.prof
+#         (pstats format: python -m pstats, snakeviz, gprof2dot, ...)
+#   mem - tracemalloc snapshot at the end of the call -> .tracemalloc
+#         (tracemalloc.Snapshot.load); slows the profiled code down
+# Files are tagged with the recording ID (or the route's patient/recording)
+# and written to $IMU_PROFILE_DIR, default data/profiles. `sample` profiles
+# only that fraction of calls, for busy routes. When profiling is off a
+# wrapped function costs one dict lookup per call; cProfile, tracemalloc
+# and pstats are not even imported. Async functions are profiled only while
+# they run, not while they await, so the profile holds neither the other
+# coroutines the event loop serves meanwhile nor the awaited wait itself.
+import os
+import re
+import time
+import random
+import inspect
+import itertools
+import threading
+import functools
+import contextlib
+import contextvars
+
+MODES = ('cpu', 'mem')
+DEFAULT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'profiles'))
+
+_config = {'modes': frozenset(), 'sample': 1.0, 'dir': DEFAULT_DIR, 'tag': None}
+# set inside a profiled call (per thread and per asyncio task), so nested ones are covered by it
+_active = contextvars.ContextVar('profiling_active', default=False)
+_mem_lock = threading.Lock()
+_mem_users = 0
+_counter = itertools.count()
+
+def parse_modes(spec):
+    """'cpu', 'mem', 'cpu,mem' or '1' (= cpu); '', '0' or None turn profiling off."""
+    if spec is None or str(spec).strip() in ('', '0'):
+        return frozenset()
+    if str(spec).strip() == '1':
+        return frozenset({'cpu'})
+    modes = frozenset(m.strip() for m in str(spec).split(',') if m.strip())
+    unknown = modes - set(MODES)
+    if unknown:
+        raise ValueError(f"Unknown profiling modes {sorted(unknown)}; use {', '.join(MODES)}")
+    return modes
+
+def configure(modes=None, sample=None, out_dir=None, tag=None):
+    """Change the profiling settings; arguments left as None keep their value."""
+    if modes is not None:
+        _config['modes'] = parse_modes(modes)
+    if sample is not None:
+        if not 0.0 < float(sample) <= 1.0:
+            raise ValueError("sample must be in (0, 1]")
+        _config['sample'] = float(sample)
+    if out_dir is not None:
+        _config['dir'] = out_dir
+    if tag is not None:
+        _config['tag'] = tag
+
+def settings():
+    return {'modes': sorted(_config['modes']), 'sample': _config['sample'], 'dir': _config['dir']}
+
+def enabled():
+    return bool(_config['modes'])
+
+def child_env():
+    """Environment entries that carry the current settings into a main.py subprocess."""
+    if not _config['modes']:
+        return {}
+    return {'IMU_PROFILE': ','.join(sorted(_config['modes'])), 'IMU_PROFILE_DIR': _config['dir']}
+
+def list_profiles(limit=200):
+    """Newest profile files first: [{'name', 'size', 'mtime'}]."""
+    if not os.path.isdir(_config['dir']):
+        return []
+    entries = [e for e in os.scandir(_config['dir']) if e.is_file()]
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    return [{'name': e.name, 'size': e.stat().st_size, 'mtime': e.stat().st_mtime} for e in entries[:limit]]
+
+def profile_path(name):
+    """Path of a profile file by name (None for anything outside the profile directory)."""
+    if os.path.basename(name) != name or name.startswith('.'):
+        return None
+    path = os.path.join(_config['dir'], name)
+    return path if os.path.isfile(path) else None
+
+def _start_mem():
+    global _mem_users
+    import tracemalloc
+
+    with _mem_lock:
+        if _mem_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        _mem_users += 1
+
+def _stop_mem(path):
+    global _mem_users
+    import tracemalloc
+
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '*/cProfile.py'),
+    ])
+    snapshot.dump(path)
+    with _mem_lock:
+        _mem_users -= 1
+        if _mem_users == 0:
+            tracemalloc.stop()
+
+def _base_path(name, tag):
+    tag = re.sub(r'[^A-Za-z0-9_\-]', '_', str(tag or _config['tag'] or 'untagged'))
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(_config['dir'], f"{tag}_{name}_{stamp}_{os.getpid()}-{next(_counter)}")
+
+def _enable(prof):
+    try:
+        prof.enable()
+        return True
+    except ValueError:
+        return False  # another profiler is active (Python 3.12+ allows one per process)
+
+@contextlib.contextmanager
+def _session(name, tag):
+    # (base path, cProfile.Profile or None) of one profiled call, or None when not profiling it
+    modes = _config['modes']
+    if not modes or _active.get() or random.random() >= _config['sample']:
+        yield None
+        return
+    import cProfile
+
+    token = _active.set(True)
+    base = _base_path(name, tag)
+    os.makedirs(_config['dir'], exist_ok=True)
+    prof = cProfile.Profile() if 'cpu' in modes else None
+    try:
+        if 'mem' in modes:
+            _start_mem()
+        yield base, prof
+    finally:
+        if 'mem' in modes:
+            _stop_mem(base + '.tracemalloc')
+        if prof is not None:
+            prof.dump_stats(base + '.prof')
+        _active.reset(token)
+        print(f"Profile written: {base}.*")
+
+@contextlib.contextmanager
+def profile_block(name, tag=None):
+    """
+    Profile the enclosed code when profiling is on (and the call is sampled).
+    Nested blocks in the same thread / asyncio task are covered by the
+    outermost one. Yields the output path prefix, or None when not profiling.
+    """
+    with _session(name, tag) as session:
+        if session is None:
+            yield None
+            return
+        base, prof = session
+        on = prof is not None and _enable(prof)
+        try:
+            yield base
+        finally:
+            if on:
+                prof.disable()
+
+class _Suspend:
+    # hands what the inner coroutine yielded (a future) on to the task running us
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __await__(self):
+        return (yield self.value)
+
+async def _profile_steps(coro, prof):
+    """Await coro with prof enabled only while coro runs, not while it is suspended."""
+    send, exc = None, None
+    while True:
+        on = _enable(prof)
+        try:
+            yielded = coro.throw(exc) if exc is not None else coro.send(send)
+        except StopIteration as e:
+            return e.value
+        finally:
+            if on:
+                prof.disable()
+        try:
+            send, exc = await _Suspend(yielded), None
+        except BaseException as e:  # cancellation included: the inner coroutine handles it
+            send, exc = None, e
+
+def profiled(name=None, tag_arg=None):
+    """
+    Decorator running the function under profile_block(name) when profiling is on.
+    tag_arg: keyword argument whose value tags the files (e.g. a route's 'rid');
+             otherwise the configured tag (the recording ID in main.py).
+    Works on plain and async functions; the signature is kept for FastAPI.
+    """
+    def wrap(fn):
+        label = name or fn.__name__
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                if not _config['modes']:
+                    return await fn(*args, **kwargs)
+                with _session(label, kwargs.get(tag_arg) if tag_arg else None) as session:
+                    if session is None or session[1] is None:
+                        return await fn(*args, **kwargs)
+                    return await _profile_steps(fn(*args, **kwargs), session[1])
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not _config['modes']:
+                    return fn(*args, **kwargs)
+                with profile_block(label, kwargs.get(tag_arg) if tag_arg else None):
+                    return fn(*args, **kwargs)
+        return wrapper
+    return wrap
+
+configure(modes=os.getenv('IMU_PROFILE'), sample=os.getenv('IMU_PROFILE_SAMPLE'), out_dir=os.getenv('IMU_PROFILE_DIR'))
@@ -0,0 +1,133 @@
+# src/quality.py
+import numpy as np
+from packets import IMU_NAMES, IMU1_ACC, IMU1_GYR, IMU2_ACC, IMU2_GYR
+
+_IMU_COLS = {
+    'IMU1': (IMU1_ACC, IMU1_GYR),
+    'IMU2': (IMU2_ACC, IMU2_GYR),
+}
+
+def _clipped_fraction(x, min_pinned=3):
+    """
+    Per-channel fraction of samples pinned at the channel's extreme value.
+    A clipping sensor piles samples up on its rail: more samples sit exactly
+    at the extreme than in the 20% band below it, which never happens
+    for a smooth (even quantized) waveform. Channels that barely vary
+    (e.g. gravity at rest) are never counted.
+    """
+    ax = np.abs(x)
+    peak = np.nanmax(ax, axis=0)
+    pinned = (ax == peak) & (peak > 0)
+    count = pinned.sum(axis=0)
+    below = ((ax >= 0.8 * peak) & ~pinned).sum(axis=0)
+    moving = x.std(axis=0) > 0.1 * peak
+    clipped = (count >= min_pinned) & (count > below) & moving
+    return np.where(clipped, count / max(1, len(x)), 0.0)
+
+def _longest_run(mask):
+    # length of the longest run of True values, vectorized
+    if not mask.any():
+        return 0
+    m = np.concatenate(([0], mask.astype(np.int8), [0]))
+    d = np.diff(m)
+    return int((np.flatnonzero(d == -1) - np.flatnonzero(d == 1)).max())
+
+def assess_signal_quality(imu, arrival_times=None, require_excitation=True,
+                          min_samples=10, max_nonfinite_frac=0.05,
+                          accel_range=None, gyro_range=None, max_clipped_frac=0.02,
+                          flat_std=1e-6, max_stuck_frac=0.3,
+                          gap_factor=3.0, max_gap_frac=0.1,
+                          min_gyro_rms=10.0, min_axis_conditioning=0.05):
+    """
+    Fast signal-quality gate on a packet array.
+    imu: array (N, 12) from packets.packets_to_array
+    arrival_times: optional (N,) receive timestamps (s) for gap detection
+    require_excitation: also check calibration motion (gyro excitation and
+                        conditioning of the joint-axis problem)
+    accel_range/gyro_range: optional sensor full-scale values; samples at or
+                            beyond 99% of them count as saturated
+    min_gyro_rms: minimum RMS gyro norm per IMU (sensor units, deg/s)
+    min_axis_conditioning: minimum ratio of 2nd to 1st singular value of the
+                           gyro matrix; below it the motion is essentially
+                           about one axis and identify_joint_axis is ill-posed
+    Returns a report dict: {'ok', 'issues', 'checks'}.
+    """
+    imu = np.asarray(imu, dtype=float)
+    N = imu.shape[0]
+    issues = []
+    checks = {'n_samples': int(N)}
+
+    if N < min_samples:
+        issues.append(f"too few samples ({N} < {min_samples})")
+        return {'ok': False, 'issues': issues, 'checks': checks}
+
+    finite = np.isfinite(imu).all(axis=1)
+    nonfinite_frac = float(1.0 - finite.mean())
+    checks['nonfinite_frac'] = nonfinite_frac
+    if nonfinite_frac > max_nonfinite_frac:
+        issues.append(f"{nonfinite_frac:.0%} of packets malformed")
+    x = imu[finite]
+    if len(x) < min_samples:
+        issues.append("too few valid packets")
+        return {'ok': False, 'issues': issues, 'checks': checks}
+
+    for name in IMU_NAMES:
+        acc_cols, gyr_cols = _IMU_COLS[name]
+        acc = x[:, acc_cols]
+        gyr = x[:, gyr_cols]
+        c = {}
+
+        # saturation: pinned at the rail, or beyond a known full scale
+        clipped = np.maximum(_clipped_fraction(acc).max(), _clipped_fraction(gyr).max())
+        if accel_range is not None:
+            clipped = max(clipped, float((np.abs(acc) >= 0.99 * accel_range).any(axis=1).mean()))
+        if gyro_range is not None:
+            clipped = max(clipped, float((np.abs(gyr) >= 0.99 * gyro_range).any(axis=1).mean()))
+        c['clipped_frac'] = float(clipped)
+        if clipped > max_clipped_frac:
+            issues.append(f"{name} saturated on {clipped:.0%} of samples")
+
+        # dead / frozen sensor
+        std = np.concatenate([acc.std(axis=0), gyr.std(axis=0)])
+        c['min_channel_std'] = float(std.min())
+        stuck = np.all(np.diff(np.hstack([acc, gyr]), axis=0) == 0, axis=1)
+        c['stuck_frac'] = _longest_run(stuck) / float(len(x))
+        flat = bool((std < flat_std).all())
+        if flat:
+            issues.append(f"{name} is flat (no signal)")
+        elif c['stuck_frac'] > max_stuck_frac:
+            issues.append(f"{name} output frozen for {c['stuck_frac']:.0%} of capture")
+
+        gnorm = np.linalg.norm(gyr, axis=1)
+        c['gyro_rms'] = float(np.sqrt(np.mean(gnorm ** 2)))
+        sv = np.linalg.svd(gyr, compute_uv=False)
+        c['axis_conditioning'] = float(sv[1] / sv[0]) if sv[0] > 0 else 0.0
+        if require_excitation and not flat:
+            if c['gyro_rms'] < min_gyro_rms:
+                issues.append(f"{name} barely moving (gyro RMS {c['gyro_rms']:.1f})")
+            elif c['axis_conditioning'] < min_axis_conditioning:
+                issues.append(f"{name} rotates about a single axis only; vary the motion")
+        checks[name] = c
+
+    if arrival_times is not None and len(arrival_times) > 2:
+        dt = np.diff(np.asarray(arrival_times, dtype=float))
+        med = float(np.median(dt))
+        gaps = dt > gap_factor * med if med > 0 else np.zeros(len(dt), dtype=bool)
+        # approximate number of samples missing inside the gaps
+        lost = float(np.sum(dt[gaps] / med - 1.0)) if med > 0 else 0.0
+        checks['median_dt_s'] = med
+        checks['n_gaps'] = int(gaps.sum())
+        checks['max_gap_s'] = float(dt.max())
+        checks['gap_frac'] = lost / (lost + N)
+        if checks['gap_frac'] > max_gap_frac:
+            issues.append(f"packet gaps: ~{checks['gap_frac']:.0%} of samples lost")
+
+    return {'ok': len(issues) == 0, 'issues': issues, 'checks': checks}
+
+def print_quality_report(report):
+    if report['ok']:
+        print("[OK] Signal quality check passed")
+        return
+    print("[ERROR] Signal quality check failed:")
+    for issue in report['issues']:
+        print(f"  - {issue}")
@@ -0,0 +1,192 @@
+# src/recording_index.py
+import os
+import json
+import bisect
+import threading
+from aggregates import TREND_METRICS, recording_point
+
+# numeric metrics that can be range-filtered (GET /recordings?<metric>_lt=...)
+INDEX_METRICS = TREND_METRICS
+
+# query suffix -> (bound side, inclusive); longer suffixes first when parsing
+RANGE_OPS = {'_lte': ('hi', True), '_gte': ('lo', True), '_lt': ('hi', False), '_gt': ('lo', False)}
+
+def parse_range_filters(params, reserved=()):
+    """
+    {metric: [lo, lo_inclusive, hi, hi_inclusive]} from query parameters
+    like cadence_spm_lt=90; keys in `reserved` are skipped. Raises
+    ValueError on unknown metrics or non-numeric bounds.
+    """
+    ranges = {}
+    for key, value in params.items():
+        if key in reserved:
+            continue
+        op = next((s for s in RANGE_OPS if key.endswith(s)), None)
+        metric = key[:-len(op)] if op else key
+        if op is None or metric not in INDEX_METRICS:
+            raise ValueError(f"Unknown filter: {key}")
+        try:
+            bound = float(value)
+        except ValueError:
+            raise ValueError(f"Filter {key} needs a number")
+        side, inclusive = RANGE_OPS[op]
+        r = ranges.setdefault(metric, [None, True, None, True])
+        if side == 'lo':
+            r[0], r[1] = bound, inclusive
+        else:
+            r[2], r[3] = bound, inclusive
+    return ranges
+
+class _SortedColumn:
+    """(value, recording id) pairs kept sorted by value for range lookups."""
+    def __init__(self):
+        self.values = []
+        self.ids = []
+
+    def insert(self, value, rid):
+        i = bisect.bisect_right(self.values, value)
+        self.values.insert(i, value)
+        self.ids.insert(i, rid)
+
+    def load(self, pairs):
+        # bulk (value, id) load: one sort instead of an insert per row
+        pairs = sorted(pairs, key=lambda p: p[0])
+        self.values = [v for v, _ in pairs]
+        self.ids = [rid for _, rid in pairs]
+
+    def span(self, lo=None, lo_inclusive=True, hi=None, hi_inclusive=True):
+        """Index range [i, j) of the values within the bounds."""
+        i, j = 0, len(self.values)
+        if lo is not None:
+            i = (bisect.bisect_left if lo_inclusive else bisect.bisect_right)(self.values, lo)
+        if hi is not None:
+            j = (bisect.bisect_right if hi_inclusive else bisect.bisect_left)(self.values, hi)
+        return i, max(i, j)
+
+def recording_key(rec):
+    """Sort / pagination key of a recording (or index row): oldest first, ties by id."""
+    return (rec.get('timestamp') or 0, rec['id'])
+
+def _within(v, lo, lo_inclusive, hi, hi_inclusive):
+    if v is None:
+        return False
+    if lo is not None and (v < lo or (v == lo and not lo_inclusive)):
+        return False
+    if hi is not None and (v > hi or (v == hi and not hi_inclusive)):
+        return False
+    return True
+
+class RecordingIndex:
+    """
+    Key numeric metrics of every recording, for range queries.
+    - recording_index.jsonl: one row per recording (id, patient, date,
+      label and the INDEX_METRICS values), appended when it is written
+    - in memory: a sorted column per metric and for the date, and the
+      recording IDs per patient
+    A query looks up how many rows each condition matches (binary search),
+    walks only the most selective one and checks the other conditions on
+    those rows, so its cost follows the result size rather than the number
+    of stored recordings. rebuild() recreates the log from recordings.json.
+    """
+    def __init__(self, data_dir):
+        self.path = os.path.join(data_dir, 'recording_index.jsonl')
+        self._lock = threading.Lock()
+        self._reset()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self._load(json.loads(line) for line in f if line.strip())
+
+    @property
+    def ready(self):
+        return os.path.exists(self.path)
+
+    def _reset(self):
+        self.rows = {}
+        self.by_patient = {}
+        self.columns = {k: _SortedColumn() for k in INDEX_METRICS + ('date',)}
+
+    @staticmethod
+    def _keys(row):
+        # (column, value) pairs a row is indexed under
+        keys = [(k, row['metrics'][k]) for k in INDEX_METRICS if row['metrics'].get(k) is not None]
+        if row.get('date'):
+            keys.append(('date', row['date']))
+        return keys
+
+    def _add_row(self, row):
+        if row['id'] in self.rows:
+            return False  # first write wins; recordings are not rewritten
+        self.rows[row['id']] = row
+        self.by_patient.setdefault(row.get('patient_id'), []).append(row['id'])
+        return True
+
+    def _insert(self, row):
+        if self._add_row(row):
+            for k, v in self._keys(row):
+                self.columns[k].insert(v, row['id'])
+
+    def _load(self, rows):
+        pairs = {k: [] for k in self.columns}
+        for row in rows:
+            if self._add_row(row):
+                for k, v in self._keys(row):
+                    pairs[k].append((v, row['id']))
+        for k, col in self.columns.items():
+            col.load(pairs[k])
+
+    @staticmethod
+    def _row(rec):
+        point = recording_point(rec)
+        return {'id': rec.get('id'), 'patient_id': rec.get('patient_id'), 'date': rec.get('date'),
+                'timestamp': rec.get('timestamp'), 'label': rec.get('label'),
+                'metrics': {k: point[k] for k in INDEX_METRICS}}
+
+    def rebuild(self, recordings):
+        with self._lock:
+            self._reset()
+            rows = [self._row(rec) for rec in recordings]
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.writelines(json.dumps(row) + "\n" for row in rows)
+            os.replace(tmp, self.path)
+            self._load(rows)
+
+    def recording_added(self, rec):
+        with self._lock:
+            row = self._row(rec)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(row) + "\n")
+            self._insert(row)
+            return row
+
+    def query(self, ranges=None, patient_id=None, date_from=None, date_to=None):
+        """
+        Index rows matching every condition, oldest first.
+        ranges: {metric: [lo, lo_inclusive, hi, hi_inclusive]} (parse_range_filters)
+        date_from / date_to: inclusive 'YYYY-MM-DD' bounds
+        """
+        conditions = dict(ranges or {})
+        if date_from or date_to:
+            conditions['date'] = [date_from or None, True, date_to or None, True]
+        with self._lock:
+            # candidate list from the most selective condition
+            best = None
+            if patient_id is not None:
+                best = self.by_patient.get(patient_id, [])
+            for key, bounds in conditions.items():
+                col = self.columns[key]
+                i, j = col.span(*bounds)
+                if best is None or j - i < len(best):
+                    best = col.ids[i:j]
+            if best is None:
+                best = list(self.rows)
+            out = []
+            for rid in best:
+                row = self.rows[rid]
+                if patient_id is not None and row.get('patient_id') != patient_id:
+                    continue
+                values = dict(row['metrics'], date=row.get('date'))
+                if all(_within(values.get(k), *b) for k, b in conditions.items()):
+                    out.append(row)
+        out.sort(key=recording_key)
+        return out
@@ -0,0 +1,84 @@
+# src/sample_selection.py
+# Picks the calibration rows worth optimizing over. Minutes of calibration
+# motion are mostly repeats of the same few states plus near-static pauses;
+# the joint axis / position cost functions only gain from distinct,
+# well-excited states, so the optimizers get a bounded subset instead.
+import numpy as np
+
+def excitation_scores(gyr, g_dot):
+    """
+    Per-row excitation score from gyro (N, S, 3) and its derivative (N, S, 3)
+    for S sensors: gyro magnitude weighted by how far the rotation axis is
+    from the sensor's dominant axis (axis diversity), plus angular
+    acceleration. Magnitudes are scaled by their 90th percentile, so scores
+    are comparable across sensors and units.
+    """
+    gm = np.linalg.norm(gyr, axis=-1)  # (N, S)
+    am = np.linalg.norm(g_dot, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        u = gyr / gm[..., None]
+    u = np.where(np.isfinite(u), u, 0.0)
+    # dominant rotation axis per sensor: top eigenvector of the gyro scatter
+    _, vecs = np.linalg.eigh(np.einsum('nsa,nsb->sab', gyr, gyr))
+    dominant = vecs[..., -1]  # (S, 3)
+    diversity = 1.0 - np.einsum('nsk,sk->ns', u, dominant) ** 2
+    g_scale = np.maximum(np.percentile(gm, 90, axis=0), 1e-9)
+    a_scale = np.maximum(np.percentile(am, 90, axis=0), 1e-9)
+    score = (gm / g_scale) * (0.5 + diversity) + 0.5 * (am / a_scale)
+    return score.mean(axis=1)
+
+def _state_bins(gyr, n_bins):
+    # quantized rotation direction and log magnitude per sensor: rows in the
+    # same bin are near-identical states for the calibration cost
+    gm = np.linalg.norm(gyr, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        u = np.nan_to_num(gyr / gm[..., None])
+    qu = np.clip(((u + 1.0) * 0.5 * n_bins).astype(np.int64), 0, n_bins - 1)
+    qm = np.floor(np.log2(1.0 + gm) * n_bins / 4.0).astype(np.int64)
+    keys = np.concatenate([qu.reshape(len(gyr), -1), qm], axis=1)
+    # one int64 per row (polynomial hash, wrapping); a rare collision only merges two bins
+    mult = np.int64(1000003) ** np.arange(keys.shape[1], dtype=np.int64)
+    with np.errstate(over='ignore'):
+        return np.unique(keys @ mult, return_inverse=True)[1]
+
+def _best_per_bin(bins, score):
+    # index of the highest-scoring row in every bin
+    order = np.lexsort((-score, bins))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = bins[order][1:] != bins[order][:-1]
+    return order[first]
+
+def select_informative(gyr, g_dot, max_samples=400, static_gyro=5.0, n_bins=16, min_samples=20):
+    """
+    Indices (sorted) of at most max_samples well-spread, well-excited rows.
+    gyr, g_dot: (N, S, 3) gyro and its derivative per sensor
+    static_gyro: rows where every sensor turns slower than this are dropped
+    Rows are binned by rotation state and only the best-scoring row per bin
+    is kept; the bins are coarsened until the subset fits, so it spreads over
+    the motion rather than piling up on its most energetic part.
+    Recordings that already fit (N <= max_samples) are returned whole.
+    """
+    gyr = np.asarray(gyr, dtype=float)
+    g_dot = np.asarray(g_dot, dtype=float)
+    N = len(gyr)
+    if N <= max_samples:
+        return np.arange(N)
+    finite = np.isfinite(gyr).all(axis=(1, 2)) & np.isfinite(g_dot).all(axis=(1, 2))
+    moving = finite & (np.linalg.norm(gyr, axis=-1) >= static_gyro).any(axis=1)
+    rows = np.flatnonzero(moving if moving.sum() >= min_samples else finite)
+    g, score = gyr[rows], excitation_scores(gyr[rows], g_dot[rows])
+    finer = np.arange(len(rows))
+    keep = finer
+    while n_bins >= 2:
+        keep = _best_per_bin(_state_bins(g, n_bins), score)
+        if len(keep) <= max_samples:
+            break
+        finer = keep
+        n_bins //= 2
+    if len(keep) < max_samples:
+        # top up from the next finer level, best first
+        extra = np.setdiff1d(finer, keep)
+        keep = np.concatenate([keep, extra[np.argsort(-score[extra])[:max_samples - len(keep)]]])
+    elif len(keep) > max_samples:
+        keep = keep[np.argsort(-score[keep])[:max_samples]]
+    return np.sort(rows[keep])
@@ -0,0 +1,170 @@
+# src/segments.py
+import os
+import json
+import bisect
+from sketches import RecordingSketches, merge_sketches
+
+INDEX_NAME = 'index.json'
+
+def _segment_name(k):
+    return f"seg_{k:05d}.jsonl"
+
+class SegmentWriter:
+    """
+    Raw packets of one long session as a directory of rolling JSONL segments.
+    A new segment starts when the current one covers `max_segment_s` seconds
+    or reaches `max_segment_bytes`. index.json lists, per segment, the file
+    name, first/last sample time and the session-wide sample offset, so a
+    reader can go straight to the segments covering a time range.
+    The index is rewritten (atomically) whenever a segment is closed, so a
+    crash loses at most the tail of the open segment from the index.
+    Samples passed to write() also update the segment's RecordingSketches,
+    stored in its index entry ('sketch'), so SegmentReader.sketch() gives
+    session distributions without reading any packets.
+    """
+    def __init__(self, session_dir, max_segment_s=60.0, max_segment_bytes=8 << 20):
+        self.session_dir = session_dir
+        self.max_segment_s = max_segment_s
+        self.max_segment_bytes = max_segment_bytes
+        os.makedirs(session_dir, exist_ok=True)
+        self.segments = []
+        self.n_samples = 0
+        self._f = None
+        self._current = None
+        self._sketch = None
+
+    def _open_segment(self, t):
+        name = _segment_name(len(self.segments))
+        self._f = open(os.path.join(self.session_dir, name), 'w')
+        self._current = {'file': name, 'start_t': t, 'end_t': t,
+                         'first_sample': self.n_samples, 'n_samples': 0, 'bytes': 0}
+        self.segments.append(self._current)
+        self._sketch = None
+
+    def _close_segment(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+            if self._sketch is not None:
+                self._current['sketch'] = self._sketch.to_dict()
+            self._write_index()
+
+    def _write_index(self):
+        tmp = os.path.join(self.session_dir, INDEX_NAME + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'version': 1, 'n_samples': self.n_samples, 'segments': self.segments}, f)
+        os.replace(tmp, os.path.join(self.session_dir, INDEX_NAME))
+
+    def write(self, packet, t, sample=None):
+        """
+        Append one packet. t (s, non-decreasing) is used unless the packet
+        carries its own 't'; it is stored with the packet either way.
+        sample: optional (accel angle deg, gyro norm deg/s) for the segment
+                sketch; its accel_angle_deg is the same signal as in the
+                recording sketches, knee_angle_deg stays empty.
+        """
+        if 't' in packet:
+            t = packet['t']
+        else:
+            packet = dict(packet, t=t)
+        cur = self._current
+        if self._f is None or t - cur['start_t'] >= self.max_segment_s or cur['bytes'] >= self.max_segment_bytes:
+            self._close_segment()
+            self._open_segment(t)
+            cur = self._current
+        line = json.dumps(packet) + "\n"
+        self._f.write(line)
+        cur['end_t'] = t
+        cur['n_samples'] += 1
+        cur['bytes'] += len(line)
+        self.n_samples += 1
+        if sample is not None:
+            if self._sketch is None:
+                self._sketch = RecordingSketches()
+            self._sketch.update(accel_angle_deg=sample[0], gyro_norm_dps=sample[1])
+
+    def close(self):
+        self._close_segment()
+        if not self.segments:
+            self._write_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class SegmentReader:
+    """Random access into a SegmentWriter session through its index."""
+    def __init__(self, session_dir):
+        self.session_dir = session_dir
+        with open(os.path.join(session_dir, INDEX_NAME)) as f:
+            index = json.load(f)
+        self.segments = index['segments']
+        self.n_samples = index['n_samples']
+        self._ends = [s['end_t'] for s in self.segments]
+        self._offsets = [s['first_sample'] for s in self.segments]
+
+    @property
+    def start_t(self):
+        return self.segments[0]['start_t'] if self.segments else None
+
+    @property
+    def end_t(self):
+        return self.segments[-1]['end_t'] if self.segments else None
+
+    def segments_for(self, t0, t1):
+        """Index entries of the segments overlapping [t0, t1]."""
+        k = bisect.bisect_left(self._ends, t0)
+        out = []
+        while k < len(self.segments) and self.segments[k]['start_t'] <= t1:
+            out.append(self.segments[k])
+            k += 1
+        return out
+
+    def sketch(self, t0=None, t1=None):
+        """
+        RecordingSketches merged over the segments overlapping [t0, t1] (whole
+        session by default); segments are included whole, and those written
+        without samples are skipped.
+        """
+        segs = self.segments if t0 is None and t1 is None else self.segments_for(
+            float('-inf') if t0 is None else t0, float('inf') if t1 is None else t1)
+        return merge_sketches(s.get('sketch') for s in segs)
+
+    def _read_segment(self, seg):
+        with open(os.path.join(self.session_dir, seg['file'])) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def read_range(self, t0, t1):
+        """Packets with t0 <= t <= t1; only the covering segments are opened."""
+        out = []
+        for seg in self.segments_for(t0, t1):
+            packets = self._read_segment(seg)
+            if seg['start_t'] >= t0 and seg['end_t'] <= t1:
+                out.extend(packets)
+            else:
+                out.extend(p for p in packets if t0 <= p['t'] <= t1)
+        return out
+
+    def read_samples(self, start, stop):
+        """Packets with session-wide sample numbers in [start, stop)."""
+        k = max(0, bisect.bisect_right(self._offsets, start) - 1)
+        out = []
+        while k < len(self.segments) and self.segments[k]['first_sample'] < stop:
+            seg = self.segments[k]
+            first = seg['first_sample']
+            out.extend(self._read_segment(seg)[max(0, start - first):stop - first])
+            k += 1
+        return out
+
+    def iter_segments(self):
+        """Packets of each segment in turn, so only one segment is in memory."""
+        for seg in self.segments:
+            yield self._read_segment(seg)
+
+    def read_all(self):
+        out = []
+        for packets in self.iter_segments():
+            out.extend(packets)
+        return out
@@ -0,0 +1,203 @@
+# src/sequence.py
+import numpy as np
+
+SEQ_MODULUS = 1 << 32  # firmware sequence counters are uint32
+# a step back by more than this is a counter reset (device reboot), not a
+# late or repeated packet; the websocket runs over TCP, so steps back come
+# from firmware resends of the last few packets at most
+MAX_REORDER = 32
+
+class SequenceTracker:
+    """
+    Live packet-loss accounting from per-packet sequence numbers.
+    observe() is O(1) and returns the number of packets missing before this
+    one (0 when in order). Duplicates and late packets are counted, not lost;
+    a step back by more than max_reorder restarts the count (counter reset).
+    """
+    def __init__(self, modulus=SEQ_MODULUS, log_gaps_over=1, max_reorder=MAX_REORDER):
+        self.modulus = modulus
+        self.log_gaps_over = log_gaps_over
+        self.max_reorder = max_reorder
+        self.expected = None
+        self.received = 0
+        self.lost = 0
+        self.n_gaps = 0
+        self.max_gap = 0
+        self.out_of_order = 0
+        self.n_resets = 0
+
+    def observe(self, seq):
+        seq = int(seq) % self.modulus
+        self.received += 1
+        if self.expected is None:
+            self.expected = (seq + 1) % self.modulus
+            return 0
+        gap = (seq - self.expected) % self.modulus
+        if gap > self.modulus // 2:
+            if self.modulus - gap > self.max_reorder:
+                print(f"WARNING: sequence reset to {seq}")
+                self.n_resets += 1
+                self.expected = (seq + 1) % self.modulus
+                return 0
+            # behind the expected number: duplicate or reordered packet
+            self.out_of_order += 1
+            return 0
+        if gap:
+            self.lost += gap
+            self.n_gaps += 1
+            self.max_gap = max(self.max_gap, gap)
+            if gap > self.log_gaps_over:
+                print(f"WARNING: {gap} packets lost before seq {seq}")
+        self.expected = (seq + 1) % self.modulus
+        return gap
+
+    def stats(self):
+        total = self.received + self.lost
+        return {
+            'received': self.received,
+            'lost': self.lost,
+            'loss_frac': self.lost / total if total else 0.0,
+            'n_gaps': self.n_gaps,
+            'max_gap': self.max_gap,
+            'out_of_order': self.out_of_order,
+            'n_resets': self.n_resets,
+        }
+
+def unwrap_sequence(seqs, modulus=SEQ_MODULUS):
+    """Monotonic int64 sequence numbers from wrapping counters (vectorized)."""
+    s = np.asarray(seqs, dtype=np.int64) % modulus
+    if len(s) == 0:
+        return s
+    d = np.diff(s) % modulus
+    # steps of more than half the range are backwards (reordered) packets
+    d = np.where(d > modulus // 2, d - modulus, d)
+    return s[0] + np.concatenate(([0], np.cumsum(d)))
+
+def _runs(mask):
+    """(starts, ends) of True runs, ends exclusive."""
+    m = np.concatenate(([False], mask, [False])).astype(np.int8)
+    d = np.diff(m)
+    return np.flatnonzero(d == 1), np.flatnonzero(d == -1)
+
+def sequence_runs(seqs, modulus=SEQ_MODULUS, max_reorder=MAX_REORDER):
+    """
+    (starts, ends, sequenced) of the runs that can share one sequence grid,
+    in arrival order: a run ends where packets stop / start carrying a
+    sequence number (None / NaN) and at counter resets (a step back by more
+    than max_reorder).
+    """
+    s = _float_seqs(seqs)
+    has = np.isfinite(s)
+    si = np.where(has, s, 0).astype(np.int64)
+    d = (si[1:] - si[:-1]) % modulus
+    cut = np.zeros(len(s), dtype=bool)
+    cut[1:] = (has[1:] != has[:-1]) | (has[1:] & has[:-1] & (d > modulus // 2) & (modulus - d > max_reorder))
+    cut[:1] = True
+    starts = np.flatnonzero(cut)
+    ends = np.append(starts[1:], len(s))
+    return starts, ends, has[starts]
+
+def _float_seqs(seqs):
+    # (N,) float sequence numbers, NaN where a packet has none
+    if isinstance(seqs, np.ndarray):
+        return seqs.astype(float)
+    return np.array([np.nan if v is None else v for v in seqs], dtype=float)
+
+def _repair_run(values, seqs, max_gap, modulus):
+    N, C = values.shape
+    s = unwrap_sequence(seqs, modulus)
+    s0 = s.min()
+    idx = s - s0
+    M = int(idx.max()) + 1
+    grid = np.full((M, C), np.nan, dtype=values.dtype)
+    # first arrival wins for duplicated sequence numbers
+    _, first = np.unique(idx, return_index=True)
+    keep = np.zeros(N, dtype=bool)
+    keep[first] = True
+    grid[idx[keep]] = values[keep]
+    positions = np.where(keep, idx, -1)
+
+    missing = np.isnan(grid).any(axis=1)
+    starts, ends = _runs(missing)
+    lengths = ends - starts
+    # interior gaps short enough to repair (edges have nothing to interpolate from)
+    short = (lengths <= max_gap) & (starts > 0) & (ends < M)
+    fill = np.zeros(M + 1, dtype=np.int64)
+    np.add.at(fill, starts[short], 1)
+    np.add.at(fill, ends[short], -1)
+    fill = np.cumsum(fill[:M]) > 0
+
+    known = ~missing
+    rows = np.arange(M)
+    prev_known = np.maximum.accumulate(np.where(known, rows, 0))
+    next_known = np.minimum.accumulate(np.where(known, rows, M - 1)[::-1])[::-1]
+    f = np.flatnonzero(fill)
+    if len(f):
+        lo, hi = prev_known[f], next_known[f]
+        w = ((f - lo) / (hi - lo))[:, None]
+        grid[f] = grid[lo] * (1.0 - w) + grid[hi] * w
+
+    valid = known | fill
+    return grid, valid, positions, {
+        'n_missing': int(lengths.sum()),
+        'n_interpolated': int(fill.sum()),
+        'n_duplicates': int(N - keep.sum()),
+        'invalid_segments': np.column_stack([starts[~short], ends[~short]]),
+    }
+
+def repair_gaps(values, seqs, max_gap=5, modulus=SEQ_MODULUS, max_reorder=MAX_REORDER):
+    """
+    Place samples on their sequence-number grid and repair packet loss.
+    values: (N, C) samples in arrival order; seqs: (N,) sequence numbers,
+            None / NaN for packets without one
+    max_gap: gaps of up to this many missing samples are linearly
+             interpolated; longer gaps stay NaN and are marked invalid
+    Each run of sequence_runs gets its own grid (so a counter reset does not
+    fold the samples after it onto the ones before); runs of packets without
+    a sequence number are kept as received. The grids are concatenated in
+    arrival order.
+    Returns (grid, valid, info):
+      grid  - (M, C) samples; within a run, row i is sequence seq0 + i
+      valid - (M,) bool, False inside unrepaired gaps
+      info  - dict with 'positions' (grid row of each input sample, -1 for
+              duplicates), 'n_interpolated', 'invalid_segments' [[start, end)]
+              in grid rows, 'n_resets', 'n_unsequenced' and counts
+    Everything within a run is vectorized; there is no per-sample or per-gap
+    Python loop.
+    """
+    values = np.asarray(values)
+    if values.dtype != np.float32:
+        values = values.astype(float)
+    if values.ndim == 1:
+        values = values[:, None]
+    N, C = values.shape
+    info = {'positions': [], 'n_missing': 0, 'n_interpolated': 0, 'n_duplicates': 0,
+            'invalid_segments': [], 'n_resets': 0, 'n_unsequenced': 0}
+    if N == 0:
+        return values.copy(), np.zeros(0, dtype=bool), info
+
+    s = _float_seqs(seqs)
+    starts, ends, sequenced = sequence_runs(s, modulus, max_reorder)
+    grids, valids, positions, invalid = [], [], [], []
+    offset = 0
+    for a, b, seq in zip(starts, ends, sequenced):
+        if seq:
+            grid, valid, pos, run_info = _repair_run(values[a:b], s[a:b].astype(np.int64), max_gap, modulus)
+            for k in ('n_missing', 'n_interpolated', 'n_duplicates'):
+                info[k] += run_info[k]
+            invalid.append(run_info['invalid_segments'] + offset)
+            pos = np.where(pos >= 0, pos + offset, -1)
+        else:
+            grid = values[a:b].copy()
+            valid = np.isfinite(grid).all(axis=1)
+            pos = offset + np.arange(b - a)
+            info['n_unsequenced'] += int(b - a)
+        grids.append(grid)
+        valids.append(valid)
+        positions.append(pos)
+        offset += len(grid)
+    # a sequenced run right after another one starts at a counter reset
+    info['n_resets'] = int(np.count_nonzero(sequenced[1:] & sequenced[:-1]))
+    info['positions'] = np.concatenate(positions).tolist()
+    info['invalid_segments'] = np.concatenate(invalid).tolist() if invalid else []
+    return (grids[0] if len(grids) == 1 else np.concatenate(grids)), np.concatenate(valids), info
@@ -4,7 +4,16 @@
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-import json, os, subprocess, time, uuid, shutil, re
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
+import json, os, subprocess, sys, time, uuid, re, threading, asyncio
+from manifest import RecordingManifest, is_path_id
+from aggregates import Aggregates, TREND_METRICS
+from recording_index import RecordingIndex, parse_range_filters, recording_key
+import profiling
+import alerts
+from api_helpers import (load_store, store_version, project, parse_fields, paginate,
+                         make_etag, not_modified, json_response)
 
 # Project root is one level up from this file (backend/)
 DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data'))
@@ -15,6 +24,12 @@ RECORDING_DIR = os.path.join(DATA_DIR, 'recordings')
 os.makedirs(RECORDING_DIR, exist_ok=True)
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# background archival of old recordings (see archive.py); ARCHIVE_RECORDINGS=0 disables
+ARCHIVE_RECORDINGS = os.getenv("ARCHIVE_RECORDINGS", "1") == "1"
+ARCHIVE_MIN_AGE_S = float(os.getenv("ARCHIVE_MIN_AGE_S", str(24 * 3600)))
+ARCHIVE_INTERVAL_S = float(os.getenv("ARCHIVE_INTERVAL_S", "3600"))
+ARCHIVE_CODEC = os.getenv("ARCHIVE_CODEC", "lzma")
+
 app = FastAPI()
 
 app.add_middleware(
@@ -22,7 +37,9 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 def load_json(path):
     if not os.path.exists(path):
@@ -34,8 +51,21 @@ def load_json(path):
             return []
 
 def save_json(path, data):
-    with open(path, 'w') as f:
+    # atomic: a concurrent load_json never sees a half-written store
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
         json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+# held around every read-modify-write of recordings.json: routes run in
+# worker threads (and /analyze alongside them), archival in its own thread
+recordings_lock = threading.Lock()
+
+def append_recording(rec):
+    with recordings_lock:
+        recs = load_json(RECORDING_FILE)
+        recs.append(rec)
+        save_json(RECORDING_FILE, recs)
 
 def slugify(name: str):
     # simple slugify - lower, replace spaces with _, remove non-alnum/_/-
@@ -44,50 +74,156 @@ def slugify(name: str):
     s = re.sub(r'[^a-z0-9_\-]', '', s)
     return s[:60]  # keep reasonably short
 
-def find_latest_raw_and_csv():
-    # find latest raw_*.jsonl in RECORDING_DIR by mtime
-    raw_files = [f for f in os.listdir(RECORDING_DIR) if f.startswith("raw_") and f.endswith(".jsonl")]
-    raw_files = sorted(raw_files, key=lambda fn: os.path.getmtime(os.path.join(RECORDING_DIR, fn))) if raw_files else []
-    latest_raw = raw_files[-1] if raw_files else None
-
-    # CSV may be written as 'joint_angles.csv' or a time-based name; pick newest .csv
-    csv_files = [f for f in os.listdir(RECORDING_DIR) if f.endswith(".csv")]
-    csv_files = sorted(csv_files, key=lambda fn: os.path.getmtime(os.path.join(RECORDING_DIR, fn))) if csv_files else []
-    latest_csv = csv_files[-1] if csv_files else None
-
-    return latest_raw, latest_csv
+manifest = RecordingManifest(RECORDING_DIR)
+# cohort statistics and per-patient trends, updated as patients/recordings change
+aggregates = Aggregates(DATA_DIR)
+# key metrics of every recording for GET /recordings range queries
+recording_index = RecordingIndex(DATA_DIR)
+# sessions being recorded by /analyze right now: recording id -> patient id
+live_sessions = {}
+# how often alert streams check the session's alert log (adds at most this to the alert latency)
+ALERT_POLL_S = float(os.getenv("ALERT_POLL_S", "0.02"))
+# /analyze sessions: measurement length (main.py --duration), the longest
+# accepted, and from how long on raw packets are written as rolling
+# segments (main.py --segment-s) unless the request sets segmentS
+SESSION_DURATION_S = 30.0
+MAX_SESSION_DURATION_S = float(os.getenv("MAX_SESSION_DURATION_S", str(4 * 3600)))
+AUTO_SEGMENT_OVER_S = 300.0
+AUTO_SEGMENT_S = 60.0
+# main.py timeout: calibration, start-up and analysis on top of the measurement,
+# plus analysis time that grows with the session
+SESSION_TIMEOUT_BASE_S = 150.0
+SESSION_TIMEOUT_PER_S = 1.25
+
+def session_timeout_s(duration_s):
+    return SESSION_TIMEOUT_BASE_S + SESSION_TIMEOUT_PER_S * duration_s
+
+def _positive_seconds(body, key, default, maximum=None):
+    value = body.get(key, default)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value < float("inf"):
+        raise HTTPException(status_code=400, detail=f"{key} must be a positive number of seconds")
+    if maximum is not None and value > maximum:
+        raise HTTPException(status_code=400, detail=f"{key} must be at most {maximum:g}")
+    return float(value)
+
+def _rename_archived(renamed):
+    # point recording metadata at the archived files
+    if not renamed:
+        return
+    manifest.rename(renamed)
+    with recordings_lock:
+        recs = load_json(RECORDING_FILE)
+        for r in recs:
+            for key in ("raw_file", "angles_file"):
+                if r.get(key) in renamed:
+                    r[key] = renamed[r[key]]
+        save_json(RECORDING_FILE, recs)
+
+def compact_recordings_loop():
+    from archive import compact_recordings
+    # files that could not be archived, so they are not re-parsed every interval
+    skipped = set()
+    while True:
+        try:
+            # metadata is repointed per file, before compact_recordings deletes the original
+            done = compact_recordings(RECORDING_DIR, min_age_s=ARCHIVE_MIN_AGE_S, codec=ARCHIVE_CODEC,
+                                      on_archived=lambda old, new: _rename_archived({old: new}),
+                                      skipped=skipped)
+            if done:
+                print(f"Archived {len(done)} recording files")
+        except Exception as e:
+            print("Archival failed:", e)
+        time.sleep(ARCHIVE_INTERVAL_S)
+
+@app.on_event("startup")
+def build_aggregates():
+    # one full pass only when there is no saved state yet
+    if not aggregates.ready:
+        aggregates.rebuild(load_json(PATIENT_FILE), load_json(RECORDING_FILE))
+    if not recording_index.ready:
+        recording_index.rebuild(load_json(RECORDING_FILE))
+
+@app.on_event("startup")
+def start_archiver():
+    if ARCHIVE_RECORDINGS:
+        threading.Thread(target=compact_recordings_loop, daemon=True).start()
+
+def _recordings_by_patient(recs):
+    out = {}
+    for r in sorted(recs, key=recording_key):
+        out.setdefault(r.get("patient_id"), []).append(r)
+    return out
+
+# Read routes: ?limit=&cursor= paginate (next page cursor in the X-Next-Cursor
+# header; without limit the whole list is returned as before; recordings page
+# oldest first, patients by id), ?fields=a,b.c
+# projects, and the ETag (derived from the store versions and the query,
+# checked before anything is loaded) turns repeat requests into 304s.
 
 # ---------- PATIENT ROUTES ----------
 @app.get("/patients")
-def get_patients():
-    return load_json(PATIENT_FILE)
+def get_patients(request: Request, limit: int = None, cursor: str = None, fields: str = None):
+    etag = make_etag(store_version(PATIENT_FILE), str(request.query_params))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    store = load_store(PATIENT_FILE, load_json)
+    if limit is None and cursor is None:
+        page, next_cursor = store.data, None
+    else:
+        # pages follow patient id order, the only stable key patients have
+        rows, keys = store.sorted_by("id", lambda p: p["id"])
+        page, next_cursor = paginate(rows, keys, limit, cursor)
+    return json_response(project(page, parse_fields(fields)), etag, next_cursor)
 
 @app.get("/patients/{pid}")
-def get_patient(pid: str):
-    patients = load_json(PATIENT_FILE)
-    patient = next((p for p in patients if p["id"] == pid), None)
+def get_patient(pid: str, request: Request, fields: str = None):
+    etag = make_etag(pid, store_version(PATIENT_FILE), store_version(RECORDING_FILE), str(request.query_params))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    patient = load_store(PATIENT_FILE, load_json).by_id().get(pid)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    recs = [r for r in load_json(RECORDING_FILE) if r["patient_id"] == pid]
-    patient["recordings"] = recs
-    return patient
+    recs = load_store(RECORDING_FILE, load_json).index("patient", _recordings_by_patient).get(pid, [])
+    patient = dict(patient, recordings=recs)
+    return json_response(project(patient, parse_fields(fields)), etag)
+
+@app.get("/patients/{pid}/recordings")
+def get_patient_recordings(pid: str, request: Request, limit: int = None, cursor: str = None, fields: str = None):
+    etag = make_etag(pid, store_version(RECORDING_FILE), str(request.query_params))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    recs = load_store(RECORDING_FILE, load_json).index("patient", _recordings_by_patient).get(pid, [])
+    page, next_cursor = paginate(recs, [recording_key(r) for r in recs], limit, cursor)
+    return json_response(project(page, parse_fields(fields)), etag, next_cursor)
 
 @app.post("/patients")
 def create_patient(payload: dict):
-    patients = load_json(PATIENT_FILE)
     new_patient = {"id": str(uuid.uuid4()), **payload}
+    # the ID names the patient's shard and trend files
+    if not is_path_id(new_patient["id"]):
+        raise HTTPException(status_code=400, detail="Invalid patient id: use letters, digits, '_', '-' and '.'")
+    patients = load_json(PATIENT_FILE)
     patients.append(new_patient)
     save_json(PATIENT_FILE, patients)
+    aggregates.patient_added(new_patient)
     return new_patient
 
 @app.put("/patients/{pid}")
 def update_patient(pid: str, payload: dict):
+    if payload.get("id", pid) != pid:
+        raise HTTPException(status_code=400, detail="Patient id cannot be changed")
     patients = load_json(PATIENT_FILE)
     for p in patients:
         if p["id"] == pid:
             p.update(payload)
             save_json(PATIENT_FILE, patients)
+            aggregates.patient_updated(p)
             return p
     raise HTTPException(status_code=404, detail="Patient not found")
 
@@ -95,18 +231,181 @@ def update_patient(pid: str, payload: dict):
 def delete_patient(pid: str):
     patients = [p for p in load_json(PATIENT_FILE) if p["id"] != pid]
     save_json(PATIENT_FILE, patients)
+    aggregates.patient_removed(pid)
     return {"ok": True}
 
+@app.get("/patients/{pid}/trends")
+@profiling.profiled("trends", tag_arg="pid")
+def get_patient_trends(pid: str, metrics: str = None):
+    """Per-recording metric values over time, e.g. ?metrics=cadence_spm,knee_rom_deg"""
+    names = tuple(m for m in metrics.split(",") if m) if metrics else TREND_METRICS
+    unknown = [m for m in names if m not in TREND_METRICS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown metrics: {unknown}")
+    return {"patient_id": pid, "metrics": list(names), "points": aggregates.trends(pid, names)}
+
+@app.get("/patients/{pid}/distribution")
+def get_patient_distribution(pid: str):
+    """Knee angle / gyro norm quantiles and histograms over all of a patient's recordings."""
+    return dict(aggregates.patient_distribution(pid), patient_id=pid)
+
+# ---------- STATS ----------
+@app.get("/stats/cohort")
+def get_cohort_stats():
+    return aggregates.cohort()
+
+@app.get("/stats/distribution")
+def get_cohort_distribution(status: str = None, age_bucket: str = None):
+    """Same distributions merged over a cohort, e.g. ?status=active&age_bucket=>50"""
+    return aggregates.cohort_distribution(status, age_bucket)
+
+# ---------- ALERTS ----------
+async def _follow_alerts(rid):
+    # alert log lines as server-sent events until the session has ended and the log is drained
+    path = alerts.log_path(rid)
+    pos, tail = 0, ""
+    while True:
+        live = rid in live_sessions
+        if os.path.exists(path):
+            with open(path) as f:
+                f.seek(pos)
+                tail += f.read()
+                pos = f.tell()
+            *lines, tail = tail.split("\n")
+            for line in lines:
+                if line.strip():
+                    yield f"event: alert\ndata: {line}\n\n"
+        if not live:
+            break
+        await asyncio.sleep(ALERT_POLL_S)
+    yield f"event: end\ndata: {json.dumps({'recording_id': rid})}\n\n"
+
+@app.get("/patients/{pid}/alerts/stream")
+async def stream_patient_alerts(pid: str, wait_s: float = 30.0):
+    """
+    Live alerts of the patient's running session as server-sent events:
+    'alert' events carry the alert JSON, 'end' closes the stream. Waits up
+    to wait_s for a session to start, so it can be opened alongside POST /analyze.
+    """
+    deadline = time.time() + wait_s
+    while True:
+        rid = next((r for r, p in reversed(list(live_sessions.items())) if p == pid), None)
+        if rid is not None:
+            break
+        if time.time() >= deadline:
+            raise HTTPException(status_code=404, detail="No live session for this patient")
+        await asyncio.sleep(ALERT_POLL_S)
+    return StreamingResponse(_follow_alerts(rid), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Recording-Id": rid})
+
+@app.get("/recordings/{rid}/alerts")
+def get_recording_alerts(rid: str):
+    """Alerts raised during a recording, in order."""
+    if not is_path_id(rid):
+        raise HTTPException(status_code=404, detail="Recording not found")
+    return {"recording_id": rid, "live": rid in live_sessions, "alerts": alerts.read_alerts(alerts.log_path(rid))}
+
+@app.get("/alerts/rules")
+def get_default_alert_rules():
+    """Built-in rules (used when POST /analyze sends no alertRules) and the rule vocabulary."""
+    return {"rules": alerts.DEFAULT_RULES, "signals": list(alerts.SIGNALS), "aggregates": list(alerts.AGGREGATES),
+            "ops": list(alerts.OPS), "severities": list(alerts.SEVERITIES)}
+
+# ---------- ADMIN ----------
+@app.get("/admin/profiling")
+def get_profiling():
+    """Current profiling settings and the newest profile files."""
+    return dict(profiling.settings(), files=profiling.list_profiles())
+
+@app.post("/admin/profiling")
+def set_profiling(payload: dict):
+    """
+    {"modes": "cpu" | "mem" | "cpu,mem" | "" (off), "sample": 0.1}. Applies
+    to the profiled routes and to the main.py runs started by /analyze.
+    """
+    try:
+        profiling.configure(modes=payload.get("modes"), sample=payload.get("sample"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return profiling.settings()
+
+@app.get("/admin/profiling/{name}")
+def download_profile(name: str):
+    path = profiling.profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=name)
+
 # ---------- RECORDINGS ----------
+SEARCH_PARAMS = ("patient_id", "date_from", "date_to", "limit", "cursor", "fields")
+
+@app.get("/recordings")
+@profiling.profiled("search_recordings", tag_arg="patient_id")
+def search_recordings(request: Request, patient_id: str = None, date_from: str = None, date_to: str = None,
+                      limit: int = None, cursor: str = None, fields: str = None):
+    """
+    Recordings by metric ranges, e.g.
+    ?cadence_spm_lt=90&peak_knee_angle_deg_lt=50&patient_id=..&date_from=2024-01-01
+    Filters are <metric>_lt / _lte / _gt / _gte over TREND_METRICS; dates are
+    inclusive YYYY-MM-DD. Answered from the recording index (id, patient_id,
+    date, timestamp, label and the indexed metrics), oldest first; the full
+    recording is at /recordings/{rid}.
+    """
+    etag = make_etag(store_version(recording_index.path), str(request.query_params))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    try:
+        ranges = parse_range_filters(request.query_params, reserved=SEARCH_PARAMS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rows = recording_index.query(ranges, patient_id=patient_id, date_from=date_from, date_to=date_to)
+    page, next_cursor = paginate(rows, [recording_key(r) for r in rows], limit, cursor)
+    return json_response(project(page, parse_fields(fields)), etag, next_cursor)
+
 @app.get("/recordings/{rid}")
-def get_recording(rid: str):
+def get_recording(rid: str, request: Request, fields: str = None):
+    etag = make_etag(rid, store_version(RECORDING_FILE), str(request.query_params))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    rec = load_store(RECORDING_FILE, load_json).by_id().get(rid)
+    if not rec:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    return json_response(project(rec, parse_fields(fields)), etag)
+
+@app.get("/recordings/{rid}/samples")
+@profiling.profiled("recording_samples", tag_arg="rid")
+def get_recording_samples(rid: str, t0: float = 0.0, t1: float = float("inf")):
+    """Raw packets of a recording with t0 <= t <= t1 (s from the recording start)."""
     recs = load_json(RECORDING_FILE)
     rec = next((r for r in recs if r["id"] == rid), None)
-    if not rec:
+    if not rec or not rec.get("raw_file"):
         raise HTTPException(status_code=404, detail="Recording not found")
-    return rec
+    path = os.path.join(RECORDING_DIR, rec["raw_file"])
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Raw file not found")
+    from archive import ArchiveReader, ARCHIVE_EXT, rows_to_packets
+    if path.endswith(ARCHIVE_EXT):
+        # only the chunks covering [t0, t1] are decompressed
+        reader = ArchiveReader(path)
+        offset = reader.chunks[0]['t0'] if reader.index['time_column'] and reader.chunks else 0.0
+        return rows_to_packets(reader.read_time_range(offset + t0, offset + t1))
+    if os.path.isdir(path):
+        # segmented session ({rid}_raw/): only the segments covering [t0, t1] are read
+        from segments import SegmentReader
+        reader = SegmentReader(path)
+        if reader.start_t is None:
+            return []
+        return reader.read_range(reader.start_t + t0, reader.start_t + t1)
+    with open(path) as f:
+        packets = [json.loads(line) for line in f if line.strip()]
+    rate = 10.0
+    start = packets[0].get("t", 0.0) if packets else 0.0
+    return [p for i, p in enumerate(packets) if t0 <= p.get("t", start + i / rate) - start <= t1]
 
 @app.post("/analyze")
+@profiling.profiled("analyze")
 async def analyze_patient(request: Request):
     body = await request.json()
     pid = body.get("patientId") or body.get("patient_id")
@@ -114,6 +413,17 @@ async def analyze_patient(request: Request):
     mock = bool(body.get("mock", False))
     if not pid:
         raise HTTPException(status_code=400, detail="Missing patientId in request body")
+    if not is_path_id(pid):
+        raise HTTPException(status_code=404, detail="Patient not found")
+    # live alert rules for this session (alerts.py); default: alerts.DEFAULT_RULES
+    alert_rules = body.get("alertRules")
+    if alert_rules is not None:
+        try:
+            alerts.parse_rules(alert_rules)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid alertRules: {e}")
+    duration_s = _positive_seconds(body, "durationS", SESSION_DURATION_S, MAX_SESSION_DURATION_S)
+    segment_s = _positive_seconds(body, "segmentS", AUTO_SEGMENT_S if duration_s > AUTO_SEGMENT_OVER_S else None)
 
     patients = load_json(PATIENT_FILE)
     patient = next((p for p in patients if p["id"] == pid), None)
@@ -121,7 +431,6 @@ async def analyze_patient(request: Request):
         raise HTTPException(status_code=404, detail="Patient not found")
 
     patient_name = patient.get("name", "patient")
-    slug = slugify(patient_name)
     project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
     print(f"Starting analysis for patient {pid} (name={patient_name}) in {project_root} ...")
 
@@ -129,41 +438,62 @@ async def analyze_patient(request: Request):
     if mock:
         ts = int(time.time())
         date_str = time.strftime("%Y-%m-%d")
-        raw_name = f"{slug}_{date_str}_{ts}_raw.jsonl"
-        angles_name = f"{slug}_{date_str}_{ts}_angles.csv"
+        rec_id = f"r{ts}_{uuid.uuid4().hex[:6]}"
+        rec_dir = manifest.shard_dir(pid)
+        raw_path = os.path.join(rec_dir, f"{rec_id}_raw.jsonl")
+        angles_path = os.path.join(rec_dir, f"{rec_id}_angles.csv")
         # create small fake files
-        with open(os.path.join(RECORDING_DIR, raw_name), "w") as f:
+        with open(raw_path, "w") as f:
             f.write(json.dumps({"fake": True, "ts": ts}) + "\n")
-        with open(os.path.join(RECORDING_DIR, angles_name), "w") as f:
+        with open(angles_path, "w") as f:
             f.write("time_s,angle_deg\n0.0,10\n0.1,11\n")
-        rec_id = f"r{ts}_{uuid.uuid4().hex[:6]}"
+        files = manifest.add(rec_id, pid, {"raw": raw_path, "angles": angles_path})["files"]
         rec = {
             "id": rec_id,
             "patient_id": pid,
             "date": date_str,
             "timestamp": ts,
             "label": custom_label or f"{patient_name} {date_str}",
-            "raw_file": raw_name,
-            "angles_file": angles_name,
+            "raw_file": files["raw"]["path"],
+            "angles_file": files["angles"]["path"],
             "metrics": {"mock": True}
         }
-        recs = load_json(RECORDING_FILE); recs.append(rec); save_json(RECORDING_FILE, recs)
+        append_recording(rec)
+        aggregates.recording_added(rec)
+        recording_index.recording_added(rec)
         return {"status": "completed", "recording": rec}
 
     # Real run: set AUTO_START so main.py won't wait for input
     env = os.environ.copy()
     env["AUTO_START"] = "1"
-    # optionally pass patient info or duration via env if main.py supports it
-    # env["PATIENT_ID"] = pid
-
+    # main.py writes into the patient's shard and registers the outputs under
+    # this ID in the manifest, so overlapping analyses cannot swap files
+    rec_id = f"r{int(time.time())}_{uuid.uuid4().hex[:6]}"
+    env["RECORDING_ID"] = rec_id
+    env["PATIENT_ID"] = pid
+    # the session is profiled (tagged with rec_id) when server profiling is on
+    env.update(profiling.child_env())
+    # live alerts go to data/alerts/<rec_id>.jsonl, streamed by /patients/{pid}/alerts/stream
+    env["ALERT_LOG"] = alerts.log_path(rec_id)
+    if alert_rules is not None:
+        os.makedirs(alerts.DEFAULT_DIR, exist_ok=True)
+        rules_path = os.path.join(alerts.DEFAULT_DIR, f"{rec_id}_rules.json")
+        with open(rules_path, "w") as f:
+            json.dump(alert_rules, f)
+        env["ALERT_RULES"] = rules_path
+
+    live_sessions[rec_id] = pid
     try:
-        result = subprocess.run(
-            ["python", "src/main.py"],
+        # in a worker thread: the event loop keeps serving (alert streams) during the session
+        result = await asyncio.to_thread(
+            subprocess.run,
+            [sys.executable, "src/main.py", "--duration", f"{duration_s:g}"]
+            + (["--segment-s", f"{segment_s:g}"] if segment_s else []),
             cwd=project_root,
             capture_output=True,
             text=True,
             env=env,
-            timeout=180  # give it more time in case initial processing takes a bit
+            timeout=session_timeout_s(duration_s)
         )
         if result.returncode != 0:
             # include stdout/stderr in error for debugging (dev only)
@@ -183,30 +513,19 @@ async def analyze_patient(request: Request):
         err = str(e)
         print("Analysis exception:", err)
         raise HTTPException(status_code=500, detail=f"Analysis failed: {err}")
+    finally:
+        live_sessions.pop(rec_id, None)
 
-    # find output files (same logic as before)
-    latest_raw, latest_csv = find_latest_raw_and_csv()
-    if latest_raw is None and latest_csv is None:
+    # output files of this job, by ID (no directory scan)
+    entry = manifest.get(rec_id)
+    if entry is None or not entry["files"]:
         raise HTTPException(status_code=500, detail="No output files produced by analysis")
+    files = entry["files"]
 
-    ts = int(time.time()); date_str = time.strftime("%Y-%m-%d"); safe_ts = str(ts)
-    new_raw_name = None; new_csv_name = None
-
-    if latest_raw:
-        src_raw = os.path.join(RECORDING_DIR, latest_raw)
-        new_raw_name = f"{slug}_{date_str}_{safe_ts}_raw.jsonl"
-        shutil.copy(src_raw, os.path.join(RECORDING_DIR, new_raw_name))
-
-    if latest_csv:
-        src_csv = os.path.join(RECORDING_DIR, latest_csv)
-        new_csv_name = f"{slug}_{date_str}_{safe_ts}_angles.csv"
-        try:
-            shutil.copy(src_csv, os.path.join(RECORDING_DIR, new_csv_name))
-        except Exception as e:
-            print("Failed to copy csv:", e)
-            new_csv_name = None
+    ts = int(time.time()); date_str = time.strftime("%Y-%m-%d")
+    new_raw_name = files["raw"]["path"] if "raw" in files else None
+    new_csv_name = files["angles"]["path"] if "angles" in files else None
 
-    rec_id = f"r{int(time.time())}_{uuid.uuid4().hex[:6]}"
     rec_label = custom_label or f"{patient_name} {date_str}"
     new_rec = {
         "id": rec_id,
@@ -224,14 +543,15 @@ async def analyze_patient(request: Request):
         out_lines = [ln.strip() for ln in result.stdout.splitlines() if ln.strip()]
         if out_lines:
             last = out_lines[-1]
-            parsed = json.loads(last)
+            # NaN / Infinity would make the stored recording unserializable
+            parsed = json.loads(last, parse_constant=lambda c: None)
             if isinstance(parsed, dict):
                 new_rec["metrics"] = parsed
     except Exception:
         pass
 
-    recs = load_json(RECORDING_FILE)
-    recs.append(new_rec)
-    save_json(RECORDING_FILE, recs)
+    append_recording(new_rec)
+    aggregates.recording_added(new_rec)
+    recording_index.recording_added(new_rec)
 
     return {"status": "completed", "recording": new_rec}
@@ -0,0 +1,131 @@
+# src/shm_ring.py
+import numpy as np
+from multiprocessing import shared_memory
+from packets import ROW_WIDTH
+
+# header: int64 slots [write_seq, closed]; padded to one cache line
+_HEADER_BYTES = 64
+_WRITE_SEQ = 0
+_CLOSED = 1
+
+class SharedRingBuffer:
+    """
+    Single-writer, multi-reader ring of fixed-width float64 rows in
+    multiprocessing shared memory.
+    The writer stores row n in slot n % capacity and then publishes n + 1 as
+    write_seq. Readers keep their own sequence number (see RingReader) and
+    get numpy views straight into the shared block, so nothing is copied or
+    pickled between processes.
+    """
+    def __init__(self, shm, capacity, width, owner=False):
+        self.shm = shm
+        self.capacity = capacity
+        self.width = width
+        self.owner = owner
+        self._header = np.ndarray((2,), dtype=np.int64, buffer=shm.buf, offset=0)
+        self.data = np.ndarray((capacity, width), dtype=np.float64, buffer=shm.buf, offset=_HEADER_BYTES)
+
+    @classmethod
+    def create(cls, capacity=1 << 16, width=ROW_WIDTH, name=None):
+        size = _HEADER_BYTES + capacity * width * 8
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        ring = cls(shm, capacity, width, owner=True)
+        ring._header[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name, capacity, width=ROW_WIDTH):
+        return cls(shared_memory.SharedMemory(name=name), capacity, width)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def write_seq(self):
+        return int(self._header[_WRITE_SEQ])
+
+    @property
+    def closed(self):
+        return bool(self._header[_CLOSED])
+
+    def write(self, row):
+        """Append one row (sequence of `width` values)."""
+        seq = int(self._header[_WRITE_SEQ])
+        self.data[seq % self.capacity] = row
+        # publish only after the row is complete
+        self._header[_WRITE_SEQ] = seq + 1
+        return seq
+
+    def slot(self):
+        """
+        Zero-copy write: return (seq, row view) of the next slot. Fill the
+        view, then call commit(). Avoids building a temporary row.
+        """
+        seq = int(self._header[_WRITE_SEQ])
+        return seq, self.data[seq % self.capacity]
+
+    def commit(self):
+        self._header[_WRITE_SEQ] += 1
+
+    def close_writer(self):
+        """Mark the stream finished; readers drain and stop."""
+        self._header[_CLOSED] = 1
+
+    def views(self, start, end):
+        """Views of rows [start, end) as at most two contiguous blocks."""
+        s = start % self.capacity
+        n = end - start
+        if s + n <= self.capacity:
+            return [self.data[s:s + n]]
+        first = self.capacity - s
+        return [self.data[s:], self.data[:n - first]]
+
+    def release(self):
+        # drop our views before closing the mapping
+        self._header = None
+        self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+class RingReader:
+    """
+    Independent cursor over a SharedRingBuffer.
+    poll() returns views of all rows published since the last call. If the
+    writer lapped this reader (more than `capacity` rows behind), the
+    overwritten rows are skipped and counted in `lost`.
+    The returned views are only valid until the writer wraps around to
+    them again; consume (or copy) them before the next poll.
+    """
+    def __init__(self, ring, start_seq=0, max_rows=None):
+        self.ring = ring
+        self.seq = start_seq
+        self.max_rows = max_rows or ring.capacity
+        self.lost = 0
+        self._last_start = start_seq
+
+    def poll(self):
+        end = self.ring.write_seq
+        oldest = end - self.ring.capacity
+        if self.seq < oldest:
+            self.lost += oldest - self.seq
+            self.seq = oldest
+        end = min(end, self.seq + self.max_rows)
+        if end <= self.seq:
+            return []
+        blocks = self.ring.views(self.seq, end)
+        self._last_start = self.seq
+        self.seq = end
+        return blocks
+
+    def overwritten(self):
+        """
+        Rows of the last poll() that the writer may have overwritten while
+        they were being consumed (0 if the reader kept up).
+        """
+        oldest = self.ring.write_seq - self.ring.capacity
+        return max(0, min(oldest, self.seq) - self._last_start)
+
+    def finished(self):
+        return self.ring.closed and self.seq >= self.ring.write_seq
@@ -0,0 +1,267 @@
+# src/sketches.py
+# Mergeable, bounded-memory distribution summaries of the knee angle,
+# accel-vector angle and gyro norm, so session / patient / cohort
+# distributions never need the samples. Both sketch types update in O(1) per sample (or vectorized per
+# batch), merge by adding counts and, for moving a patient between cohort
+# groups, subtract exactly.
+#   QuantileSketch - log-spaced buckets (DDSketch): every quantile is within
+#                    `alpha` relative error of a true sample value; values are
+#                    clipped to [MIN_VALUE, MAX_VALUE] in magnitude, which
+#                    bounds the bucket count
+#   Histogram      - fixed bins over [lo, hi) plus under/overflow counts
+import math
+import numpy as np
+
+MIN_VALUE = 1e-3   # |x| below this counts as zero
+MAX_VALUE = 1e5
+
+# per signal: histogram (lo, hi, n_bins)
+#   knee_angle_deg  - the recording's knee angles (calibrated estimator, or
+#                     the accel fallback without calibration); analysis only
+#   accel_angle_deg - processors.process_packet_accel_angle, which every
+#                     capture path has per packet (segment sketches)
+#   gyro_norm_dps   - IMU2 gyro norm
+SIGNALS = {
+    'knee_angle_deg': (-45.0, 180.0, 45),
+    'accel_angle_deg': (0.0, 180.0, 36),
+    'gyro_norm_dps': (0.0, 1000.0, 50),
+}
+QUANTILES = {'p5': 0.05, 'median': 0.5, 'p95': 0.95}
+
+class QuantileSketch:
+    def __init__(self, alpha=0.01):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.pos = {}
+        self.neg = {}
+        self.zero = 0
+        self.count = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+
+    def _key(self, mag):
+        return math.ceil(math.log(min(mag, MAX_VALUE)) / self._log_gamma)
+
+    def _value(self, key):
+        return 2.0 * self.gamma ** key / (self.gamma + 1)
+
+    def update(self, x):
+        if x is None or not math.isfinite(x):
+            return
+        self.count += 1
+        self.sum += x
+        self.sumsq += x * x
+        if x > MIN_VALUE:
+            k = self._key(x)
+            self.pos[k] = self.pos.get(k, 0) + 1
+        elif x < -MIN_VALUE:
+            k = self._key(-x)
+            self.neg[k] = self.neg.get(k, 0) + 1
+        else:
+            self.zero += 1
+
+    def update_batch(self, xs):
+        x = np.asarray(xs, dtype=float)
+        x = x[np.isfinite(x)]
+        self.count += len(x)
+        self.sum += float(x.sum())
+        self.sumsq += float(np.dot(x, x))
+        for store, mag in ((self.pos, x[x > MIN_VALUE]), (self.neg, -x[x < -MIN_VALUE])):
+            keys = np.ceil(np.log(np.minimum(mag, MAX_VALUE)) / self._log_gamma).astype(np.int64)
+            for k, c in zip(*np.unique(keys, return_counts=True)):
+                store[int(k)] = store.get(int(k), 0) + int(c)
+        self.zero += int(np.sum(np.abs(x) <= MIN_VALUE))
+
+    def _combine(self, other, sign):
+        if other.alpha != self.alpha:
+            raise ValueError("Cannot combine sketches with different accuracy")
+        for store, o in ((self.pos, other.pos), (self.neg, other.neg)):
+            for k, c in o.items():
+                n = store.get(k, 0) + sign * c
+                if n:
+                    store[k] = n
+                else:
+                    store.pop(k, None)
+        self.zero += sign * other.zero
+        self.count += sign * other.count
+        self.sum += sign * other.sum
+        self.sumsq += sign * other.sumsq
+
+    def merge(self, other):
+        self._combine(other, 1)
+        return self
+
+    def subtract(self, other):
+        """Remove a sketch that was merged in earlier."""
+        self._combine(other, -1)
+        return self
+
+    def quantile(self, q):
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for k in sorted(self.neg, reverse=True):
+            seen += self.neg[k]
+            if seen > rank:
+                return -self._value(k)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for k in sorted(self.pos):
+            seen += self.pos[k]
+            if seen > rank:
+                return self._value(k)
+        return self._value(max(self.pos)) if self.pos else 0.0
+
+    def mean(self):
+        return self.sum / self.count if self.count > 0 else None
+
+    def std(self):
+        if self.count <= 0:
+            return None
+        m = self.sum / self.count
+        return math.sqrt(max(0.0, self.sumsq / self.count - m * m))
+
+    @staticmethod
+    def _dense(store):
+        # {key: count} -> [first key, [counts...]]: compact in JSON
+        if not store:
+            return [0, []]
+        lo, hi = min(store), max(store)
+        return [lo, [store.get(k, 0) for k in range(lo, hi + 1)]]
+
+    @staticmethod
+    def _sparse(dense):
+        lo, counts = dense
+        return {lo + i: c for i, c in enumerate(counts) if c}
+
+    def to_dict(self):
+        return {'alpha': self.alpha, 'count': self.count, 'sum': self.sum, 'sumsq': self.sumsq,
+                'zero': self.zero, 'pos': self._dense(self.pos), 'neg': self._dense(self.neg)}
+
+    @classmethod
+    def from_dict(cls, d):
+        s = cls(d['alpha'])
+        s.count, s.sum, s.sumsq, s.zero = d['count'], d['sum'], d['sumsq'], d['zero']
+        s.pos, s.neg = cls._sparse(d['pos']), cls._sparse(d['neg'])
+        return s
+
+class Histogram:
+    def __init__(self, lo, hi, n_bins):
+        self.lo, self.hi, self.n_bins = float(lo), float(hi), int(n_bins)
+        self._scale = self.n_bins / (self.hi - self.lo)
+        # [underflow, bins..., overflow]
+        self.counts = [0] * (self.n_bins + 2)
+
+    def update(self, x):
+        if x is None or not math.isfinite(x):
+            return
+        i = int(math.floor((x - self.lo) * self._scale)) + 1
+        self.counts[min(max(i, 0), self.n_bins + 1)] += 1
+
+    def update_batch(self, xs):
+        x = np.asarray(xs, dtype=float)
+        x = x[np.isfinite(x)]
+        idx = np.clip(np.floor((x - self.lo) * self._scale).astype(np.int64) + 1, 0, self.n_bins + 1)
+        for i, c in enumerate(np.bincount(idx, minlength=self.n_bins + 2).tolist()):
+            self.counts[i] += c
+
+    def _combine(self, other, sign):
+        if (other.lo, other.hi, other.n_bins) != (self.lo, self.hi, self.n_bins):
+            raise ValueError("Cannot combine histograms with different bins")
+        self.counts = [a + sign * b for a, b in zip(self.counts, other.counts)]
+
+    def merge(self, other):
+        self._combine(other, 1)
+        return self
+
+    def subtract(self, other):
+        self._combine(other, -1)
+        return self
+
+    def edges(self):
+        return [self.lo + i / self._scale for i in range(self.n_bins + 1)]
+
+    def to_dict(self):
+        return {'lo': self.lo, 'hi': self.hi, 'counts': list(self.counts)}
+
+    @classmethod
+    def from_dict(cls, d):
+        h = cls(d['lo'], d['hi'], len(d['counts']) - 2)
+        h.counts = list(d['counts'])
+        return h
+
+class RecordingSketches:
+    """
+    Quantile sketch and histogram per signal in SIGNALS, for one segment,
+    recording or any merged set of them. Stored as to_dict() in the
+    recording metrics ('sketches'), segment indexes and cohort groups.
+    """
+    def __init__(self, alpha=0.01):
+        self.signals = {name: (QuantileSketch(alpha), Histogram(*bins)) for name, bins in SIGNALS.items()}
+
+    def update(self, knee_angle_deg=None, gyro_norm_dps=None, accel_angle_deg=None):
+        """One sample; None / NaN values are skipped."""
+        for name, x in (('knee_angle_deg', knee_angle_deg), ('gyro_norm_dps', gyro_norm_dps),
+                        ('accel_angle_deg', accel_angle_deg)):
+            q, h = self.signals[name]
+            q.update(x)
+            h.update(x)
+
+    def update_batch(self, knee_angle_deg=None, gyro_norm_dps=None, accel_angle_deg=None):
+        for name, xs in (('knee_angle_deg', knee_angle_deg), ('gyro_norm_dps', gyro_norm_dps),
+                         ('accel_angle_deg', accel_angle_deg)):
+            if xs is not None:
+                q, h = self.signals[name]
+                q.update_batch(xs)
+                h.update_batch(xs)
+
+    def merge(self, other):
+        for name, (q, h) in self.signals.items():
+            if name in other.signals:
+                q.merge(other.signals[name][0])
+                h.merge(other.signals[name][1])
+        return self
+
+    def subtract(self, other):
+        for name, (q, h) in self.signals.items():
+            if name in other.signals:
+                q.subtract(other.signals[name][0])
+                h.subtract(other.signals[name][1])
+        return self
+
+    def summary(self):
+        """Per signal: n, mean, std, p5 / median / p95 and the histogram."""
+        out = {}
+        for name, (q, h) in self.signals.items():
+            s = {'n': q.count, 'mean': q.mean(), 'std': q.std()}
+            s.update({k: q.quantile(p) for k, p in QUANTILES.items()})
+            s['histogram'] = h.to_dict()
+            out[name] = s
+        return out
+
+    def to_dict(self):
+        return {name: {'quantiles': q.to_dict(), 'histogram': h.to_dict()} for name, (q, h) in self.signals.items()}
+
+    @classmethod
+    def from_dict(cls, d):
+        # signals missing from older stored sketches stay empty
+        sk = cls(alpha=next(iter(d.values()))['quantiles']['alpha'] if d else 0.01)
+        sk.signals.update({name: (QuantileSketch.from_dict(v['quantiles']), Histogram.from_dict(v['histogram']))
+                           for name, v in d.items()})
+        return sk
+
+def merge_sketches(dicts):
+    """RecordingSketches merged from stored to_dict() forms (None entries skipped)."""
+    out = RecordingSketches()
+    for d in dicts:
+        if d:
+            out.merge(RecordingSketches.from_dict(d))
+    return out
+
+def knee_quantiles(sketches):
+    """Flat knee-angle quantile metrics of a RecordingSketches."""
+    q = sketches.signals['knee_angle_deg'][0]
+    return {f"{k}_knee_angle_deg": q.quantile(p) for k, p in QUANTILES.items()}
@@ -0,0 +1,224 @@
+# src/spectral.py
+import numpy as np
+
+# Frequency bands (Hz). Locomotor band holds the stride fundamental; the freeze
+# band captures the 3-8 Hz trembling of freezing of gait (Moore et al. 2008).
+LOCO_BAND = (0.5, 3.0)
+FREEZE_BAND = (3.0, 8.0)
+# below this the freeze band is cut off (and aliased) by the Nyquist limit:
+# the freeze index is not computed and freezing is never reported
+MIN_FREEZE_RATE_HZ = 2 * FREEZE_BAND[1]
+
+def resolves_freeze_band(sampling_rate):
+    return sampling_rate >= MIN_FREEZE_RATE_HZ
+
+def _band_mask(freqs, band):
+    return (freqs >= band[0]) & (freqs < band[1])
+
+def spectral_features(power, freqs, sampling_rate, n_harmonics=10, freeze_threshold=2.0, min_power=1e-3):
+    """
+    Gait features from a batch of power spectra.
+    power: array (F, n_freqs, C) - F frames, C channels
+    freqs: array (n_freqs,) - rfft bin frequencies
+    Returns dict of (F, C) arrays:
+      stride_freq_hz  - dominant frequency inside LOCO_BAND
+      harmonic_ratio  - sum of even / sum of odd harmonic amplitudes of the
+                        dominant frequency (higher = more regular gait)
+      freeze_index    - FREEZE_BAND power / LOCO_BAND power (NaN below
+                        MIN_FREEZE_RATE_HZ)
+      freezing        - freeze_index above threshold while there is enough
+                        movement power to rule out standing still
+    """
+    F, n_freqs, C = power.shape
+    df = freqs[1] - freqs[0] if n_freqs > 1 else 1.0
+    loco = _band_mask(freqs, LOCO_BAND)
+    frz = _band_mask(freqs, FREEZE_BAND)
+
+    loco_power = power[:, loco, :].sum(axis=1)
+    freeze_power = power[:, frz, :].sum(axis=1)
+
+    if loco.any():
+        loco_idx = np.flatnonzero(loco)
+        dom = loco_idx[np.argmax(power[:, loco, :], axis=1)]  # (F, C)
+    else:
+        dom = np.zeros((F, C), dtype=np.int64)
+    stride_freq = freqs[dom]
+
+    # amplitudes at k * f0 for k = 1..n_harmonics, gathered in one shot
+    k = np.arange(1, n_harmonics + 1)
+    h_idx = dom[:, None, :] * k[None, :, None]  # (F, H, C)
+    in_range = (h_idx < n_freqs) & (dom[:, None, :] > 0)
+    amp = np.sqrt(np.take_along_axis(power, np.minimum(h_idx, n_freqs - 1), axis=1))
+    amp = np.where(in_range, amp, 0.0)
+    even = amp[:, 1::2, :].sum(axis=1)
+    odd = amp[:, 0::2, :].sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        harmonic_ratio = np.where(odd > 0, even / odd, np.nan)
+        if frz.any() and resolves_freeze_band(sampling_rate):
+            freeze_index = np.where(loco_power > 0, freeze_power / loco_power, np.nan)
+        else:
+            freeze_index = np.full((F, C), np.nan)
+
+    moving = (loco_power + freeze_power) * df > min_power
+    freezing = moving & (freeze_index > freeze_threshold)
+    return {
+        'stride_freq_hz': stride_freq,
+        'harmonic_ratio': harmonic_ratio,
+        'freeze_index': freeze_index,
+        'freezing': freezing,
+    }
+
+def _prepare_frames(frames, taper):
+    # frames: (..., window, C); remove DC, fill gaps with the mean, apply taper
+    mean = np.nanmean(frames, axis=-2, keepdims=True)
+    mean = np.where(np.isfinite(mean), mean, 0.0)
+    frames = np.where(np.isfinite(frames), frames - mean, 0.0)
+    return frames * taper
+
+def stft_features(signals, sampling_rate=10.0, window_s=4.0, hop_s=0.5, **feature_kwargs):
+    """
+    Offline sliding-window spectral analysis.
+    signals: array (N, C) or (N,) - e.g. IMU2 gyro norm and knee angle columns
+    Frames are strided views of the input, transformed with one batched rfft
+    over all frames and channels.
+    Returns dict with 'times' (frame end times, s) and the feature arrays
+    from spectral_features, each of shape (F, C).
+    """
+    x = np.asarray(signals)
+    if x.dtype != np.float32:
+        x = x.astype(float)
+    if x.ndim == 1:
+        x = x[:, None]
+    window = max(2, int(round(window_s * sampling_rate)))
+    hop = max(1, int(round(hop_s * sampling_rate)))
+    freqs = np.fft.rfftfreq(window, d=1.0 / sampling_rate)
+    if x.shape[0] < window:
+        C = x.shape[1]
+        empty = np.zeros((0, C))
+        return {'times': np.zeros(0), 'stride_freq_hz': empty, 'harmonic_ratio': empty,
+                'freeze_index': empty, 'freezing': empty.astype(bool)}
+
+    frames = np.lib.stride_tricks.sliding_window_view(x, window, axis=0)[::hop]  # (F, C, window)
+    frames = np.swapaxes(frames, 1, 2)  # (F, window, C)
+    taper = np.hanning(window)[:, None]
+    power = np.abs(np.fft.rfft(_prepare_frames(frames, taper), axis=1)) ** 2
+    feats = spectral_features(power, freqs, sampling_rate, **feature_kwargs)
+    feats['times'] = (np.arange(power.shape[0]) * hop + window) / sampling_rate
+    return feats
+
+def _episodes(times, flags, hop_s):
+    # collapse per-frame freezing flags into [start, end] time intervals
+    episodes = []
+    start = None
+    for t, f in zip(times, flags):
+        if f and start is None:
+            start = t - hop_s
+        elif not f and start is not None:
+            episodes.append([float(start), float(t - hop_s)])
+            start = None
+    if start is not None:
+        episodes.append([float(start), float(times[-1])])
+    return episodes
+
+def spectral_summary(gyro_norms, angles, sampling_rate=10.0, window_s=4.0, hop_s=0.5, **feature_kwargs):
+    """
+    JSON-friendly offline summary for a recording.
+    gyro_norms: (N,) IMU2 gyro norm; angles: (N,) knee angle (None allowed)
+    Freezing is judged on the gyro channel; below MIN_FREEZE_RATE_HZ there
+    is no freeze index and freezing_fraction is None.
+    """
+    gyro_norms = np.asarray(gyro_norms)
+    dtype = np.float32 if gyro_norms.dtype == np.float32 else float
+    ang = np.array([np.nan if a is None else a for a in angles], dtype=dtype)
+    feats = stft_features(np.column_stack([gyro_norms.astype(dtype, copy=False), ang]),
+                          sampling_rate=sampling_rate, window_s=window_s, hop_s=hop_s,
+                          **feature_kwargs)
+
+    def col(name, c):
+        return [None if not np.isfinite(v) else float(v) for v in feats[name][:, c]]
+
+    freezing = feats['freezing'][:, 0]
+    return {
+        'frame_times_s': feats['times'].tolist(),
+        'gyro_stride_freq_hz': col('stride_freq_hz', 0),
+        'gyro_harmonic_ratio': col('harmonic_ratio', 0),
+        'gyro_freeze_index': col('freeze_index', 0),
+        'knee_stride_freq_hz': col('stride_freq_hz', 1),
+        'knee_harmonic_ratio': col('harmonic_ratio', 1),
+        'freezing_fraction': (None if not resolves_freeze_band(sampling_rate)
+                              else float(freezing.mean()) if len(freezing) else 0.0),
+        'freeze_episodes_s': _episodes(feats['times'], freezing, hop_s),
+    }
+
+class StreamingSTFT:
+    """
+    Incremental short-time spectral analysis for live use.
+    Samples go into a fixed (window, C) ring buffer; every `hop` samples the
+    ring is unrolled into a preallocated frame and one rfft over all channels
+    is computed, so each hop costs O(window log window) regardless of
+    session length.
+    """
+    def __init__(self, sampling_rate=10.0, window_s=4.0, hop_s=0.5, n_channels=2, **feature_kwargs):
+        self.sampling_rate = sampling_rate
+        self.window = max(2, int(round(window_s * sampling_rate)))
+        self.hop = max(1, int(round(hop_s * sampling_rate)))
+        self.freqs = np.fft.rfftfreq(self.window, d=1.0 / sampling_rate)
+        self.taper = np.hanning(self.window)[:, None]
+        self.feature_kwargs = feature_kwargs
+
+        self._ring = np.zeros((self.window, n_channels))
+        self._frame = np.empty((self.window, n_channels))
+        self._pos = 0
+        self._count = 0
+        self._since_hop = 0
+
+    def push(self, sample):
+        """
+        Add one sample (sequence of n_channels values, NaN allowed).
+        Returns a feature dict (per-channel arrays of shape (C,)) when a new
+        hop completes, else None.
+        """
+        self._ring[self._pos] = sample
+        self._pos = (self._pos + 1) % self.window
+        self._count += 1
+        self._since_hop += 1
+        if self._count < self.window or self._since_hop < self.hop:
+            return None
+        self._since_hop = 0
+        return self._analyze()
+
+    def _analyze(self):
+        k = self.window - self._pos
+        self._frame[:k] = self._ring[self._pos:]
+        self._frame[k:] = self._ring[:self._pos]
+        power = np.abs(np.fft.rfft(_prepare_frames(self._frame, self.taper), axis=0)) ** 2
+        feats = spectral_features(power[None], self.freqs, self.sampling_rate, **self.feature_kwargs)
+        out = {name: v[0] for name, v in feats.items()}
+        out['t'] = self._count / self.sampling_rate
+        return out
+
+class FreezeMonitor:
+    """
+    Live freezing-of-gait on/off events from a StreamingSTFT over
+    (IMU2 gyro norm, knee angle). push() returns a message when the
+    freezing state changes, else None. Below MIN_FREEZE_RATE_HZ the monitor
+    is off and freezing stays None (unknown).
+    """
+    def __init__(self, sampling_rate=10.0, **stft_kwargs):
+        self.stft = StreamingSTFT(sampling_rate=sampling_rate, n_channels=2, **stft_kwargs)
+        self.freezing = False
+        if not resolves_freeze_band(sampling_rate):
+            print(f"WARNING: freezing-of-gait detection needs >= {MIN_FREEZE_RATE_HZ:g} Hz "
+                  f"(sampling at {sampling_rate:g} Hz); disabled")
+            self.freezing = None
+
+    def push(self, gyro_norm, knee_angle):
+        if self.freezing is None:
+            return None
+        feats = self.stft.push((gyro_norm, float('nan') if knee_angle is None else knee_angle))
+        if feats is None or bool(feats['freezing'][0]) == self.freezing:
+            return None
+        self.freezing = not self.freezing
+        state = "detected" if self.freezing else "ended"
+        return (f"[FOG] Freezing of gait {state} at t={feats['t']:.1f}s "
+                f"(freeze index {feats['freeze_index'][0]:.2f})")
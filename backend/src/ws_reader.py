@@ -1,7 +1,6 @@
 # src/ws_reader.py
-import json
 import time
-from websocket import create_connection, WebSocketConnectionClosedException
+from packets import PacketDecoder
 
 class IMUWebSocketReader:
     def __init__(self, esp_ip, port=81, timeout=5):
@@ -10,8 +9,11 @@ class IMUWebSocketReader:
         self.url = f"ws://{esp_ip}:{port}"
         self.ws = None
         self.timeout = timeout
+        self.decoder = PacketDecoder()
 
     def connect(self):
+        # websocket-client is imported on first connect, not at module import
+        from websocket import create_connection
         try:
             self.ws = create_connection(self.url, timeout=self.timeout)
             print(f"[OK] Connected to {self.url}")
@@ -23,9 +25,10 @@ class IMUWebSocketReader:
     def read_packet(self):
         if self.ws is None:
             return None
+        from websocket import WebSocketConnectionClosedException
         try:
             raw = self.ws.recv()
-            return json.loads(raw)
+            return self.decoder.decode_packet(raw)
         except WebSocketConnectionClosedException:
             print("[ERROR] Connection closed by remote.")
             self.ws = None
@@ -37,6 +40,26 @@ class IMUWebSocketReader:
 
             return None
 
+    def read_row(self, out):
+        """
+        Receive one message and decode it straight into `out` (a ROW_WIDTH
+        float row, e.g. a shared-memory ring slot) without building dicts.
+        Returns True if a sample was written.
+        """
+        if self.ws is None:
+            return False
+        from websocket import WebSocketConnectionClosedException
+        try:
+            raw = self.ws.recv()
+        except WebSocketConnectionClosedException:
+            print("[ERROR] Connection closed by remote.")
+            self.ws = None
+            return False
+        except Exception as e:
+            print("WARNING: read error:", e)
+            return False
+        return self.decoder.decode_into(raw, out)
+
     def close(self):
         if self.ws:
             try:
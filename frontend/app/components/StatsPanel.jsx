@@ -1,13 +1,31 @@
 'use client'
+import { useEffect, useState } from 'react'
 import { PieChart, Pie, Cell, BarChart, Bar, XAxis, YAxis, Tooltip, ResponsiveContainer } from 'recharts'
+import { fetchCohortStats } from '@/lib/api'
 
 const COLORS = ['#4f46e5', '#10b981', '#f59e0b']
 
+// client-side fallback when the stats endpoint is unreachable (mock data)
+function localStats(patients) {
+    return {
+        total_patients: patients.length,
+        by_status: patients.reduce((acc, p) => { acc[p.status] = (acc[p.status] || 0) + 1; return acc }, {}),
+        by_age_bucket: { '<30': patients.filter(p => p.age < 30).length, '30-50': patients.filter(p => p.age >= 30 && p.age <= 50).length, '>50': patients.filter(p => p.age > 50).length },
+    }
+}
+
 export default function StatsPanel({ patients }) {
-    const total = patients.length
-    const byStatus = patients.reduce((acc, p) => { acc[p.status] = (acc[p.status] || 0) + 1; return acc }, {})
-    const pieData = Object.entries(byStatus).map(([k, v]) => ({ name: k, value: v }))
-    const ageBuckets = [{ bucket: '<30', v: patients.filter(p => p.age < 30).length }, { bucket: '30-50', v: patients.filter(p => p.age >= 30 && p.age <= 50).length }, { bucket: '>50', v: patients.filter(p => p.age > 50).length }]
+    const [stats, setStats] = useState(null)
+
+    // the server keeps these aggregates up to date; refetch when the list changes
+    useEffect(() => {
+        fetchCohortStats().then(setStats).catch(() => setStats(null))
+    }, [patients])
+
+    const s = stats || localStats(patients)
+    const total = s.total_patients
+    const pieData = Object.entries(s.by_status).map(([k, v]) => ({ name: k, value: v }))
+    const ageBuckets = ['<30', '30-50', '>50'].map(bucket => ({ bucket, v: s.by_age_bucket[bucket] || 0 }))
 
     return (
         <div className="grid grid-cols-3 gap-4">
@@ -53,6 +53,16 @@ export async function deletePatient(id) {
     }
 }
 
+// server-side aggregates (cohort counts by status / age bucket, per-patient trends)
+export async function fetchCohortStats() {
+    return await safeGet('/stats/cohort')
+}
+
+export async function fetchPatientTrends(id, metrics) {
+    const q = metrics ? `?metrics=${metrics.join(',')}` : ''
+    return await safeGet(`/patients/${id}/trends${q}`)
+}
+
 export async function fetchRecording(id) {
   const res = await api.get(`/recordings/${id}`)
   return res.data